@@ -0,0 +1,91 @@
+"""
+Throughput of the master list import pipeline in rows per second.
+
+Reads the master list once, optionally repeats it up to --rows rows (with
+unique lab numbers) and imports it into a scratch database
+(BENCH_DATABASE, default patients_bench, dropped and recreated for each
+run) for each --chunk-size.
+
+    python benchmarks/import_benchmark.py --rows 100000 --chunk-size 100 1000 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+import pandas as pd
+from database_setup import MASTER_LIST_FILE, PATIENTS_TABLE_DDL
+from db_utils import DatabaseManager
+from migrations import apply_migrations
+from patient_import import prepare_patients, import_patients
+
+
+def scale_patients(patients, rows):
+    """Repeat the prepared rows until there are `rows` of them, keeping lab numbers unique"""
+    if not rows or rows <= len(patients):
+        return patients.head(rows) if rows else patients
+    copies = []
+    for copy in range(-(-rows // len(patients))):
+        batch = patients.copy()
+        batch['lab_number'] = batch['lab_number'].map(lambda lab: f"{lab}-{copy}" if lab else lab)
+        batch['im_lab_number'] = batch['im_lab_number'].map(lambda lab: f"{lab}-{copy}" if lab else lab)
+        copies.append(batch)
+    return pd.concat(copies, ignore_index=True).head(rows)
+
+
+def reset_database(conn, database):
+    """
+    Switch conn to an empty scratch database. Recreating it drops every table
+    the last run's migrations made, whatever foreign keys point at patients.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {database}")
+    cursor.execute(f"CREATE DATABASE {database}")
+    cursor.close()
+    conn.database = database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=MASTER_LIST_FILE)
+    parser.add_argument('--rows', type=int, default=0, help='scale the sheet to this many rows')
+    parser.add_argument('--chunk-size', type=int, nargs='+', default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    source = pd.read_excel(args.file, header=1)
+    read_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    patients, _, _ = prepare_patients(source)
+    prepare_time = time.perf_counter() - started
+    print(f"read_excel: {read_time:.2f}s, prepare: {prepare_time:.3f}s "
+          f"({len(source) / prepare_time if prepare_time else 0:,.0f} sheet rows/s)")
+
+    patients = scale_patients(patients, args.rows)
+    database = os.getenv('BENCH_DATABASE', 'patients_bench')
+    server_config = {k: v for k, v in DatabaseManager().config.items() if k != 'database'}
+    conn = mysql.connector.connect(**server_config)
+
+    print(f"{'chunk size':>10} {'rows':>10} {'seconds':>9} {'rows/s':>10}")
+    try:
+        for chunk_size in args.chunk_size:
+            reset_database(conn, database)
+            cursor = conn.cursor()
+            cursor.execute(PATIENTS_TABLE_DDL)
+            cursor.close()
+            apply_migrations(conn)
+
+            started = time.perf_counter()
+            imported, _ = import_patients(conn, patients, chunk_size)
+            elapsed = time.perf_counter() - started
+            print(f"{chunk_size:>10} {len(imported):>10} {elapsed:>9.2f} {len(imported) / elapsed:>10,.0f}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
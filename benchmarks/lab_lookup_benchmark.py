@@ -0,0 +1,116 @@
+"""
+Point-lookup latency for patients by lab number / IM lab number.
+
+Builds a scratch database (BENCH_DATABASE, default patients_bench, dropped
+and recreated for each size) with 10k, 100k and 1M synthetic patients and
+times the indexed lab_key lookup used by DatabaseManager against the old OR
+scan on the raw columns.
+
+    python benchmarks/lab_lookup_benchmark.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+from database_setup import PATIENTS_TABLE_DDL
+from db_utils import DatabaseManager, normalize_lab_number
+from migrations import apply_migrations
+
+INDEXED_QUERY = "SELECT * FROM patients WHERE lab_key = %s OR im_lab_key = %s"
+LEGACY_QUERY = "SELECT * FROM patients WHERE lab_number = %s OR im_lab_number = %s"
+
+
+def synthetic_patient(i):
+    return (
+        '2024-02-05', f"24IG{i:06d}", f"IM{i}", f"PATIENT {i}", f"A{i:07d}",
+        '1990-01-01', random.choice(['M', 'F']), str(random.randint(1, 90)), 'Chinese',
+        '2024-02-01', '2024-02-02', 'Synthetic case', 'SuperPanel', random.choice('ACIN')
+    )
+
+
+def reset_database(conn, database):
+    """
+    Switch conn to an empty scratch database. Recreating it drops every table
+    the last run's migrations made, whatever foreign keys point at patients.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS {database}")
+    cursor.execute(f"CREATE DATABASE {database}")
+    cursor.close()
+    conn.database = database
+
+
+def build_table(conn, size, chunk_size=5000):
+    cursor = conn.cursor()
+    cursor.execute(PATIENTS_TABLE_DDL)
+    insert = """
+        INSERT INTO patients (
+            report_date, lab_number, im_lab_number, name,
+            hkid, dob, sex, age, ethnicity,
+            specimen_collected, specimen_arrived, case_history,
+            type_of_test, type_of_findings
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    for start in range(0, size, chunk_size):
+        rows = [synthetic_patient(i) for i in range(start, min(start + chunk_size, size))]
+        cursor.executemany(insert, rows)
+        conn.commit()
+    started = time.perf_counter()
+    apply_migrations(conn)
+    cursor.close()
+    return time.perf_counter() - started
+
+
+def time_lookups(conn, query, keys):
+    cursor = conn.cursor()
+    timings = []
+    for key in keys:
+        started = time.perf_counter()
+        cursor.execute(query, (key, key))
+        cursor.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    cursor.close()
+    timings.sort()
+    return {
+        'p50': statistics.median(timings),
+        'p95': timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1],
+        'mean': statistics.mean(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--lookups', type=int, default=1000, help='indexed lookups per size')
+    parser.add_argument('--legacy-lookups', type=int, default=20, help='full-scan lookups per size')
+    args = parser.parse_args()
+
+    db = DatabaseManager()
+    database = os.getenv('BENCH_DATABASE', 'patients_bench')
+    server_config = {k: v for k, v in db.config.items() if k != 'database'}
+    conn = mysql.connector.connect(**server_config)
+
+    print(f"{'patients':>10} {'query':>8} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+    try:
+        for size in args.sizes:
+            reset_database(conn, database)
+            migration_time = build_table(conn, size)
+            sample = [f"24IG{random.randrange(size):06d}" if n % 2 else f"IM{random.randrange(size)}"
+                      for n in range(args.lookups)]
+            indexed = time_lookups(conn, INDEXED_QUERY, [normalize_lab_number(k) for k in sample])
+            legacy = time_lookups(conn, LEGACY_QUERY, sample[:args.legacy_lookups])
+            for name, result in (('indexed', indexed), ('legacy', legacy)):
+                print(f"{size:>10} {name:>8} {result['p50']:>9.3f} {result['p95']:>9.3f} {result['mean']:>9.3f}")
+            print(f"{size:>10} migration took {migration_time:.1f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
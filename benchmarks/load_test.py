@@ -0,0 +1,227 @@
+"""
+Load test: throughput of the production server (gunicorn with
+gunicorn.conf.py and wsgi.py) as the number of worker processes grows.
+
+Loads a synthetic master list of --patients rows (synthetic_data.py) into a
+scratch database, a SQLite file unless DB_BACKEND=mysql (then the MySQL
+database BENCH_DATABASE, default patients_bench). Then for each --workers
+count it starts gunicorn on a free local port, waits until every worker
+answers /health/ready, warms the workers up and has --clients client
+processes send a mix of read requests (patient table pages, typeahead,
+patient lookups) for --duration seconds over keep-alive connections.
+
+Prints requests per second, the speedup over the first worker count,
+latency percentiles and errors per run. Worker processes only add
+throughput up to the number of CPUs, and the clients need cores too: run
+on a machine with more CPUs than the largest worker count.
+
+    python benchmarks/load_test.py --workers 1 2 4 8 --threads 4 --clients 16
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_data
+from suite import percentile
+
+ROOT = synthetic_data.ROOT
+
+
+def request_paths(patients, count, seed):
+    """The request mix: patient table pages, typeahead prefixes and patient lookups"""
+    rng = random.Random(seed)
+    pages = [
+        '/get_patients?limit=50',
+        '/get_patients?limit=50&sort=report_date&order=desc',
+        '/get_patients?limit=50&type_of_test=SuperPanel',
+    ]
+    paths = []
+    for n in range(count):
+        i = rng.randrange(patients)
+        kind = n % 4
+        if kind == 0:
+            paths.append(pages[n // 4 % len(pages)])
+        elif kind == 1:
+            paths.append(f'/search/typeahead?q={synthetic_data.im_lab_number(i)[:4]}')
+        elif kind == 2:
+            paths.append(f'/view_patient/{synthetic_data.lab_number(i)}')
+        else:
+            paths.append(f'/search/typeahead?q={synthetic_data.lab_number(i)[:6]}')
+    return paths
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(patients, data_dir, seed, work_dir):
+    """Load the synthetic master list into the scratch database, returns its name or file"""
+    from database_setup import initialize_database
+
+    paths, _ = synthetic_data.generate(data_dir, patients, seed)
+    if os.environ['DB_BACKEND'] == 'sqlite':
+        database = os.path.join(work_dir, 'patients_bench.db')
+    else:
+        database = os.getenv('BENCH_DATABASE', 'patients_bench')
+    # initialize_database() reports progress on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not initialize_database(paths['master_list'], database=database):
+            raise RuntimeError("initialize_database() failed, see the log above")
+    return database
+
+
+def start_server(workers, threads, port, database, work_dir):
+    env = dict(os.environ, WEB_WORKERS=str(workers), WEB_THREADS=str(threads), WEB_BIND=f'127.0.0.1:{port}')
+    env['SQLITE_PATH' if env['DB_BACKEND'] == 'sqlite' else 'MYSQL_DATABASE'] = database
+    for name, path in (('WORKBOOK_CACHE_DIR', 'workbook_cache'), ('REPORT_STORE_DIR', 'report_store'),
+                       ('JOB_DB_PATH', 'jobs.sqlite3'), ('GENOME_INDEX_PATH', 'genome_index.pkl')):
+        env[name] = os.path.join(work_dir, path)
+    log = open(os.path.join(work_dir, f'gunicorn-{workers}.log'), 'w')
+    return subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT), log.name
+
+
+def wait_ready(url, workers, timeout):
+    """Wait until /health/ready has answered from `workers` distinct processes"""
+    parts = urlsplit(url)
+    seen = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            conn.request('GET', '/health/ready')
+            response = conn.getresponse()
+            body = json.loads(response.read())
+            conn.close()
+            if response.status == 200:
+                seen.add(body['pid'])
+                if len(seen) >= workers:
+                    return
+        except (OSError, ValueError, http.client.HTTPException):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{len(seen)} of {workers} workers ready after {timeout}s")
+
+
+def client(url, paths, start_at, stop_at):
+    """One client process: requests paths in a loop until stop_at, returns (latencies in ms, errors)"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    timings = []
+    errors = 0
+    time.sleep(max(start_at - time.time(), 0))
+    n = 0
+    while time.time() < stop_at:
+        path = paths[n % len(paths)]
+        n += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            body = response.read()
+            if response.status >= 400 or json.loads(body).get('success') is False:
+                errors += 1
+        except (OSError, ValueError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+            continue
+        timings.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    return timings, errors
+
+
+def drive(url, paths, clients, duration):
+    """Run the clients for duration seconds, returns (requests per second, sorted latencies, errors)"""
+    # Each client starts at a different point of the mix
+    start_at = time.time() + 1
+    with ProcessPoolExecutor(clients) as pool:
+        futures = [pool.submit(client, url, paths[n::clients] or paths, start_at, start_at + duration)
+                   for n in range(clients)]
+        results = [future.result() for future in futures]
+    timings = sorted(timing for client_timings, _ in results for timing in client_timings)
+    return len(timings) / duration, timings, sum(errors for _, errors in results)
+
+
+def run(args):
+    os.environ.setdefault('DB_BACKEND', 'sqlite')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    work_dir = tempfile.mkdtemp(prefix='load-')
+    print(f"loading {args.patients} synthetic patients into a scratch {os.environ['DB_BACKEND']} database...")
+    database = prepare_database(args.patients, args.data_dir, args.seed, work_dir)
+    paths = request_paths(args.patients, 2000, args.seed)
+
+    cpus = os.cpu_count()
+    print(f"{cpus} CPUs, {args.threads} threads per worker, {args.clients} clients, {args.duration}s per run")
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    runs = []
+    for workers in args.workers:
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        server, log = start_server(workers, args.threads, port, database, work_dir)
+        try:
+            wait_ready(url, workers, args.ready_timeout)
+            drive(url, paths, args.clients, args.warmup)
+            rps, timings, errors = drive(url, paths, args.clients, args.duration)
+        except Exception as e:
+            print(f"{workers:>8} failed: {e} (server log: {log})")
+            continue
+        finally:
+            server.terminate()
+            server.wait(60)
+        speedup = rps / runs[0]['requests_per_second'] if runs else 1.0
+        result = {
+            'workers': workers, 'threads': args.threads, 'clients': args.clients,
+            'requests': len(timings), 'errors': errors, 'requests_per_second': round(rps, 1),
+            'speedup': round(speedup, 2),
+            'p50_ms': round(percentile(timings, 0.5), 3) if timings else None,
+            'p95_ms': round(percentile(timings, 0.95), 3) if timings else None,
+            'p99_ms': round(percentile(timings, 0.99), 3) if timings else None,
+        }
+        runs.append(result)
+        note = '  (more workers than CPUs)' if workers > cpus else ''
+        print(f"{workers:>8} {rps:>10.1f} {speedup:>7.2f}x {result['p50_ms'] or 0:>9.2f} {result['p95_ms'] or 0:>9.2f} "
+              f"{result['p99_ms'] or 0:>9.2f} {errors:>7}{note}")
+    return {'cpus': cpus, 'patients': args.patients, 'backend': os.environ['DB_BACKEND'],
+            'duration': args.duration, 'runs': runs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker process counts to compare')
+    parser.add_argument('--threads', type=int, default=4, help='request threads per worker')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent client processes')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per worker count')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of untimed load before each run')
+    parser.add_argument('--patients', type=int, default=10000, help='synthetic patients in the database')
+    parser.add_argument('--data-dir', default=os.path.join(ROOT, 'benchmarks', 'data'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ready-timeout', type=float, default=120, help='seconds to wait for the workers to start')
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Report documents per second: the python-docx builder against the compiled
+template (reports.get_report_template()). Documents are written to memory
+so disk speed doesn't count.
+
+    python benchmarks/report_benchmark.py --count 500
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reports import build_document, get_report_template, report_fields
+
+SAMPLE_PATIENT = {
+    'report_date': '2024-09-17',
+    'im_lab_number': 'IM599',
+    'lab_number': '24IG001789',
+    'name': 'CHAN TAI MAN',
+    'hkid': 'A123456(7)',
+    'dob': '2019-05-02',
+    'sex': 'M',
+    'age': '5',
+    'ethnicity': 'Chinese',
+    'specimen_collected': '2024-08-01',
+    'specimen_arrived': '2024-08-02',
+    'clinical_history': 'Recurrent infections, low IgG',
+    'type_of_test': 'trio',
+    'test_type': 'trio',
+}
+
+SAMPLE_SUMMARY = "One likely Pathogenic variant was detected in the BTK gene."
+
+
+def run(label, render, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        render()
+    elapsed = time.perf_counter() - started
+    print(f"{label:>10} {count:>8} {elapsed:>9.2f} {count / elapsed:>10,.0f}")
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=200, help='documents per method')
+    args = parser.parse_args()
+
+    fields = report_fields(SAMPLE_PATIENT, SAMPLE_SUMMARY)
+
+    def builder():
+        build_document(fields).save(io.BytesIO())
+
+    started = time.perf_counter()
+    template = get_report_template()
+    print(f"template compiled in {time.perf_counter() - started:.3f}s")
+
+    print(f"{'method':>10} {'docs':>8} {'seconds':>9} {'docs/s':>10}")
+    builder_rate = run('builder', builder, args.count)
+    template_rate = run('template', lambda: template.render(fields), args.count)
+    print(f"template is {template_rate / builder_rate:.1f}x faster")
+
+
+if __name__ == '__main__':
+    main()
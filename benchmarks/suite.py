@@ -0,0 +1,408 @@
+"""
+Benchmark suite: the import, search, upload and report paths at 1k, 10k
+and 100k patients / variants, written to a JSON report that can be
+compared between runs.
+
+Synthetic data comes from synthetic_data.py and is kept in --data-dir, so
+later runs only pay for generating it once. Every scale runs:
+
+    import.read_excel, import.prepare      master list -> patients rows
+    search.build, search.lookup,
+    search.typeahead                       PatientIndex / PatientSearchIndex
+    upload.read, upload.prepare            variant workbook -> table rows
+    report.summary, report.render          findings summary, DOCX rendering
+
+and the same paths end to end through the app, on a scratch database
+named BENCH_DATABASE (default patients_bench). --backend sqlite (the
+default) runs them in-process on a SQLite file; --backend mysql needs a
+reachable server (MYSQL_HOST / MYSQL_USER / MYSQL_PASSWORD):
+
+    db.initialize_database                 database_setup.initialize_database()
+    http.get_patients, http.search,
+    http.typeahead, http.upload_file       Flask test client
+
+Steps that can't run are recorded as skipped with the reason. Latency
+steps report p50 / p95 / max in milliseconds, the others seconds and
+rows per second.
+
+    python benchmarks/suite.py --scales 1000 10000 100000 --output bench.json
+    python benchmarks/suite.py --compare baseline.json bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+import synthetic_data
+
+ROOT = synthetic_data.ROOT
+
+# Bump when steps are added, removed or measure something different
+REPORT_VERSION = 1
+
+# Columns process_file_data() reads from an upload
+UPLOAD_COLUMNS = [
+    'Reportable Variant', 'Chr:Pos', 'IGV review ( True / False call)',
+    'Second review and comment on reportable variant', 'Gene Names',
+    'HGVS c. (Clinically Relevant)', 'HGVS p. (Clinically Relevant)',
+    'Exon Number (Clinically Relevant)', 'Zygosity', 'Inheritance', 'Classification',
+    'OMIM ID', 'RSID', 'Title'
+]
+
+# A step is a regression when its p50 (or seconds) grows by more than this
+REGRESSION_THRESHOLD = 0.2
+
+# ... and by more than this many milliseconds, so sub-microsecond lookups don't flap
+MIN_REGRESSION_MS = 0.05
+
+
+def percentile(sorted_values, quantile):
+    """Nearest rank, like metrics.Summary"""
+    return sorted_values[max(math.ceil(quantile * len(sorted_values)) - 1, 0)]
+
+
+def timed(step, scale, func, rows=None):
+    """Run func() once, returns (result entry, func's return value)"""
+    started = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - started
+    entry = {'step': step, 'scale': scale, 'status': 'ok', 'seconds': round(seconds, 6)}
+    if rows is not None:
+        count = rows(value) if callable(rows) else rows
+        entry.update(rows=count, rows_per_second=round(count / seconds, 1) if seconds else None)
+    return entry, value
+
+
+def latencies(step, scale, func, args):
+    """Call func(arg) for each arg, returns the result entry with latency percentiles"""
+    timings = []
+    for arg in args:
+        started = time.perf_counter()
+        func(arg)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'step': step, 'scale': scale, 'status': 'ok', 'calls': len(timings),
+        'seconds': round(sum(timings) / 1000, 6),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+def skipped(step, scale, reason):
+    return {'step': step, 'scale': scale, 'status': 'skipped', 'reason': reason}
+
+
+def failed(step, scale, error):
+    return {'step': step, 'scale': scale, 'status': 'failed', 'reason': f"{type(error).__name__}: {error}"}
+
+
+def search_terms(rng, patients, count):
+    """Typeahead queries: lab number prefixes and name prefixes of random patients"""
+    terms = []
+    for _ in range(count):
+        patient = patients.iloc[rng.randrange(len(patients))]
+        if rng.random() < 0.5:
+            terms.append(patient['lab_number'][:rng.randint(4, len(patient['lab_number']))])
+        else:
+            terms.append(patient['name'].split()[0][:rng.randint(2, 4)])
+    return terms
+
+
+def run_local(scale, paths, work_dir, calls, rng):
+    """The steps that need no database, returns result entries"""
+    from patient_import import prepare_patients
+    from patient_index import PatientIndex
+    from patient_search import PatientSearchIndex
+    from report_store import ReportStore
+    from reports import build_summary, report_data, store_report
+    from variant_processing import clean_variants, insert_rows
+    from variant_reader import read_variants
+    from variant_store import prepare_variants
+    from workbook_cache import WorkbookCache
+
+    results = []
+    entry, source = timed('import.read_excel', scale, lambda: pd.read_excel(paths['master_list'], header=1), len)
+    results.append(entry)
+    entry, (patients, _, _) = timed('import.prepare', scale, lambda: prepare_patients(source), lambda value: len(value[0]))
+    results.append(entry)
+
+    index = PatientIndex(lambda: patients)
+    search = PatientSearchIndex(lambda: patients)
+    results.append(timed('search.build', scale, lambda: (index.reload(), search.reload()), len(patients))[0])
+    keys = [patients.iloc[rng.randrange(len(patients))][rng.choice(['lab_number', 'im_lab_number'])] for _ in range(calls)]
+    results.append(latencies('search.lookup', scale, index.lookup, keys))
+    results.append(latencies('search.typeahead', scale, search.search, search_terms(rng, patients, calls)))
+
+    for kind in ('superpanel', 'trio'):
+        columns = UPLOAD_COLUMNS + (['Inherited From'] if kind == 'trio' else [])
+        entry, variants = timed(f'upload.read.{kind}', scale, lambda: read_variants(paths[kind], columns), len)
+        results.append(entry)
+
+        def prepare():
+            frame = clean_variants(variants)
+            return insert_rows(frame, columns), prepare_variants(frame, 1, synthetic_data.im_lab_number(0), kind)
+        results.append(timed(f'upload.prepare.{kind}', scale, prepare, len(variants))[0])
+
+        # Cold cache: each run parses the workbook
+        cache = WorkbookCache(cache_dir=tempfile.mkdtemp(dir=work_dir))
+        results.append(timed(f'report.summary.{kind}', scale, lambda: build_summary(paths[kind], cache))[0])
+
+    summary = build_summary(paths['superpanel'], WorkbookCache(cache_dir=tempfile.mkdtemp(dir=work_dir)))
+    store = ReportStore(directory=tempfile.mkdtemp(dir=work_dir))
+    # Distinct patients so every report is rendered rather than found in the store
+    sample = patients.sample(min(calls, len(patients)), random_state=rng.randrange(2 ** 32))
+    reports = [report_data(patient, 'SuperPanel') for patient in sample.to_dict('records')]
+    results.append(latencies('report.render', scale, lambda patient: store_report(store, patient, summary), reports))
+    return results
+
+
+def database_error(backend):
+    """Why the database steps can't run, or None"""
+    if backend == 'sqlite':
+        return None
+    try:
+        import mysql.connector
+        from db_utils import DatabaseManager
+        config = {k: v for k, v in DatabaseManager().config.items() if k != 'database'}
+        mysql.connector.connect(connection_timeout=5, **config).close()
+    except Exception as e:
+        return f"MySQL not reachable: {e}"
+    return None
+
+
+def load_app(database, work_dir):
+    """patient_info pointed at the scratch database, with its caches and uploads under work_dir"""
+    os.environ['SQLITE_PATH' if os.environ['DB_BACKEND'] == 'sqlite' else 'MYSQL_DATABASE'] = database
+    for name, path in (('WORKBOOK_CACHE_DIR', 'workbook_cache'), ('REPORT_STORE_DIR', 'report_store'),
+                       ('JOB_DB_PATH', 'jobs.sqlite3'), ('GENOME_INDEX_PATH', 'genome_index.pkl')):
+        os.environ[name] = os.path.join(work_dir, path)
+    import patient_info
+    patient_info.app.config['UPLOAD_FOLDER'] = os.path.join(work_dir, 'uploads')
+    os.makedirs(patient_info.app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return patient_info
+
+
+def checked(request):
+    """request(arg) that raises when the app answers with an error, so failures don't pass as fast requests"""
+    def call(arg):
+        response = request(arg)
+        body = response.get_json(silent=True) or {}
+        if response.status_code >= 400 or body.get('success') is False:
+            raise RuntimeError(f"{response.status_code}: {body.get('message', response.status)}")
+        return body
+    return call
+
+
+def attempt(results, step, scale, run):
+    """Append run()'s result entry, or a failed entry if it raises"""
+    try:
+        results.append(run())
+    except Exception as e:
+        results.append(failed(step, scale, e))
+
+
+def wait_for_job(patient_info, job_id, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = patient_info.job_queue.get(job_id)
+        if job['status'] in ('succeeded', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"job {job_id} still running after {timeout}s")
+
+
+def run_database(scale, paths, database, work_dir, calls, rng):
+    """The end to end steps against the database, returns result entries"""
+    from database_setup import initialize_database
+
+    results = []
+    patient_info = load_app(database, work_dir)
+    # The previous scale's connections must not outlive its database (SQLite removes the file)
+    patient_info.db.close_pool()
+    # initialize_database() reports progress on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        entry, ok = timed('db.initialize_database', scale,
+                          lambda: initialize_database(paths['master_list'], database=database), scale)
+    if not ok:
+        return results + [failed('db.initialize_database', scale, RuntimeError('initialize_database() returned False'))]
+    results.append(entry)
+
+    patient_info.db.facets.invalidate()
+    patient_info.patient_index.invalidate()
+    patient_info.patient_search.invalidate()
+    client = patient_info.app.test_client()
+
+    queries = [
+        '/get_patients?limit=50',
+        '/get_patients?limit=50&sort=report_date&order=desc',
+        '/get_patients?limit=50&type_of_test=SuperPanel',
+        '/get_patients?limit=50&report_date_from=2024-01-01&report_date_to=2024-06-30',
+        '/get_patients?limit=50&include_filters=1',
+    ]
+    get = checked(client.get)
+    attempt(results, 'http.get_patients', scale, lambda: latencies(
+        'http.get_patients', scale, get, [queries[n % len(queries)] for n in range(calls)]))
+
+    # Warm the indexes so http.search and http.typeahead time lookups, not the first load
+    client.get('/search/typeahead?q=IM1')
+    terms = [synthetic_data.im_lab_number(rng.randrange(min(scale, 900))) for _ in range(calls)]
+    attempt(results, 'http.typeahead', scale, lambda: latencies(
+        'http.typeahead', scale, lambda term: get(f'/search/typeahead?q={term[:4]}'), terms))
+
+    # Uploads first so the reports below have a findings summary to render
+    post = checked(lambda form: client.post(form.pop('url'), data=form, content_type='multipart/form-data'))
+    for kind in ('superpanel', 'trio'):
+        def upload():
+            with open(paths[kind], 'rb') as handle:
+                body = post({'url': '/upload_file', 'file': (handle, os.path.basename(paths[kind])),
+                             'file_type': 'singleton' if kind == 'superpanel' else 'trio'})
+            job = wait_for_job(patient_info, body['job_id'])
+            if job['status'] != 'succeeded':
+                raise RuntimeError(job['message'])
+        attempt(results, f'http.upload_file.{kind}', scale, lambda: timed(f'http.upload_file.{kind}', scale, upload, scale)[0])
+
+    attempt(results, 'http.search', scale, lambda: latencies('http.search', scale, lambda term: post({
+        'url': '/search', 'lab_number': term, 'test_type': 'SuperPanel'}), terms))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_suite(scales, data_dir, database, backend, calls, seed, skip_database):
+    report = {
+        'version': REPORT_VERSION,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': seed,
+        'calls': calls,
+        'backend': backend,
+        'results': [],
+    }
+    db_error = 'disabled with --skip-database' if skip_database else database_error(backend)
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    if backend == 'sqlite':
+        database = os.path.join(work_dir, f'{database}.db')
+    for scale in scales:
+        rng = random.Random(seed)
+        paths, generate_seconds = synthetic_data.generate(data_dir, scale, seed)
+        report['results'].append({'step': 'generate', 'scale': scale, 'status': 'ok',
+                                  'seconds': round(generate_seconds, 6)})
+        try:
+            report['results'].extend(run_local(scale, paths, work_dir, calls, rng))
+        except Exception as e:
+            report['results'].append(failed('local', scale, e))
+        if db_error:
+            report['results'].append(skipped('database', scale, db_error))
+        else:
+            try:
+                report['results'].extend(run_database(scale, paths, database, work_dir, calls, rng))
+            except Exception as e:
+                report['results'].append(failed('database', scale, e))
+        for entry in report['results']:
+            if entry['scale'] == scale:
+                print_entry(entry)
+    report['finished_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    return report
+
+
+def print_entry(entry):
+    if entry['status'] != 'ok':
+        print(f"{entry['scale']:>8} {entry['step']:<28} {entry['status']}: {entry['reason']}")
+    elif 'p50_ms' in entry:
+        print(f"{entry['scale']:>8} {entry['step']:<28} p50 {entry['p50_ms']:>9.3f} ms  p95 {entry['p95_ms']:>9.3f} ms")
+    else:
+        rate = f"  {entry['rows_per_second']:>12,.0f} rows/s" if entry.get('rows_per_second') else ''
+        print(f"{entry['scale']:>8} {entry['step']:<28} {entry['seconds']:>9.3f} s{rate}")
+
+
+def measure(entry):
+    """The number compared between runs, in ms: p50 for latency steps, total time otherwise"""
+    return entry['p50_ms'] if 'p50_ms' in entry else entry['seconds'] * 1000
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Print the change of every step in both reports, returns the (scale, step) pairs that regressed"""
+    if baseline.get('version') != current.get('version'):
+        print(f"warning: report versions differ ({baseline.get('version')} vs {current.get('version')})")
+    if baseline.get('backend') != current.get('backend'):
+        print(f"warning: database backends differ ({baseline.get('backend')} vs {current.get('backend')})")
+    before = {(entry['scale'], entry['step']): entry for entry in baseline['results'] if entry['status'] == 'ok'}
+    regressions = []
+    print(f"{'scale':>8} {'step':<28} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for entry in current['results']:
+        key = (entry['scale'], entry['step'])
+        if entry['status'] != 'ok' or key not in before or entry['step'] == 'generate':
+            continue
+        old, new = measure(before[key]), measure(entry)
+        change = (new - old) / old if old else 0.0
+        flag = ''
+        if change > threshold and new - old > MIN_REGRESSION_MS:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f"{key[0]:>8} {key[1]:<28} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--data-dir', default=os.path.join(ROOT, 'benchmarks', 'data'))
+    parser.add_argument('--calls', type=int, default=200, help='requests / lookups per latency step')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['sqlite', 'mysql'], default=os.getenv('DB_BACKEND', 'sqlite'),
+                        help='database for the end to end steps (default DB_BACKEND, else sqlite)')
+    parser.add_argument('--skip-database', action='store_true', help='only run the steps that need no database')
+    parser.add_argument('--output', help='where to write the JSON report (default bench-<time>.json)')
+    parser.add_argument('--compare', nargs='+', metavar='REPORT',
+                        help='baseline report to compare this run with, or baseline and current to compare without running')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.compare and len(args.compare) > 2:
+        parser.error('--compare takes a baseline report and optionally a current one')
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as baseline, open(args.compare[1]) as current:
+            sys.exit(1 if compare(json.load(baseline), json.load(current), args.threshold) else 0)
+
+    # Read by DatabaseManager and initialize_database()
+    os.environ['DB_BACKEND'] = args.backend
+    database = os.getenv('BENCH_DATABASE', 'patients_bench')
+    report = run_suite(args.scales, args.data_dir, database, args.backend, args.calls, args.seed, args.skip_database)
+    output = args.output or f"bench-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"report written to {output}")
+
+    if args.compare:
+        with open(args.compare[0]) as baseline:
+            sys.exit(1 if compare(json.load(baseline), report, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
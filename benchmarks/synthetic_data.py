@@ -0,0 +1,260 @@
+"""
+Synthetic master lists and variant workbooks for the benchmark suite.
+
+The layout is copied from the real files: the master list gets the two
+header rows of the IM sheet of database_setup.MASTER_LIST_FILE, the variant
+workbooks the rows above and including the header row of the first sheet of
+a SuperPanel / Trio upload in uploads/ (and the coverage sheet's header for
+SuperPanel). Only headers are copied; every patient and variant row is made
+up from a seeded random generator, so the same seed and size give the same
+workbook.
+
+    python benchmarks/synthetic_data.py --rows 1000 10000 100000 --out benchmarks/data
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+import warnings
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+from database_setup import MASTER_LIST_FILE
+from patient_import import SOURCE_COLUMNS
+from variant_reader import REPORTABLE_COLUMN
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATES = {
+    'superpanel': os.path.join(ROOT, 'uploads', '*SuperPanel*.xlsx'),
+    'trio': os.path.join(ROOT, 'uploads', '*Trio*.xlsx'),
+}
+
+# Header rows of the master list when MASTER_LIST_FILE isn't available
+FALLBACK_MASTER_HEADER = [None] * 3 + list(SOURCE_COLUMNS) + ['Sex/Age']
+
+SURNAMES = ['CHAN', 'WONG', 'LEE', 'LAM', 'CHEUNG', 'HO', 'NG', 'LEUNG', 'CHOW', 'TSANG', 'YIP', 'CHIU', 'NGUYEN', 'SMITH']
+GIVEN_NAMES = ['TAI', 'MAN', 'MEI', 'SIU', 'MING', 'WING', 'YAN', 'KA', 'WAI', 'HO', 'YEE', 'LING', 'CHUN', 'KIT', 'JOHN', 'MARY']
+ETHNICITIES = ['Chinese', 'Chinese', 'Chinese', 'Filipino', 'Indonesian', 'Pakistani', 'Caucasian', None]
+TESTS = ['SuperPanel', 'trio', 'single gene', 'family screening']
+FINDINGS = ['A', 'C', 'I', 'N', None]
+GENES = ['MVK', 'BTK', 'ZAP70', 'CYBB', 'WAS', 'IL2RG', 'RAG1', 'RAG2', 'ADA', 'STAT1', 'STAT3', 'IKBKG',
+         'SERPING1', 'BLK', 'TNFRSF13B', 'CTLA4', 'LRBA', 'NFKB1', 'PLCH2', 'RPSA']
+CLASSIFICATIONS = ['Pathogenic', 'Likely pathogenic', 'VUS', 'Likely benign', 'Benign']
+ZYGOSITIES = ['Heterozygous', 'Heterozygous', 'Homozygous', 'Hemizygous']
+CHROMOSOMES = [str(number) for number in range(1, 23)] + ['X']
+
+# Share of master list rows whose dates are notes rather than dates (see date_quarantine)
+DATE_NOTE_RATE = 0.02
+DATE_NOTES = ['results passed to clinician', 'pending', 'see remark']
+
+# Share of variant rows marked reportable
+REPORTABLE_RATE = 0.02
+
+
+def im_lab_number(i):
+    """IM lab number of the i-th synthetic patient, IM100 onwards so the first 900 pass /search's IMxxx check"""
+    return f"IM{100 + i}"
+
+
+def lab_number(i):
+    return f"24IG{i:06d}"
+
+
+def master_list_header(path=os.path.join(ROOT, MASTER_LIST_FILE)):
+    """The two header rows (group labels, column names) of the master list's first sheet"""
+    if not os.path.exists(path):
+        return [None] * len(FALLBACK_MASTER_HEADER), FALLBACK_MASTER_HEADER
+    with warnings.catch_warnings():
+        # The master list's print area names a sheet openpyxl can't resolve
+        warnings.simplefilter('ignore', UserWarning)
+        workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        groups, names = list(workbook.worksheets[0].iter_rows(max_row=2, values_only=True))
+    finally:
+        workbook.close()
+    return list(groups), list(names)
+
+
+def _date(rng, start, days):
+    return datetime(*start) + timedelta(days=rng.randrange(days))
+
+
+def synthetic_patient(rng, i):
+    """Master list column name -> value for the i-th patient"""
+    collected = _date(rng, (2023, 1, 1), 700)
+    reported = collected + timedelta(days=rng.randint(7, 90))
+    born = _date(rng, (1940, 1, 1), 30000)
+    if rng.random() < DATE_NOTE_RATE:
+        reported = rng.choice(DATE_NOTES)
+    sex = rng.choice('MF')
+    name = ' '.join([rng.choice(SURNAMES)] + rng.sample(GIVEN_NAMES, rng.randint(1, 3)))
+    return {
+        'IM Lab. no.': im_lab_number(i),
+        'Lab. no.': lab_number(i),
+        'Sample collection date': collected,
+        'Sample receive date': collected + timedelta(days=rng.randint(0, 3)),
+        'TAT for NGS': rng.randint(7, 90),
+        'HKID': f"{rng.choice('ABCDEGHKMPRSVYZ')}{rng.randrange(10 ** 7):07d}",
+        'Patient name': name,
+        'DOB': born if rng.random() < 0.9 else None,
+        'Sex/Age': f"{sex}/{max(collected.year - born.year, 0)}",
+        'Ethnicity': rng.choice(ETHNICITIES),
+        'Case': f"Suspected {rng.choice(GENES)} deficiency",
+        'Request Dr.': f"Dr {rng.choice(SURNAMES).title()}",
+        'Single gene': rng.choice(GENES),
+        'Singe gene Reported date': reported,
+        'Type of test': rng.choice(TESTS),
+        'Type of findings': rng.choice(FINDINGS),
+    }
+
+
+def write_master_list(path, rows, seed=0):
+    """Master list workbook with `rows` synthetic patients"""
+    rng = random.Random(seed)
+    groups, names = master_list_header()
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('IM')
+    sheet.append(groups)
+    sheet.append(names)
+    for i in range(rows):
+        patient = synthetic_patient(rng, i)
+        sheet.append([patient.get(str(name).strip()) if name is not None else None for name in names])
+    workbook.save(path)
+
+
+def template_path(kind):
+    """A real upload of this kind ('superpanel' or 'trio') to copy the layout from"""
+    matches = sorted(glob.glob(TEMPLATES[kind]))
+    if not matches:
+        raise FileNotFoundError(f"No {kind} workbook matching {TEMPLATES[kind]}")
+    return matches[0]
+
+
+def variant_layout(path, max_header_rows=10):
+    """
+    (title, rows above and including the header row, column names) of the
+    first sheet, plus the same for the coverage sheet ('Region' and 'Name'
+    columns) or None.
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        layouts = []
+        for sheet in workbook.worksheets:
+            header_rows = []
+            for row in sheet.iter_rows(max_row=max_header_rows, values_only=True):
+                header_rows.append(list(row))
+                names = [str(name).strip() if name is not None else None for name in row]
+                if REPORTABLE_COLUMN in names or ('Region' in names and 'Name' in names):
+                    layouts.append((sheet.title, header_rows, names))
+                    break
+        variants = layouts[0]
+        coverage = next((layout for layout in layouts[1:] if 'Region' in layout[2]), None)
+        return variants, coverage
+    finally:
+        workbook.close()
+
+
+def synthetic_variant(rng, names, kind):
+    """One variant row for a sheet with these (stripped) column names"""
+    gene = rng.choice(GENES)
+    if rng.random() < 0.05:
+        gene = f"{gene},{rng.choice(GENES)}"
+    reportable = rng.choice('CCAIN') if rng.random() < REPORTABLE_RATE else None
+    values = {
+        REPORTABLE_COLUMN: reportable,
+        'Chr:Pos': f"{rng.choice(CHROMOSOMES)}:{rng.randrange(1, 200_000_000)}",
+        'Ref/Alt': '/'.join(rng.sample('ACGT', 2)),
+        'IGV review ( True / False call)': rng.choice(['True', 'False']),
+        'Second review and comment on reportable variant': rng.choice(['pathogenic', 'likely pathogenic']) if reportable else None,
+        'Gene Names': gene,
+        'HGVS c. (Clinically Relevant)': f"NM_{rng.randrange(10 ** 6):06d}.4:c.{rng.randrange(1, 3000)}G>A",
+        'HGVS p. (Clinically Relevant)': f"p.Val{rng.randrange(1, 1000)}Ile",
+        'Exon Number (Clinically Relevant)': str(rng.randint(1, 30)),
+        'Zygosity': rng.choice(ZYGOSITIES),
+        'Inheritance': rng.choice(['AR', 'AD', 'XL', None]),
+        'Classification': rng.choice(CLASSIFICATIONS),
+        'OMIM ID': rng.randrange(100000, 700000),
+        'RSID': f"rs{rng.randrange(10 ** 8)}",
+        'Title': f"{gene.split(',')[0]} deficiency",
+    }
+    if kind == 'trio':
+        values['Inherited From'] = rng.choice(['Father', 'Mother', 'Both', 'De novo'])
+    # Columns the app doesn't read get numbers, like the depth / frequency columns that make up most of the sheet
+    return [values[name] if name in values else (round(rng.random(), 6) if position % 2 else None)
+            for position, name in enumerate(names)]
+
+
+def write_variant_workbook(path, kind, rows, lab_number, seed=0):
+    """Variant workbook with the layout of a real `kind` upload, `rows` variants and IM numbers replaced by lab_number"""
+    rng = random.Random(seed)
+    (title, header_rows, names), coverage = variant_layout(template_path(kind))
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(re.sub(r'\d+', str(rows), title, count=1)[:31])
+    for header in header_rows:
+        sheet.append([re.sub(r'IM\d+', lab_number, value) if isinstance(value, str) else value for value in header])
+    for _ in range(rows):
+        sheet.append(synthetic_variant(rng, names, kind))
+
+    if coverage is not None:
+        title, header_rows, names = coverage
+        sheet = workbook.create_sheet(title)
+        for header in header_rows:
+            sheet.append([re.sub(r'IM\d+', lab_number, value) if isinstance(value, str) else value for value in header])
+        for _ in range(max(rows // 10, 100)):
+            start = rng.randrange(1, 200_000_000)
+            region = {'Region': f"{rng.choice(CHROMOSOMES)}:{start}-{start + rng.randint(100, 400)}", 'Name': rng.choice(GENES)}
+            sheet.append([region.get(name, round(rng.random() * 100, 4)) for name in names])
+    workbook.save(path)
+
+
+def variant_file_name(kind, rows):
+    """Upload file name; the IM numbers are synthetic patients so reports find the upload"""
+    if kind == 'trio':
+        return f"IMM_GRCh38_Trio_synthetic_{rows}_{im_lab_number(1)}_{im_lab_number(2)[2:]}_{im_lab_number(3)[2:]}.xlsx"
+    return f"IMM_GRCh38_SuperPanel_synthetic_{rows}_{im_lab_number(0)}.xlsx"
+
+
+def generate(out_dir, rows, seed=0, force=False):
+    """
+    Write the master list and both variant workbooks for `rows` into out_dir
+    unless they are already there. Returns ({'master_list': path, 'superpanel':
+    path, 'trio': path}, seconds spent writing).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        'master_list': os.path.join(out_dir, f"master_list_{rows}_seed{seed}.xlsx"),
+        'superpanel': os.path.join(out_dir, f"seed{seed}", variant_file_name('superpanel', rows)),
+        'trio': os.path.join(out_dir, f"seed{seed}", variant_file_name('trio', rows)),
+    }
+    os.makedirs(os.path.join(out_dir, f"seed{seed}"), exist_ok=True)
+    started = time.perf_counter()
+    if force or not os.path.exists(paths['master_list']):
+        write_master_list(paths['master_list'], rows, seed)
+    for kind in ('superpanel', 'trio'):
+        if force or not os.path.exists(paths[kind]):
+            lab = re.search(r'IM\d+(_\d+)*', os.path.basename(paths[kind])).group(0)
+            write_variant_workbook(paths[kind], kind, rows, lab, seed)
+    return paths, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--out', default=os.path.join(ROOT, 'benchmarks', 'data'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--force', action='store_true', help='rewrite files that already exist')
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        paths, elapsed = generate(args.out, rows, args.seed, args.force)
+        print(f"{rows:>8} rows in {elapsed:.1f}s: " + ', '.join(os.path.relpath(path) for path in paths.values()))
+
+
+if __name__ == '__main__':
+    main()
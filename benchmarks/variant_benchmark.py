@@ -0,0 +1,106 @@
+"""
+Variant processing: the row-by-row iterrows() code the upload and report
+paths used to run against variant_processing's column-wise helpers, on the
+panels in uploads/. Each sheet is read once and repeated --repeat times so
+the timings are about processing, not openpyxl.
+
+    python benchmarks/variant_benchmark.py --repeat 20
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from variant_processing import CHR_POS_PATTERN, GENE_SEPARATORS, clean_variants, insert_rows, summarize_variants
+from variant_reader import read_variants
+from variant_store import CHR_POS_COLUMN, VARIANT_COLUMNS, prepare_variants
+
+COLUMNS = [CHR_POS_COLUMN] + list(VARIANT_COLUMNS)
+
+
+def iterrows_summary(variants):
+    sentences = []
+    for _, row in variants.iterrows():
+        comment = row['Second review and comment on reportable variant']
+        gene_name = row['Gene Names']
+        sentences.append(f"One likely {comment} variant was detected in the {gene_name} gene.")
+    return " ".join(sentences)
+
+
+def iterrows_insert_rows(df, columns):
+    df = df.replace({pd.NA: None, '': None, ' ': None, 'nan': None, 'NaN': None}).where(pd.notnull(df), None)
+    rows = []
+    for _, row in df.iterrows():
+        rows.append(tuple(row[col] for col in columns))
+    return rows
+
+
+def iterrows_prepare_variants(frame, upload_id, lab_number, file_type):
+    rows = []
+    genes = []
+    for source_row, (_, record) in enumerate(frame.iterrows(), start=1):
+        match = re.match(CHR_POS_PATTERN, str(record[CHR_POS_COLUMN]), re.IGNORECASE)
+        if match is None:
+            continue
+        position = (match.group(1).upper(), int(match.group(2)))
+        values = [None if pd.isna(record.get(column)) else str(record[column]).strip() for column in VARIANT_COLUMNS]
+        rows.append((upload_id, lab_number, file_type, source_row) + position + tuple(values))
+        symbols = dict.fromkeys(gene.strip() for gene in re.split(GENE_SEPARATORS, values[3] or ''))
+        genes.extend((gene[:64], upload_id, source_row) for gene in symbols if gene)
+    return rows, genes
+
+
+def read_panel(path):
+    columns = [column for column in COLUMNS if column != 'Inherited From']
+    try:
+        return read_variants(path, columns + ['Inherited From'])
+    except ValueError:
+        return read_variants(path, columns)
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uploads', default='uploads', help='folder with variant workbooks')
+    parser.add_argument('--repeat', type=int, default=10, help='copies of each sheet to process')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.uploads, '*.xlsx')))
+    if not paths:
+        sys.exit(f"No workbooks in {args.uploads}")
+
+    print(f"{'panel':>40} {'rows':>7} {'step':>10} {'iterrows s':>11} {'columns s':>10} {'speedup':>8}")
+    totals = {}
+    for path in paths:
+        panel = read_panel(path)
+        frame = pd.concat([panel] * args.repeat, ignore_index=True)
+        columns = list(frame.columns)
+        steps = [
+            ('summary', iterrows_summary, summarize_variants, (frame,)),
+            ('insert', iterrows_insert_rows, lambda df, cols: insert_rows(clean_variants(df), cols), (frame, columns)),
+            ('variants', iterrows_prepare_variants, prepare_variants, (frame, 1, 'IM000', 'singleton')),
+        ]
+        for step, old, new, step_args in steps:
+            old_seconds, new_seconds = timed(old, *step_args), timed(new, *step_args)
+            total = totals.setdefault(step, [0, 0])
+            total[0] += old_seconds
+            total[1] += new_seconds
+            print(f"{os.path.basename(path)[-40:]:>40} {len(frame):>7} {step:>10} "
+                  f"{old_seconds:>11.3f} {new_seconds:>10.3f} {old_seconds / new_seconds:>7.1f}x")
+
+    for step, (old_seconds, new_seconds) in totals.items():
+        print(f"{step}: {old_seconds / new_seconds:.1f}x faster overall")
+
+
+if __name__ == '__main__':
+    main()
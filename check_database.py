@@ -1,10 +1,14 @@
-import sqlite3
+import os
 import pandas as pd
+from storage import SQLiteBackend
+
+# The SQLite database (DB_BACKEND=sqlite), as written by create_test_data.py
+DATABASE_FILE = os.getenv('SQLITE_PATH', 'patients.db')
 
 def check_database():
     try:
         # Connect to database
-        conn = sqlite3.connect('patients.db')
+        conn = SQLiteBackend(DATABASE_FILE).connect()
         
         # Get total number of records
         count = pd.read_sql_query("SELECT COUNT(*) as count FROM patients", conn).iloc[0]['count']
@@ -21,7 +25,7 @@ def check_database():
         # Get column names
         print("\nDatabase columns:")
         cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(patients)")
+        cursor.execute("PRAGMA table_xinfo(patients)")
         columns = cursor.fetchall()
         for col in columns:
             print(f"- {col[1]} ({col[2]})")
@@ -33,7 +37,7 @@ def check_database():
 
 def check_report_dates():
     try:
-        conn = sqlite3.connect('patients.db')
+        conn = SQLiteBackend(DATABASE_FILE).connect()
         
         # First, let's see all columns and a sample of raw data
         print("\nRaw data sample:")
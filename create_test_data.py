@@ -1,6 +1,11 @@
+import os
 import pandas as pd
 import sqlite3
 from datetime import datetime, timedelta
+from data_versions import bump_version
+from migrations import ensure_schema
+from patient_dates import with_typed_dates
+from storage import SQLiteBackend
 
 # Create test data
 test_data = {
@@ -82,55 +87,40 @@ df = pd.DataFrame(test_data)
 # Save to Excel
 df.to_excel('IM_Patient_List.xlsx', index=False)
 
-# Save to SQLite database
+# Save to SQLite database, with the same schema as MySQL
+DATABASE_FILE = os.getenv('SQLITE_PATH', 'patients.db')
+
 def init_db():
-    conn = sqlite3.connect('patients.db')
-    c = conn.cursor()
+    conn = SQLiteBackend(DATABASE_FILE).connect()
     
-    # Create table if it doesn't exist
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS patients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            report_date TEXT,
-            lab_number TEXT,
-            im_lab_number TEXT,
-            name TEXT,
-            hkid TEXT,
-            dob TEXT,
-            sex TEXT,
-            age INTEGER,
-            ethnicity TEXT,
-            specimen_collected TEXT,
-            specimen_arrived TEXT,
-            UNIQUE(lab_number, im_lab_number)
-        )
-    ''')
-    conn.commit()
+    # Create tables and indexes if they don't exist
+    ensure_schema(conn)
     return conn
 
 def add_patient_to_db(conn, row):
     c = conn.cursor()
     sex, age = row['Sex/Age'].split('/')
     
+    # Text dates are stored parsed as well
+    patient = with_typed_dates({
+        'report_date': row['Reported date'],
+        'lab_number': row['Lab. no.'],
+        'im_lab_number': row['IM Lab. no.'],
+        'name': row['Patient name'],
+        'hkid': row['HKID'],
+        'dob': row['DOB'],
+        'sex': sex,
+        'age': age,
+        'ethnicity': row['Ethnicity'],
+        'specimen_collected': row['Sample collection date'],
+        'specimen_arrived': row['Sample receive date']
+    })
+    
     try:
-        c.execute('''
-            INSERT INTO patients (
-                report_date, lab_number, im_lab_number, name, hkid, 
-                dob, sex, age, ethnicity, specimen_collected, specimen_arrived
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            row['Reported date'],
-            row['Lab. no.'],
-            row['IM Lab. no.'],
-            row['Patient name'],
-            row['HKID'],
-            row['DOB'],
-            sex,
-            int(age),
-            row['Ethnicity'],
-            row['Sample collection date'],
-            row['Sample receive date']
-        ))
+        c.execute(
+            f"INSERT INTO patients ({', '.join(patient)}) VALUES ({', '.join(['%s'] * len(patient))})",
+            list(patient.values())
+        )
     except sqlite3.IntegrityError:
         print(f"Patient with Lab # {row['Lab. no.']} or IM Lab # {row['IM Lab. no.']} already exists")
 
@@ -138,7 +128,9 @@ def add_patient_to_db(conn, row):
 conn = init_db()
 for _, row in df.iterrows():
     add_patient_to_db(conn, row)
+# Running app processes reload their caches
+bump_version(conn.cursor())
 conn.commit()
 conn.close()
 
-print("Test data has been created in both 'IM_Patient_List.xlsx' and 'patients.db'") 
\ No newline at end of file
+print(f"Test data has been created in both 'IM_Patient_List.xlsx' and '{DATABASE_FILE}'") 
\ No newline at end of file
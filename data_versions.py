@@ -0,0 +1,41 @@
+"""
+Change counters shared by every process using the database.
+
+Each app process (gunicorn worker) keeps its own patient index, typeahead
+index and facet counts. Every write to the patients table, from any process
+or script, bumps the 'patients' counter in the data_versions table in the
+same transaction; the caches remember the counter they were built at and
+reload when it has moved on.
+
+The 'variants' counter moves when stored variants are deleted or replaced
+(a file uploaded again), so the genome index knows its ids are stale.
+
+The counters start at the creation time in milliseconds, so a database
+recreated by database_setup.py never repeats a value an old process saw.
+"""
+import time
+
+PATIENTS = 'patients'
+VARIANTS = 'variants'
+
+
+def seed_version(cursor, name=PATIENTS):
+    """Create the counter row if it is missing"""
+    cursor.execute("SELECT COUNT(*) FROM data_versions WHERE name = %s", (name,))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("INSERT INTO data_versions (name, version) VALUES (%s, %s)", (name, int(time.time() * 1000)))
+
+
+def bump_version(cursor, name=PATIENTS):
+    """Advance the counter inside the caller's transaction, returns the new value"""
+    cursor.execute("UPDATE data_versions SET version = version + 1 WHERE name = %s", (name,))
+    return read_version(cursor, name)
+
+
+def read_version(cursor, name=PATIENTS):
+    """Current value of the counter, or None if it has never been seeded"""
+    cursor.execute("SELECT version FROM data_versions WHERE name = %s", (name,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row['version'] if isinstance(row, dict) else row[0]
@@ -1,201 +1,106 @@
-import mysql.connector
 import pandas as pd
-import numpy as np
-from datetime import datetime
+import argparse
+import logging
+import time
+import logs
+from migrations import apply_migrations
+from patient_dates import refresh_date_quarantine
+from patient_import import prepare_patients, import_patients, sync_patients, print_progress
+from schema import create_table_sql
+from storage import get_backend
 
-def initialize_database():
-    # MySQL configuration
-    config = {
-        'host': 'localhost',
-        'user': 'root',  # Your MySQL username
-        'password': 'password'   # Your MySQL password
-    }
+# MySQL spelling, for scripts that build the table on a MySQL connection
+PATIENTS_TABLE_DDL = create_table_sql('patients', 'mysql')
+
+MASTER_LIST_FILE = 'IM patient list_20250303.xlsx'
+
+logger = logging.getLogger(__name__)
+
+def report_missing_records(patients, imported_rows):
+    """Print lab numbers from the sheet that didn't make it into the database"""
+    imported = patients[patients['source_row'].isin(imported_rows)]
+    for column, label in (('lab_number', 'Lab No'), ('im_lab_number', 'IM Lab No')):
+        missing = set(patients[column].dropna()) - set(imported[column].dropna())
+        if not missing:
+            continue
+        # First sheet row of every lab number, built in one pass
+        first_rows = patients.drop_duplicates(column).set_index(column)
+        logger.warning("%d %ss not imported", len(missing), label)
+        for lab in missing:
+            logger.warning("%s not imported", label, extra={
+                'sample': f'missing_{column}', 'row': int(first_rows.loc[lab, 'source_row']), column: lab
+            })
+
+def log_import_errors(error_details):
+    """Log the rows that failed to import, sampled, with the patient name redacted"""
+    for error in error_details:
+        logger.warning("Row not imported: %s", error['reason'], extra={
+            'sample': 'import_error',
+            'row': error['row'],
+            'patient_name': error['patient'],
+            'lab_number': error.get('lab_no'),
+            'im_lab_number': error.get('im_lab_no'),
+        })
+
+def initialize_database(excel_file=MASTER_LIST_FILE, database=None, chunk_size=1000):
+    # MySQL or SQLite (DB_BACKEND); database defaults to MYSQL_DATABASE / SQLITE_PATH
+    backend = get_backend(database)
 
     try:
-        # Create database connection
-        print("Connecting to MySQL...")
-        conn = mysql.connector.connect(**config)
-        cursor = conn.cursor()
-        
-        # Create and use database
+        # Start from an empty database
         print("Creating database...")
-        cursor.execute("DROP DATABASE IF EXISTS patients_db")
-        cursor.execute("CREATE DATABASE patients_db")
-        cursor.execute("USE patients_db")
-        
+        backend.create_database()
+        print(f"Connecting to {backend.config['database']} ({backend.dialect})...")
+        conn = backend.connect()
+        cursor = conn.cursor()
+
         # Create patients table with proper columns
         print("Creating patients table...")
-        cursor.execute("""
-            CREATE TABLE patients (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                report_date TEXT,          # Changed from DATE to TEXT
-                lab_number VARCHAR(1000),   # Increased from VARCHAR(20)
-                im_lab_number VARCHAR(1000),# Increased from VARCHAR(20)
-                name VARCHAR(1000),
-                hkid TEXT,
-                dob TEXT,                  # Changed from DATE to TEXT
-                sex VARCHAR(100),
-                age VARCHAR(100),
-                ethnicity VARCHAR(500),
-                specimen_collected TEXT,    # Changed from DATE to TEXT
-                specimen_arrived TEXT,      # Changed from DATE to TEXT
-                case_history TEXT,
-                type_of_test VARCHAR(500),
-                type_of_findings VARCHAR(500),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-        """)
+        cursor.execute(create_table_sql('patients', backend.dialect))
+
+        # Lookup keys, indexes and the other tables the app expects
+        apply_migrations(conn)
 
         # Read Excel file
         print("\nReading Excel file...")
-        df = pd.read_excel('IM patient list_20250303.xlsx', header=1)
-        
-        # Store original data for comparison
-        original_lab_numbers = set(df['Lab. no.'].dropna())
-        original_im_numbers = set(df['IM Lab. no.'].dropna())
-        
-        # Clean data
-        df = df.replace({np.nan: None})
-        
-        # Add validation counters
-        total_rows = len(df)
-        empty_rows = 0
-        skipped_rows = []
-        processed_lab_numbers = set()
-        processed_im_numbers = set()
-        
+        started = time.perf_counter()
+        source = pd.read_excel(excel_file, header=1)
+        total_rows = len(source)
+        read_time = time.perf_counter() - started
+
         print("\nStarting data validation...")
         print(f"Total rows in Excel: {total_rows}")
-        
-        # Process data and insert
-        success_count = 0
-        error_count = 0
-        error_details = []
-        
-        for index, row in df.iterrows():
-            try:
-                # Only skip if ALL fields are empty
-                all_empty = all(pd.isna(value) for value in row.values)
-                if all_empty:
-                    empty_rows += 1
-                    continue
-
-                lab_no = row.get('Lab. no.', '')
-                im_lab_no = row.get('IM Lab. no.', '')
-                
-                # Track processed numbers
-                if pd.notnull(lab_no):
-                    processed_lab_numbers.add(str(lab_no).strip())
-                if pd.notnull(im_lab_no):
-                    processed_im_numbers.add(str(im_lab_no).strip())
-                
-                # Enhanced error tracking
-                if pd.isna(row['Lab. no.']) and pd.isna(row['IM Lab. no.']):
-                    error_details.append({
-                        'row': index + 2,
-                        'reason': 'Both Lab No. and IM Lab No. are empty',
-                        'patient': row.get('Patient name', 'Unknown')
-                    })
-                    error_count += 1
-                    continue
-
-                # Add debug printing for each row
-                print(f"\nProcessing row {index + 2}:")
-                print(f"Lab No: {row.get('Lab. no.', '')}")
-                print(f"IM Lab No: {row.get('IM Lab. no.', '')}")
-                print(f"Patient Name: {row.get('Patient name', '')}")
-
-                insert_query = """
-                    INSERT INTO patients (
-                        report_date, lab_number, im_lab_number, name,
-                        hkid, dob, sex, age, ethnicity,
-                        specimen_collected, specimen_arrived, case_history,
-                        type_of_test, type_of_findings
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                
-                # Process Sex/Age
-                sex_age = str(row.get('Sex/Age', ''))
-                sex, age = sex_age.split('/') if '/' in sex_age else ('', '')
-                
-                values = (
-                    str(row.get('Singe gene Reported date', '')).strip(),  # Store as text
-                    str(row.get('Lab. no.', '')).strip(),
-                    str(row.get('IM Lab. no.', '')).strip(),
-                    str(row.get('Patient name', '')).strip(),
-                    str(row.get('HKID', '')).strip(),
-                    str(row.get('DOB', '')).strip(),                       # Store as text
-                    sex.strip(),
-                    age.strip(),
-                    str(row.get('Ethnicity', '')).strip(),
-                    str(row.get('Sample collection date', '')).strip(),    # Store as text
-                    str(row.get('Sample receive date', '')).strip(),       # Store as text
-                    str(row.get('Case', '')).strip(),
-                    str(row.get('Type of test', '')).strip(),
-                    str(row.get('Type of findings', '')).strip()
-                )
-                
-                cursor.execute(insert_query, values)
-                success_count += 1
-                
-                if success_count % 100 == 0:  # Progress indicator
-                    print(f"Processed {success_count} records...")
-                
-            except Exception as e:
-                error_details.append({
-                    'row': index + 2,
-                    'reason': str(e),
-                    'patient': row.get('Patient name', 'Unknown'),
-                    'lab_no': lab_no,
-                    'im_lab_no': im_lab_no
-                })
-                error_count += 1
-                continue
-
-        # After processing, find missing records
-        missing_lab_numbers = original_lab_numbers - processed_lab_numbers
-        missing_im_numbers = original_im_numbers - processed_im_numbers
-
-        # Commit changes
-        conn.commit()
-        
+        patients, error_details, empty_rows = prepare_patients(source)
+
+        # Insert in chunks, one commit per chunk
+        print(f"\nImporting {len(patients)} rows in chunks of {chunk_size}...")
+        import_started = time.perf_counter()
+        imported_rows, insert_errors = import_patients(conn, patients, chunk_size, progress=print_progress)
+        import_time = time.perf_counter() - import_started
+        error_details += insert_errors
+        success_count = len(imported_rows)
+        error_count = len(error_details)
+
         # Enhanced summary with missing records details
         print("\n=== Import Summary ===")
         print(f"Total rows in Excel: {total_rows}")
         print(f"Empty rows skipped: {empty_rows}")
         print(f"Successfully imported: {success_count}")
         print(f"Failed to import: {error_count}")
-        
-        if missing_lab_numbers or missing_im_numbers:
-            print("\n=== Missing Records ===")
-            print("Lab numbers not imported:")
-            for lab in missing_lab_numbers:
-                missing_row = df[df['Lab. no.'] == lab].iloc[0]
-                print(f"Row {df[df['Lab. no.'] == lab].index[0] + 2}:")
-                print(f"  Lab No: {lab}")
-                print(f"  Patient Name: {missing_row.get('Patient name', '')}")
-                print(f"  Case: {missing_row.get('Case', '')}")
-                
-            print("\nIM Lab numbers not imported:")
-            for im_lab in missing_im_numbers:
-                missing_row = df[df['IM Lab. no.'] == im_lab].iloc[0]
-                print(f"Row {df[df['IM Lab. no.'] == im_lab].index[0] + 2}:")
-                print(f"  IM Lab No: {im_lab}")
-                print(f"  Patient Name: {missing_row.get('Patient name', '')}")
-                print(f"  Case: {missing_row.get('Case', '')}")
-
-        # Enhanced error reporting
-        if error_details:
-            print("\n=== Import Errors Details ===")
-            print(f"Total errors: {error_count}")
-            for error in error_details:
-                print(f"\nRow {error['row']}:")
-                print(f"  Patient: {error['patient']}")
-                if 'lab_no' in error:
-                    print(f"  Lab No: {error['lab_no']}")
-                if 'im_lab_no' in error:
-                    print(f"  IM Lab No: {error['im_lab_no']}")
-                print(f"  Reason: {error['reason']}")
+        print(f"  Duplicate Lab No. and IM Lab No. (a later row was imported): "
+              f"{sum('duplicate_of' in error for error in error_details)}")
+        print(f"Excel read time: {read_time:.2f}s")
+        print(f"Import time: {import_time:.2f}s ({success_count / import_time if import_time else 0:,.0f} rows/s)")
+
+        report_missing_records(patients, imported_rows)
+
+        # Date text that didn't parse stays in the text columns and is listed for review
+        quarantined = refresh_date_quarantine(cursor)
+        conn.commit()
+        print(f"\nDate values that could not be parsed (see date_quarantine): {quarantined}")
+
+        # One sampled log record per failed row
+        log_import_errors(error_details)
 
         # Verify data with detailed count
         cursor.execute("""
@@ -213,8 +118,8 @@ def initialize_database():
         
         return True
         
-    except Exception as e:
-        print(f"\nDatabase initialization error: {str(e)}")
+    except Exception:
+        logger.exception("Database initialization error")
         return False
         
     finally:
@@ -223,6 +128,63 @@ def initialize_database():
         if 'conn' in locals():
             conn.close()
 
+def sync_database(excel_file=MASTER_LIST_FILE, database=None, chunk_size=1000):
+    """
+    Refresh an existing database from the master list without dropping it.
+    Only new and changed rows are written; findings summaries, uploaded
+    files and patients missing from the sheet are kept.
+    """
+    backend = get_backend(database)
+
+    try:
+        print(f"Connecting to {backend.config['database']} ({backend.dialect})...")
+        conn = backend.connect()
+        apply_migrations(conn)
+
+        print("\nReading Excel file...")
+        started = time.perf_counter()
+        source = pd.read_excel(excel_file, header=1)
+        patients, error_details, empty_rows = prepare_patients(source)
+
+        result = sync_patients(conn, patients, chunk_size, progress=print_progress)
+        error_details += result['errors']
+        cursor = conn.cursor()
+        quarantined = refresh_date_quarantine(cursor)
+        conn.commit()
+        cursor.close()
+        elapsed = time.perf_counter() - started
+
+        print("\n=== Sync Summary ===")
+        print(f"Total rows in Excel: {len(source)}")
+        print(f"Empty rows skipped: {empty_rows}")
+        print(f"Inserted: {result['inserted']}")
+        print(f"Updated: {result['updated']}")
+        print(f"Unchanged: {result['unchanged']}")
+        print(f"Unparsed dates (see date_quarantine): {quarantined}")
+        print(f"Failed: {len(error_details)}")
+        print(f"Total time: {elapsed:.2f}s")
+        log_import_errors(error_details)
+        return result
+    except Exception:
+        logger.exception("Database sync error")
+        return None
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
 if __name__ == '__main__':
-    print("Starting database initialization...")
-    initialize_database()
\ No newline at end of file
+    logs.configure(fmt='text')
+    parser = argparse.ArgumentParser(description="Load patients_db from the IM patient master list")
+    parser.add_argument('--file', default=MASTER_LIST_FILE, help='master list workbook')
+    parser.add_argument('--database', help='MySQL database or SQLite file to load (default: MYSQL_DATABASE / SQLITE_PATH)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='rows per INSERT batch / commit')
+    parser.add_argument('--sync', action='store_true',
+                        help='upsert new and changed rows into the existing database instead of rebuilding it')
+    args = parser.parse_args()
+
+    if args.sync:
+        print("Starting incremental sync...")
+        sync_database(args.file, args.database, args.chunk_size)
+    else:
+        print("Starting database initialization...")
+        initialize_database(args.file, args.database, args.chunk_size)
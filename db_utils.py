@@ -1,21 +1,311 @@
 import mysql.connector
 import pandas as pd
+import sqlite3
 from datetime import datetime
 import os
+import queue
+import threading
+import base64
+import functools
+import inspect
+import logging
+import json
+import re
+import time
+import metrics
+import storage
+from data_versions import VARIANTS, bump_version, read_version
+from facets import FacetCache, FACET_COLUMNS
+from patient_dates import DATE_COLUMNS, parse_date, with_typed_dates
 
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_lab_number(lab_number):
+    """Normalize a lab number the same way the lab_key / im_lab_key columns are"""
+    return str(lab_number).strip().upper()[:64]
+
+
+# Equality filters accepted by query_patients -> (column, normalize lab number?)
+PATIENT_FILTERS = {
+    'lab_number': ('lab_key', True),
+    'im_lab_number': ('im_lab_key', True),
+    'name': ('name', False),
+    'type_of_test': ('type_of_test', False),
+    'type_of_findings': ('type_of_findings', False),
+}
+
+# Date range filters accepted by query_patients ('report_date_from': '2024-09-01')
+# -> (DATE column, comparison)
+PATIENT_DATE_FILTERS = {
+    f'{column}_{bound}': (typed, operator)
+    for column, typed in DATE_COLUMNS.items()
+    for bound, operator in (('from', '>='), ('to', '<='))
+}
+
+# Sort options accepted by query_patients -> indexed column to order by
+PATIENT_SORTS = {
+    'id': 'id',
+    'lab_number': 'lab_key',
+    'im_lab_number': 'im_lab_key',
+    'name': 'name',
+    'type_of_test': 'type_of_test',
+    'type_of_findings': 'type_of_findings',
+    'created_at': 'created_at',
+    'report_date': 'report_on',
+    'specimen_collected': 'collected_on',
+    'specimen_arrived': 'arrived_on',
+}
+
+PATIENT_LIST_COLUMNS = ['id', 'lab_number', 'im_lab_number', 'name', 'type_of_test', 'type_of_findings']
+
+
+# Columns returned by query_variants
+VARIANT_LIST_COLUMNS = [
+    'id', 'lab_number', 'file_type', 'chr', 'pos', 'gene_names', 'hgvs_c', 'hgvs_p',
+    'zygosity', 'inheritance', 'classification', 'reportable', 'inherited_from'
+]
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def keyset_clause(column, descending, last_value, last_id):
+    """
+    WHERE clause selecting the rows after (last_value, last_id) when ordered
+    by (column, id). MySQL and SQLite sort NULLs first ascending and last descending.
+    """
+    if descending:
+        if last_value is None:
+            return f"({column} IS NULL AND id < %s)", [last_id]
+        return f"({column} < %s OR ({column} = %s AND id < %s) OR {column} IS NULL)", [last_value, last_value, last_id]
+    if last_value is None:
+        return f"(({column} IS NULL AND id > %s) OR {column} IS NOT NULL)", [last_id]
+    return f"({column} > %s OR ({column} = %s AND id > %s))", [last_value, last_value, last_id]
+
+
+class PooledConnection:
+    """
+    Wrapper around a pooled database connection.
+    close() and leaving a `with` block hand the connection back to the pool
+    instead of closing the socket; everything else is passed through.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise Exception("Connection has already been returned to the pool")
+        return getattr(self._conn, name)
+
+    def close(self, broken=False):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn, broken=broken)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        broken = isinstance(exc_value, self._pool.backend.DISCONNECT_ERRORS)
+        self.close(broken=broken)
+        return False
+
+
+class ConnectionPool:
+    """
+    Bounded pool of connections to a storage backend.
+    At most `size` connections are checked out at once; callers wait up to
+    `timeout` seconds for a free one. Idle connections are pinged on checkout
+    and reconnected (or replaced) if the server dropped them.
+    """
+
+    def __init__(self, backend, size=5, timeout=30, reconnect_attempts=3):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.reconnect_attempts = reconnect_attempts
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise Exception(f"Connection pool exhausted ({self.size} connections in use)")
+        try:
+            conn = self._checkout_idle()
+            if conn is None:
+                conn = self.backend.connect()
+            return PooledConnection(self, conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkout_idle(self):
+        """Return a healthy idle connection, or None if a new one is needed"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            try:
+                conn.ping(reconnect=True, attempts=self.reconnect_attempts, delay=1)
+                return conn
+            except storage.DATABASE_ERRORS:
+                self._discard(conn)
+
+    def release(self, conn, broken=False):
+        try:
+            if not broken:
+                try:
+                    # Never hand out a connection with an open transaction/snapshot
+                    if conn.in_transaction:
+                        conn.rollback()
+                    self._idle.put_nowait(conn)
+                    return
+                except storage.DATABASE_ERRORS + (queue.Full,):
+                    pass
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close on release)"""
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def _lab_number(arguments):
+    return {'lab_number': arguments['lab_number']}
+
+
+def _returns_on_error(default, message, level=logging.ERROR, context=None):
+    """
+    Decorator for DatabaseManager methods that answer an error with a
+    failure value instead of raising: the error is logged with message,
+    counted in DB_ERRORS under the method's __name__ and default returned
+    (default() if it is callable, so each caller gets its own DataFrame).
+    context(arguments) gives the log's extra fields from the call's
+    arguments by name.
+    """
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                metrics.DB_ERRORS.inc(method=func.__name__)
+                extra = context(signature.bind(*args, **kwargs).arguments) if context else None
+                logger.log(level, message, exc_info=True, extra=extra)
+                return default() if callable(default) else default
+        return wrapper
+    return decorate
+
+
+# Methods that return a failure value count their errors through _returns_on_error
+@metrics.timed_methods(metrics.DB_SECONDS, metrics.DB_ERRORS)
 class DatabaseManager:
-    def __init__(self):
-        # Get MySQL host from environment variable or use default
-        self.config = {
-            'host': os.getenv('MYSQL_HOST', 'localhost'),
-            'user': os.getenv('MYSQL_USER', 'root'),
-            'password': os.getenv('MYSQL_PASSWORD', 'password'),
-            'database': 'patients_db'
-        }
+    def __init__(self, pool_size=None, pool_timeout=None, backend=None):
+        # MySQL or SQLite, picked by DB_BACKEND (see storage.py)
+        self.backend = backend or storage.get_backend()
+        self.config = self.backend.config
+        self.pool_size = int(pool_size or os.getenv('MYSQL_POOL_SIZE', 5))
+        self.pool_timeout = float(pool_timeout or os.getenv('MYSQL_POOL_TIMEOUT', 30))
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        # Writes from other processes show up through the data_versions counter,
+        # read at most every DATA_VERSION_INTERVAL seconds
+        self.version_interval = float(os.getenv('DATA_VERSION_INTERVAL', 1))
+        self._version = None
+        self._version_read_at = None
+        self._version_lock = threading.Lock()
+        self.facets = FacetCache(self._load_facet_counts, max_age=float(os.getenv('FACET_CACHE_MAX_AGE', 300)),
+                                 version=self.data_version)
+        self._change_listeners = []
+
+    def add_change_listener(self, listener):
+        """Call listener() after every committed change to the patients table"""
+        self._change_listeners.append(listener)
+
+    @_returns_on_error(None, "Error reading the patients change counter", level=logging.WARNING,
+                       context=lambda arguments: {'sample': 'data_version'})
+    def data_version(self):
+        """
+        The patients change counter (see data_versions.py), or None if it
+        can't be read. Caches compare it with the value they were built at.
+        """
+        with self._version_lock:
+            if self._version_read_at is not None and time.monotonic() - self._version_read_at < self.version_interval:
+                return self._version
+        with self.get_connection() as conn:
+            version = read_version(conn.cursor())
+        self._seen_version(version)
+        return version
+
+    def _seen_version(self, version):
+        with self._version_lock:
+            self._version = version
+            self._version_read_at = time.monotonic()
+
+    def bump_data_version(self):
+        """
+        Advance the patients change counter so every process reloads its
+        caches, e.g. after database_setup.py --sync. Returns the new value.
+        """
+        with self.get_connection() as conn:
+            version = bump_version(conn.cursor())
+            conn.commit()
+        self._notify_change(version)
+        return version
+
+    def _notify_change(self, version=None):
+        if version is not None:
+            self._seen_version(version)
+        for listener in self._change_listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.exception("Error in change listener")
+
+    def get_pool(self):
+        """Create the connection pool on first use (and again after a fork)"""
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ConnectionPool(self.backend, size=self.pool_size, timeout=self.pool_timeout)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def close_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close_all()
+                self._pool = None
 
     def get_connection(self):
         try:
-            return mysql.connector.connect(**self.config)
+            return self.get_pool().acquire()
         except mysql.connector.Error as err:
             if err.errno == mysql.connector.errorcode.ER_ACCESS_DENIED_ERROR:
                 raise Exception("Invalid username or password")
@@ -23,26 +313,35 @@ class DatabaseManager:
                 raise Exception("Database does not exist")
             else:
                 raise Exception(f"Connection failed: {err}")
+        except sqlite3.Error as err:
+            raise Exception(f"Connection failed: {err}")
 
     def get_patient_by_lab_number(self, lab_number):
         """Get patient by either lab number or IM lab number"""
         query = """
             SELECT * FROM patients 
-            WHERE lab_number = %s OR im_lab_number = %s
+            WHERE lab_key = %s OR im_lab_key = %s
         """
+        key = normalize_lab_number(lab_number)
         try:
             conn = self.get_connection()
-            df = pd.read_sql_query(query, conn, params=(lab_number, lab_number))
+            df = pd.read_sql_query(query, conn, params=(key, key))
             return df
         finally:
             if 'conn' in locals():
                 conn.close()
 
+    @_returns_on_error(False, "Error adding patient",
+                       context=lambda arguments: {'lab_number': arguments['patient_data'].get('lab_number')})
     def add_patient(self, patient_data):
+        generation = self.facets.generation()
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
             
+            # Text dates are stored parsed as well
+            patient_data = with_typed_dates(patient_data)
+
             # Prepare SQL query
             fields = ', '.join(patient_data.keys())
             placeholders = ', '.join(['%s'] * len(patient_data))
@@ -50,111 +349,278 @@ class DatabaseManager:
             
             # Execute query
             cursor.execute(query, list(patient_data.values()))
+            version = bump_version(conn.cursor())
             conn.commit()
+            self._notify_change(version)
+            self.facets.record_added(patient_data, generation, version)
             
             return True
-        except Exception as e:
-            print(f"Error adding patient: {e}")
-            return False
         finally:
             if 'conn' in locals():
                 conn.close()
 
+    @_returns_on_error(pd.DataFrame, "Error getting patients")
     def get_all_patients(self):
         """Get all patients"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor(dictionary=True)
-                cursor.execute("SELECT * FROM patients")
-                results = cursor.fetchall()
-                return pd.DataFrame(results) if results else pd.DataFrame()
-        except Exception as e:
-            print(f"Error getting patients: {e}")
-            return pd.DataFrame()
+        with self.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM patients")
+            results = cursor.fetchall()
+            return pd.DataFrame(results) if results else pd.DataFrame()
+
+    def query_patients(self, filters=None, sort='id', descending=False, limit=50, cursor=None):
+        """
+        One page of patients for the patient table.
+        filters maps PATIENT_FILTERS names to exact values and
+        PATIENT_DATE_FILTERS names to dates (inclusive), cursor is the
+        next_cursor returned with the previous page. Returns
+        {'data': [...], 'next_cursor': str or None}.
+        """
+        if sort not in PATIENT_SORTS:
+            raise ValueError(f"Unsupported sort: {sort}")
+        sort_column = PATIENT_SORTS[sort]
+
+        conditions = []
+        params = []
+        for name, value in (filters or {}).items():
+            if name not in PATIENT_FILTERS and name not in PATIENT_DATE_FILTERS:
+                raise ValueError(f"Unsupported filter: {name}")
+            if value in (None, ''):
+                continue
+            if name in PATIENT_DATE_FILTERS:
+                column, operator = PATIENT_DATE_FILTERS[name]
+                day = parse_date(value)
+                if day is None:
+                    raise ValueError(f"Invalid date for {name}: {value}")
+                conditions.append(f"{column} {operator} %s")
+                params.append(day)
+                continue
+            column, is_lab_number = PATIENT_FILTERS[name]
+            conditions.append(f"{column} = %s")
+            params.append(normalize_lab_number(value) if is_lab_number else value)
+
+        if cursor:
+            last_value, last_id = decode_cursor(cursor)
+            clause, clause_params = keyset_clause(sort_column, descending, last_value, last_id)
+            conditions.append(clause)
+            params.extend(clause_params)
+
+        direction = 'DESC' if descending else 'ASC'
+        select_columns = PATIENT_LIST_COLUMNS + ([sort_column] if sort_column not in PATIENT_LIST_COLUMNS else [])
+        query = f"SELECT {', '.join(select_columns)} FROM patients"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {sort_column} {direction}, id {direction} LIMIT %s"
+        params.append(limit + 1)
+
+        with self.get_connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(query, params)
+            rows = cur.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][sort_column], rows[-1]['id']])
+        data = [{col: row[col] for col in PATIENT_LIST_COLUMNS} for row in rows]
+        return {'data': data, 'next_cursor': next_cursor}
+
+    def query_variants(self, gene=None, chr=None, start=None, end=None, zygosity=None, classification=None,
+                       limit=50, cursor=None):
+        """
+        One page of stored variants across all patients. gene matches any of
+        a variant's gene symbols, chr/start/end select a position range
+        (start and end need chr), zygosity and classification are exact.
+        Pages are ordered by position when chr is given, otherwise by id.
+        Returns {'data': [...], 'next_cursor': str or None}.
+        """
+        if (start is not None or end is not None) and not chr:
+            raise ValueError("A position range needs chr")
+
+        tables = "variants v"
+        conditions = []
+        params = []
+        # variant_genes is keyed (gene, variant_id), so one gene's variants come out in id order
+        id_column = 'v.id'
+        if gene:
+            tables += " JOIN variant_genes g ON g.variant_id = v.id"
+            conditions.append("g.gene = %s")
+            params.append(gene.strip())
+            id_column = 'g.variant_id'
+        if chr:
+            conditions.append("v.chr = %s")
+            params.append(re.sub(r'^chr', '', str(chr).strip(), flags=re.IGNORECASE).upper())
+        if start is not None:
+            conditions.append("v.pos >= %s")
+            params.append(int(start))
+        if end is not None:
+            conditions.append("v.pos <= %s")
+            params.append(int(end))
+        if zygosity:
+            conditions.append("v.zygosity = %s")
+            params.append(zygosity)
+        if classification:
+            conditions.append("v.classification = %s")
+            params.append(classification)
+
+        if cursor:
+            last = decode_cursor(cursor)
+            if chr:
+                last_pos, last_id = last
+                conditions.append(f"(v.pos > %s OR (v.pos = %s AND {id_column} > %s))")
+                params.extend([last_pos, last_pos, last_id])
+            else:
+                conditions.append(f"{id_column} > %s")
+                params.append(last[0])
+
+        query = f"SELECT {', '.join('v.' + column for column in VARIANT_LIST_COLUMNS)} FROM {tables}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY v.pos, {id_column} LIMIT %s" if chr else f" ORDER BY {id_column} LIMIT %s"
+        params.append(limit + 1)
 
+        with self.get_connection() as conn:
+            cur = conn.cursor(dictionary=True)
+            cur.execute(query, params)
+            rows = cur.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([last['pos'], last['id']] if chr else [last['id']])
+        return {'data': rows, 'next_cursor': next_cursor}
+
+    def get_variant_positions(self, after_id=0):
+        """(id, chr, pos) of the variants with an id above after_id, for the genome index"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, chr, pos FROM variants WHERE id > %s ORDER BY id", (after_id,))
+            return cursor.fetchall()
+
+    def variants_version(self):
+        """The variants change counter (see data_versions.py), None if it was never seeded"""
+        with self.get_connection() as conn:
+            return read_version(conn.cursor(), VARIANTS)
+
+    def get_variants_by_ids(self, ids):
+        """Variants (VARIANT_LIST_COLUMNS) for these ids, in the same order; deleted ids are skipped"""
+        if not ids:
+            return []
+        with self.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                f"SELECT {', '.join(VARIANT_LIST_COLUMNS)} FROM variants WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                list(ids)
+            )
+            rows = {row['id']: row for row in cursor.fetchall()}
+        return [rows[variant_id] for variant_id in ids if variant_id in rows]
+
+    def get_filter_values(self):
+        """Distinct values and counts for the patient table filter dropdowns"""
+        return self.facets.get()
+
+    def _load_facet_counts(self, column):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {column}, COUNT(*) FROM patients GROUP BY {column}")
+            return cursor.fetchall()
+
+    def _lock_findings(self, cursor, key):
+        """Current type_of_findings of the rows an update is about to change"""
+        cursor.execute("""
+            SELECT type_of_findings FROM patients
+            WHERE lab_key = %s OR im_lab_key = %s
+            FOR UPDATE
+        """, (key, key))
+        return [row[0] for row in cursor.fetchall()]
+
+    def _findings_changed(self, old_findings, findings_type, generation, version):
+        self.facets.values_changed('type_of_findings', old_findings, findings_type, generation, version)
+
+    @_returns_on_error(False, "Error updating findings", context=_lab_number)
     def update_findings(self, lab_number, findings):
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE patients 
-                    SET type_of_findings = %s 
-                    WHERE lab_number = %s OR im_lab_number = %s
-                """, (findings, lab_number, lab_number))
-                conn.commit()
-                return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error updating findings: {str(e)}")
-            return False
+        key = normalize_lab_number(lab_number)
+        generation = self.facets.generation()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            old_findings = self._lock_findings(cursor, key)
+            cursor.execute("""
+                UPDATE patients 
+                SET type_of_findings = %s 
+                WHERE lab_key = %s OR im_lab_key = %s
+            """, (findings, key, key))
+            version = bump_version(conn.cursor())
+            conn.commit()
+            self._notify_change(version)
+            self._findings_changed(old_findings, findings, generation, version)
+            return cursor.rowcount > 0
 
+    @_returns_on_error(False, "Error updating findings summary", context=_lab_number)
     def update_findings_summary(self, lab_number, findings_type, summary):
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
+        key = normalize_lab_number(lab_number)
+        generation = self.facets.generation()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            old_findings = self._lock_findings(cursor, key)
+            cursor.execute("""
+                UPDATE patients 
+                SET type_of_findings = %s,
+                    findings_summary = %s 
+                WHERE lab_key = %s OR im_lab_key = %s
+            """, (findings_type, summary, key, key))
+            version = bump_version(conn.cursor())
+            conn.commit()
+            self._notify_change(version)
+            self._findings_changed(old_findings, findings_type, generation, version)
+            return cursor.rowcount > 0
+
+    @_returns_on_error(False, "Error updating findings and summary", context=_lab_number)
+    def update_findings_and_summary(self, lab_number, findings_type, summary=None):
+        key = normalize_lab_number(lab_number)
+        generation = self.facets.generation()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            old_findings = self._lock_findings(cursor, key)
+            if summary:
                 cursor.execute("""
                     UPDATE patients 
                     SET type_of_findings = %s,
                         findings_summary = %s 
-                    WHERE lab_number = %s OR im_lab_number = %s
-                """, (findings_type, summary, lab_number, lab_number))
-                conn.commit()
-                return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error updating findings summary: {str(e)}")
-            return False
-
-    def update_findings_and_summary(self, lab_number, findings_type, summary=None):
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                if summary:
-                    cursor.execute("""
-                        UPDATE patients 
-                        SET type_of_findings = %s,
-                            findings_summary = %s 
-                        WHERE lab_number = %s OR im_lab_number = %s
-                    """, (findings_type, summary, lab_number, lab_number))
-                else:
-                    cursor.execute("""
-                        UPDATE patients 
-                        SET type_of_findings = %s
-                        WHERE lab_number = %s OR im_lab_number = %s
-                    """, (findings_type, lab_number, lab_number))
-                conn.commit()
-                return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error updating findings and summary: {str(e)}")
-            return False
-
-    def search_patients(self, search_term):
-        """Search patients by lab number or IM lab number"""
-        try:
-            conn = self.get_connection()
-            query = """
-            SELECT * FROM patients 
-            WHERE lab_number LIKE %s 
-            OR im_lab_number LIKE %s
-            OR name LIKE %s
-            """
-            search_pattern = f"%{search_term}%"
-            df = pd.read_sql_query(query, conn, params=[search_pattern, search_pattern, search_pattern])
-            return df
-        finally:
-            if 'conn' in locals():
-                conn.close()
+                    WHERE lab_key = %s OR im_lab_key = %s
+                """, (findings_type, summary, key, key))
+            else:
+                cursor.execute("""
+                    UPDATE patients 
+                    SET type_of_findings = %s
+                    WHERE lab_key = %s OR im_lab_key = %s
+                """, (findings_type, key, key))
+            version = bump_version(conn.cursor())
+            conn.commit()
+            self._notify_change(version)
+            self._findings_changed(old_findings, findings_type, generation, version)
+            return cursor.rowcount > 0
 
+    @_returns_on_error(False, "Error deleting patient", context=_lab_number)
     def delete_patient(self, lab_number):
         """Delete patient by lab number"""
+        generation = self.facets.generation()
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            query = "DELETE FROM patients WHERE lab_number = %s"
-            cursor.execute(query, (lab_number,))
+            cursor = conn.cursor(dictionary=True)
+            key = normalize_lab_number(lab_number)
+            cursor.execute(
+                f"SELECT {', '.join(FACET_COLUMNS.values())} FROM patients WHERE lab_key = %s FOR UPDATE",
+                (key,)
+            )
+            removed = cursor.fetchall()
+            query = "DELETE FROM patients WHERE lab_key = %s"
+            cursor.execute(query, (key,))
+            version = bump_version(conn.cursor())
             conn.commit()
+            self._notify_change(version)
+            self.facets.records_removed(removed, generation, version)
             return True
-        except Exception as e:
-            print(f"Error deleting patient: {e}")
-            return False
         finally:
             if 'conn' in locals():
                 conn.close()
@@ -163,67 +629,178 @@ class DatabaseManager:
         """Get single patient by lab number"""
         try:
             conn = self.get_connection()
-            query = "SELECT * FROM patients WHERE lab_number = %s"
-            df = pd.read_sql_query(query, conn, params=[lab_number])
+            query = "SELECT * FROM patients WHERE lab_key = %s"
+            df = pd.read_sql_query(query, conn, params=[normalize_lab_number(lab_number)])
             return df.to_dict('records')[0] if not df.empty else None
         finally:
             if 'conn' in locals():
                 conn.close()
 
+    def get_report_patients(self, lab_numbers=None, date_from=None, date_to=None):
+        """
+        Patients for a batch of reports in one query: those whose lab number
+        or IM lab number is in lab_numbers, or whose report date falls in
+        [date_from, date_to] (YYYY-MM-DD strings).
+        """
+        conditions = []
+        params = []
+        if lab_numbers:
+            keys = [normalize_lab_number(lab_number) for lab_number in lab_numbers]
+            placeholders = ', '.join(['%s'] * len(keys))
+            conditions.append(f"(lab_key IN ({placeholders}) OR im_lab_key IN ({placeholders}))")
+            params.extend(keys + keys)
+        if date_from:
+            conditions.append("report_on >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("report_on <= %s")
+            params.append(date_to)
+        if not conditions:
+            raise ValueError("Give lab numbers or a report date range")
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                f"SELECT * FROM patients WHERE {' AND '.join(conditions)} ORDER BY report_on, id",
+                params
+            )
+            return cursor.fetchall()
+
+    def get_turnaround_times(self, date_from=None, date_to=None):
+        """
+        Days from specimen arrival to report per report month, for reports
+        dated in [date_from, date_to]: [{'month', 'reports', 'avg_days',
+        'min_days', 'max_days'}]. Patients without both dates are left out.
+        """
+        conditions = ["report_on IS NOT NULL", "arrived_on IS NOT NULL"]
+        params = []
+        if date_from:
+            conditions.append("report_on >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("report_on <= %s")
+            params.append(date_to)
+
+        year, month = self.backend.year('report_on'), self.backend.month('report_on')
+        days = self.backend.days_between('report_on', 'arrived_on')
+        with self.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT {year} AS year, {month} AS month, COUNT(*) AS reports,
+                       AVG({days}) AS avg_days,
+                       MIN({days}) AS min_days,
+                       MAX({days}) AS max_days
+                FROM patients
+                WHERE {' AND '.join(conditions)}
+                GROUP BY {year}, {month}
+                ORDER BY year, month
+            """, params)
+            rows = cursor.fetchall()
+        return [{
+            'month': f"{row['year']:04d}-{row['month']:02d}",
+            'reports': row['reports'],
+            'avg_days': round(float(row['avg_days']), 1),
+            'min_days': row['min_days'],
+            'max_days': row['max_days'],
+        } for row in rows]
+
+    def get_uploaded_files(self, lab_numbers):
+        """
+        normalized lab number -> uploaded file (file_name, report_summary,
+        summary_source_hash, summary_version) for many lab numbers in one query
+        """
+        keys = sorted({normalize_lab_number(lab_number) for lab_number in lab_numbers if lab_number})
+        if not keys:
+            return {}
+        with self.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT lab_number, file_name, report_summary, summary_source_hash, summary_version
+                FROM uploaded_files
+                WHERE lab_number IN ({', '.join(['%s'] * len(keys))})
+                ORDER BY id
+            """, keys)
+            files = {}
+            for row in cursor.fetchall():
+                # Same as get_uploaded_file_path: the first upload wins
+                files.setdefault(normalize_lab_number(row['lab_number']), row)
+            return files
+
+    def get_variants(self, lab_number):
+        """Stored variants of a patient (lab number or IM lab number), in sheet order"""
+        key = normalize_lab_number(lab_number)
+        with self.get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT * FROM variants
+                WHERE lab_number = %s
+                ORDER BY upload_id, source_row
+            """, (key,))
+            return cursor.fetchall()
+
+    @_returns_on_error(False, "Error saving upload summaries",
+                       context=lambda arguments: {'count': len(arguments['summaries'])})
+    def save_upload_summaries(self, summaries):
+        """Store precomputed report summaries, summaries is a list of (file_name, summary, source_hash, version)"""
+        if not summaries:
+            return True
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                UPDATE uploaded_files
+                SET report_summary = %s, summary_source_hash = %s, summary_version = %s
+                WHERE file_name = %s
+            """, [(summary, source_hash, version, file_name) for file_name, summary, source_hash, version in summaries])
+            conn.commit()
+            return True
+
+    @_returns_on_error(None, "Error getting findings summary", context=_lab_number)
     def get_findings_summary(self, lab_number):
         """Get findings summary for a specific lab number"""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT findings_summary 
-                    FROM patients 
-                    WHERE lab_number = %s OR im_lab_number = %s
-                """, (lab_number, lab_number))
-                result = cursor.fetchone()
-                return result[0] if result else None
-        except Exception as e:
-            print(f"Error getting findings summary: {str(e)}")
-            return None
+        key = normalize_lab_number(lab_number)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT findings_summary 
+                FROM patients 
+                WHERE lab_key = %s OR im_lab_key = %s
+            """, (key, key))
+            result = cursor.fetchone()
+            return result[0] if result else None
 
+    @_returns_on_error(False, "Error saving uploaded file", context=_lab_number)
     def save_uploaded_file(self, file_type, file_name, lab_number):
         """
         Save uploaded file information to the database.
+        Returns the new uploaded_files id, or False on error.
         """
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                query = """
-                    INSERT INTO uploaded_files (file_type, file_name, lab_number, upload_date)
-                    VALUES (%s, %s, %s, NOW())
-                """
-                cursor.execute(query, (file_type, file_name, lab_number))
-                conn.commit()
-                print(f"Debug: File information saved to database: {file_name}, {lab_number}")  # Debug print
-                return True
-        except Exception as e:
-            print(f"Error saving uploaded file: {str(e)}")  # Debug print
-            return False
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            query = """
+                INSERT INTO uploaded_files (file_type, file_name, lab_number, upload_date)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+            """
+            cursor.execute(query, (file_type, file_name, lab_number))
+            conn.commit()
+            logger.debug("Uploaded file saved", extra={'file_name': file_name, 'lab_number': lab_number})
+            return cursor.lastrowid
 
+    @_returns_on_error(None, "Error fetching uploaded file path", context=_lab_number)
     def get_uploaded_file_path(self, lab_number):
         """
         Fetch the file path of the uploaded singleton or trio file for a specific patient.
         """
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                query = """
-                    SELECT file_name
-                    FROM uploaded_files
-                    WHERE lab_number = %s
-                    LIMIT 1
-                """
-                cursor.execute(query, (lab_number,))
-                result = cursor.fetchone()
-                print(f"Debug: Fetched file for lab number {lab_number}: {result}")  # Debug print
-                if result:
-                    return result[0]  # Return the file name if it exists
-                return None
-        except Exception as e:
-            print(f"Error fetching uploaded file path for lab number {lab_number}: {str(e)}")
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            query = """
+                SELECT file_name
+                FROM uploaded_files
+                WHERE lab_number = %s
+                LIMIT 1
+            """
+            cursor.execute(query, (lab_number,))
+            result = cursor.fetchone()
+            logger.debug("Fetched uploaded file", extra={'lab_number': lab_number, 'found': result is not None})
+            if result:
+                return result[0]  # Return the file name if it exists
             return None
\ No newline at end of file
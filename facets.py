@@ -0,0 +1,141 @@
+"""
+Cached filter facets for the patient table.
+
+The distinct values (with counts) of each filter column are loaded from the
+database once with GROUP BY and then kept up to date by DatabaseManager as
+patients are added, updated and deleted, so serving the dropdowns costs
+O(distinct values) instead of a scan over every patient. Only low
+cardinality columns are faceted; lab numbers and names are filtered by
+typed value.
+
+A writer takes generation() before its transaction and passes it with the
+change after the commit. If the counts were (re)loaded in between, the load
+may or may not have seen the change, so the cache is dropped instead of
+counting it twice. Writes made by other processes are noticed through the
+data_versions counter.
+"""
+import threading
+import time
+from collections import Counter
+
+# Response key -> patients column
+FACET_COLUMNS = {
+    'test_types': 'type_of_test',
+    'findings': 'type_of_findings',
+}
+
+
+class FacetCache:
+    def __init__(self, load_counts, max_age=300, version=None):
+        """
+        load_counts(column) must return (value, count) pairs for one column.
+        version() returns the database's patients change counter (see
+        data_versions.py); the counts are reloaded when it moves on because
+        of a write made by another process. max_age (seconds) bounds how
+        stale the cache can get otherwise.
+        """
+        self._load_counts = load_counts
+        self._version = version
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._counts = None
+        self._loaded_at = 0
+        self._loaded_version = None
+        self._snapshot = None
+        self._generation = 0
+
+    def _changed_elsewhere(self):
+        current = self._version() if self._version is not None else None
+        return current is not None and current != self._loaded_version
+
+    def _ensure_loaded(self):
+        if (self._counts is not None and time.monotonic() - self._loaded_at < self.max_age
+                and not self._changed_elsewhere()):
+            return
+        self._generation += 1
+        # Read before the counts: a write in between only causes another reload
+        loaded_version = self._version() if self._version is not None else None
+        counts = {}
+        for column in FACET_COLUMNS.values():
+            counts[column] = Counter({value: count for value, count in self._load_counts(column) if value is not None})
+        self._counts = counts
+        self._loaded_at = time.monotonic()
+        self._loaded_version = loaded_version
+        self._snapshot = None
+
+    def get(self):
+        """{response key: [{'value': ..., 'count': ...}, ...]} sorted by value"""
+        with self._lock:
+            self._ensure_loaded()
+            if self._snapshot is None:
+                self._snapshot = {
+                    key: [{'value': value, 'count': count}
+                          for value, count in sorted(self._counts[column].items(), key=lambda item: str(item[0]))]
+                    for key, column in FACET_COLUMNS.items()
+                }
+            return self._snapshot
+
+    def generation(self):
+        """Token for a change about to be made, see record_added() / records_removed() / values_changed()"""
+        with self._lock:
+            return self._generation
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+            self._snapshot = None
+
+    def _current(self, generation):
+        """True if the counts can take a change made since generation; drops them if a load overlapped it"""
+        if self._counts is None:
+            return False
+        if generation != self._generation:
+            self.invalidate()
+            return False
+        return True
+
+    def _applied(self, version):
+        """
+        After applying a change committed at version: the counts are now at
+        that version, unless another process wrote since they were loaded
+        """
+        if version is not None and self._loaded_version is not None and version == self._loaded_version + 1:
+            self._loaded_version = version
+
+    def _apply(self, column, value, delta):
+        if value is None or column not in self._counts:
+            return
+        counter = self._counts[column]
+        counter[value] += delta
+        if counter[value] <= 0:
+            del counter[value]
+        self._snapshot = None
+
+    def record_added(self, record, generation, version=None):
+        """record: dict of patients columns for a newly inserted row"""
+        with self._lock:
+            if not self._current(generation):
+                return
+            for column in FACET_COLUMNS.values():
+                self._apply(column, record.get(column), 1)
+            self._applied(version)
+
+    def records_removed(self, records, generation, version=None):
+        with self._lock:
+            if not self._current(generation):
+                return
+            for record in records:
+                for column in FACET_COLUMNS.values():
+                    self._apply(column, record.get(column), -1)
+            self._applied(version)
+
+    def values_changed(self, column, old_values, new_value, generation, version=None):
+        """column changed from each of old_values (one per row) to new_value"""
+        with self._lock:
+            if not self._current(generation):
+                return
+            for old_value in old_values:
+                if old_value != new_value:
+                    self._apply(column, old_value, -1)
+                    self._apply(column, new_value, 1)
+            self._applied(version)
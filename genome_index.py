@@ -0,0 +1,298 @@
+"""
+In-memory genomic position index over the stored variants.
+
+GenomeIndex keeps, per chromosome, a sorted array of positions with the
+matching variant ids, so a region query is two binary searches. It is
+brought up to date incrementally: variant ids only grow, so sync() loads
+just the rows with an id above the highest one indexed. Variants are only
+deleted when an upload is loaded again, which moves the 'variants' change
+counter (data_versions.py); a counter different from the one the index was
+built at (a replaced upload, or a recreated database) rebuilds the index.
+Rows deleted by hand are skipped when the variants are fetched by id.
+The arrays are pickled to a file every few minutes and at shutdown, so a
+new process only loads the variants added since.
+
+The index also keeps the panel gene coordinates (gene -> chr, start, end)
+taken from the 'Region' / 'Name' coverage sheet of the uploaded workbooks,
+for "variants in gene X" overlap queries. They are saved to their own small
+file whenever they change.
+
+Rebuild it from scratch with:
+
+    python genome_index.py --rebuild
+"""
+import argparse
+import logging
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from variant_processing import split_chr_pos
+
+logger = logging.getLogger(__name__)
+
+
+def split_regions(values):
+    """
+    Series of 'chr7:1,000,000-2,000,000' strings -> DataFrame of chr, start
+    and end, with the rows that aren't a region dropped
+    """
+    parts = values.astype(str).str.replace(',', '', regex=False).str.rsplit('-', n=1, expand=True)
+    parts = parts.reindex(columns=[0, 1])
+    regions = split_chr_pos(parts[0]).rename(columns={'pos': 'start'})
+    regions['end'] = pd.to_numeric(parts[1].astype(str).str.strip(), errors='coerce')
+    regions = regions.dropna()
+    regions = regions[regions['end'] >= regions['start']]
+    return regions.astype({'start': np.int64, 'end': np.int64})
+
+
+def parse_region(region):
+    """'chr7:1,000,000-2,000,000' -> ('7', 1000000, 2000000)"""
+    regions = split_regions(pd.Series([region]))
+    if regions.empty:
+        raise ValueError(f"Invalid region: {region}")
+    chr, start, end = regions.iloc[0]
+    return chr, int(start), int(end)
+
+
+def read_panel_regions(path, max_header_rows=5):
+    """
+    (chr, start, end, gene) of every target region in a workbook's coverage
+    sheet (the sheet with 'Region' and 'Name' columns), [] if it has none.
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            for header_row, header in enumerate(sheet.iter_rows(max_row=max_header_rows, values_only=True), start=1):
+                names = [str(name).strip() if name is not None else None for name in header]
+                if 'Region' in names and 'Name' in names:
+                    break
+            else:
+                continue
+            region_col, name_col = names.index('Region'), names.index('Name')
+            rows = [
+                (row[region_col], str(row[name_col]).strip())
+                for row in sheet.iter_rows(min_row=header_row + 1, max_col=max(region_col, name_col) + 1, values_only=True)
+                if len(row) > max(region_col, name_col) and row[name_col] and row[region_col] is not None
+            ]
+            if not rows:
+                return []
+            regions = split_regions(pd.Series([region for region, _ in rows]))
+            return [(chr, int(start), int(end), rows[i][1])
+                    for i, chr, start, end in regions.itertuples(name=None)]
+        return []
+    finally:
+        workbook.close()
+
+
+def _widen_panel(panel, regions):
+    """Copy of panel with each gene's span widened to cover these (chr, start, end, gene) regions"""
+    panel = dict(panel)
+    for chr, start, end, gene in regions:
+        if gene in panel and panel[gene][0] == chr:
+            _, old_start, old_end = panel[gene]
+            start, end = min(start, old_start), max(end, old_end)
+        panel[gene] = (chr, start, end)
+    return panel
+
+
+class GenomeIndex:
+    def __init__(self, path, load_since, max_age=60, load_generation=None, save_interval=300):
+        """
+        load_since(after_id) must return (id, chr, pos) rows of the variants
+        with an id above after_id, and load_generation() the variants change
+        counter (see data_versions.py). max_age (seconds) is how often
+        lookups pick up variants added by other processes; the variant
+        arrays are written to the file at most every save_interval seconds
+        and by save(), the panel whenever it changes.
+        """
+        self.path = path
+        self.panel_path = f"{path}.panel" if path else None
+        self._load_since = load_since
+        self._load_generation = load_generation
+        self.max_age = max_age
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._chroms = {}       # chr -> (positions, ids), both sorted by (pos, id)
+        self._panel = {}        # gene -> (chr, start, end)
+        self._max_id = 0
+        self._generation = None
+        self._synced_at = 0
+        self._saved_at = time.monotonic()
+        self._unsaved = False
+        self._load_file()
+
+    def _read_file(self, path):
+        """The object pickled at path, or None"""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning("Error reading genome index: %s", e, extra={'path': path})
+            return None
+
+    def _write_file(self, path, state):
+        # Write then rename so another process never reads half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def _load_file(self):
+        state = self._read_file(self.path)
+        if isinstance(state, dict) and {'chroms', 'max_id', 'generation'} <= state.keys():
+            self._chroms, self._max_id, self._generation = state['chroms'], state['max_id'], state['generation']
+        panel = self._read_file(self.panel_path)
+        if isinstance(panel, dict):
+            self._panel = panel
+
+    def _save_variants(self, force=False):
+        """Write the variant arrays if they changed and save_interval has passed (or force)"""
+        if not self.path or not self._unsaved:
+            return
+        if not force and time.monotonic() - self._saved_at < self.save_interval:
+            return
+        self._write_file(self.path, {'chroms': self._chroms, 'max_id': self._max_id, 'generation': self._generation})
+        self._saved_at = time.monotonic()
+        self._unsaved = False
+
+    def save(self):
+        """Write unsaved variant arrays now, e.g. at shutdown"""
+        with self._lock:
+            self._save_variants(force=True)
+
+    def _merge(self, rows):
+        """New (chroms, max_id) with rows merged in; the current arrays are left untouched for readers"""
+        by_chr = {}
+        max_id = self._max_id
+        for variant_id, chr, pos in rows:
+            by_chr.setdefault(chr, []).append((pos, variant_id))
+            max_id = max(max_id, variant_id)
+        chroms = dict(self._chroms)
+        for chr, entries in by_chr.items():
+            added = np.array(entries, dtype=np.int64)
+            positions, ids = chroms.get(chr, (np.empty(0, np.int64), np.empty(0, np.int64)))
+            positions = np.concatenate([positions, added[:, 0]])
+            ids = np.concatenate([ids, added[:, 1]])
+            order = np.lexsort((ids, positions))
+            chroms[chr] = (positions[order], ids[order])
+        return chroms, max_id
+
+    def sync(self):
+        """
+        Index the variants added since the last sync, returns how many were
+        added (all of them when the index had to be rebuilt)
+        """
+        with self._lock:
+            generation = self._load_generation() if self._load_generation is not None else None
+            if generation != self._generation:
+                if self._max_id:
+                    logger.warning("Stored variants were replaced or the database recreated, rebuilding the genome index",
+                                   extra={'path': self.path, 'max_id': int(self._max_id)})
+                return self._rebuild(generation)
+            rows = list(self._load_since(self._max_id))
+            if rows:
+                self._chroms, self._max_id = self._merge(rows)
+                self._unsaved = True
+            self._save_variants()
+            self._synced_at = time.monotonic()
+            return len(rows)
+
+    def rebuild(self):
+        """Re-index every variant and save the index, returns the number indexed"""
+        with self._lock:
+            generation = self._load_generation() if self._load_generation is not None else None
+            count = self._rebuild(generation)
+            self._save_variants(force=True)
+            return count
+
+    def _rebuild(self, generation):
+        # generation is read before the rows, so a change in between causes another rebuild
+        self._chroms, self._max_id = {}, 0
+        rows = list(self._load_since(0))
+        self._chroms, self._max_id = self._merge(rows)
+        self._generation = generation
+        self._unsaved = True
+        self._save_variants()
+        self._synced_at = time.monotonic()
+        return len(rows)
+
+    def add_panel_regions(self, regions):
+        """Widen each gene's panel span to cover these (chr, start, end, gene) regions and save the panel"""
+        with self._lock:
+            self._panel = _widen_panel(self._panel, regions)
+            if not self.panel_path:
+                return
+            # Other processes may have added panel regions since this one loaded the file
+            saved = self._read_file(self.panel_path)
+            if isinstance(saved, dict):
+                self._panel = _widen_panel(self._panel, [(chr, start, end, gene)
+                                                         for gene, (chr, start, end) in saved.items()])
+            self._write_file(self.panel_path, self._panel)
+
+    def gene_region(self, gene):
+        """(chr, start, end) of a panel gene, or None"""
+        return self._panel.get(gene.strip()) or self._panel.get(gene.strip().upper())
+
+    def query(self, chr, start, end, limit=None, after=None):
+        """
+        (pos, variant id) pairs on chr within [start, end], in position order.
+        after is the (pos, id) of the last pair of the previous page.
+        """
+        if time.monotonic() - self._synced_at >= self.max_age:
+            self.sync()
+        positions, ids = self._chroms.get(str(chr).upper(), (None, None))
+        if positions is None:
+            return []
+        lo = np.searchsorted(positions, start, side='left')
+        hi = np.searchsorted(positions, end, side='right')
+        if after is not None:
+            last_pos, last_id = after
+            lo = max(lo, np.searchsorted(positions, last_pos, side='left'))
+            while lo < hi and positions[lo] == last_pos and ids[lo] <= last_id:
+                lo += 1
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return list(zip(positions[lo:hi].tolist(), ids[lo:hi].tolist()))
+
+    def stats(self):
+        return {
+            'variants': int(sum(len(positions) for positions, _ in self._chroms.values())),
+            'chromosomes': len(self._chroms),
+            'panel_genes': len(self._panel),
+            'max_id': int(self._max_id),
+        }
+
+
+def main():
+    import logs
+    from db_utils import DatabaseManager
+
+    logs.configure(fmt='text')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help='re-index every variant and panel region')
+    parser.add_argument('--path', default=os.getenv('GENOME_INDEX_PATH', 'genome_index.pkl'))
+    parser.add_argument('--uploads', default='uploads', help='folder with the uploaded variant files')
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    db = DatabaseManager()
+    index = GenomeIndex(args.path, db.get_variant_positions, load_generation=db.variants_version)
+    print(f"Indexed {index.rebuild()} variants")
+    for name in sorted(os.listdir(args.uploads)):
+        if name.endswith(('.xlsx', '.xls')):
+            index.add_panel_regions(read_panel_regions(os.path.join(args.uploads, name)))
+    print(f"Genome index: {index.stats()}")
+
+
+if __name__ == '__main__':
+    main()
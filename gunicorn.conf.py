@@ -0,0 +1,43 @@
+"""
+gunicorn settings for patient_info:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+WEB_WORKERS processes (default 2 per CPU + 1) with WEB_THREADS request
+threads each (default 4), listening on WEB_BIND (default 0.0.0.0:8000).
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('WEB_THREADS', 4))
+worker_class = 'gthread'
+
+# Report rendering and index loads on start-up can take a while at 100k patients
+timeout = int(os.getenv('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+
+# Every worker imports the app after the fork: pools, caches, job threads and
+# indexes are never shared between processes
+preload_app = False
+
+
+def on_starting(server):
+    """Apply pending migrations once, before any worker starts"""
+    from migrations import ensure_schema
+    from storage import get_backend
+
+    try:
+        conn = get_backend().connect()
+        try:
+            versions = ensure_schema(conn)
+        finally:
+            conn.close()
+    except Exception:
+        # Workers try again themselves, and report not ready until the schema is current
+        server.log.exception("Error applying migrations")
+        return
+    server.log.info(f"Applied migrations: {versions}" if versions else "Schema is up to date")
+    # Inherited by the workers (wsgi.py)
+    os.environ['MIGRATE_ON_START'] = '0'
@@ -0,0 +1,130 @@
+"""
+Background jobs for slow request work (parsing and loading variant files).
+
+JobQueue runs submitted functions on a thread pool and records each job's
+state in a small SQLite file, so /jobs/<id> can report progress from any
+worker process and finished jobs survive a restart. Jobs that were still
+queued or running in a process that no longer exists are marked failed on
+startup.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+JOB_FIELDS = ['id', 'kind', 'status', 'message', 'result', 'created_at', 'started_at', 'finished_at']
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _pid_alive(pid):
+    """Whether a local process with this pid still exists (other workers may share the job store)"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, db_path='jobs.sqlite3', workers=2):
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    message TEXT,
+                    result TEXT,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    pid INTEGER
+                )
+            """)
+            unfinished = conn.execute(
+                "SELECT id, pid FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+            for job_id, pid in unfinished:
+                if not _pid_alive(pid):
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, message = ?, finished_at = ? WHERE id = ?",
+                        (FAILED, 'Interrupted by a restart', _now(), job_id)
+                    )
+
+    def _connect(self):
+        """One SQLite connection per thread; `with` commits the statement"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _update(self, job_id, **fields):
+        assignments = ', '.join(f"{field} = ?" for field in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", tuple(fields.values()) + (job_id,))
+
+    def submit(self, kind, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) and return the job id. The job succeeds
+        if func returns without raising; a (JSON serializable) return value
+        is stored as the job result. func may return (False, message) to
+        report a failure without raising.
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, created_at, pid) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, _now(), os.getpid())
+            )
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        self._update(job_id, status=RUNNING, started_at=_now())
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            logger.exception("Error in job", extra={'job_id': job_id})
+            self._update(job_id, status=FAILED, message=str(e), finished_at=_now())
+            return
+        if isinstance(result, tuple) and len(result) == 2 and result[0] is False:
+            self._update(job_id, status=FAILED, message=result[1], finished_at=_now())
+        else:
+            self._update(job_id, status=SUCCEEDED, result=json.dumps(result, default=str), finished_at=_now())
+
+    def get(self, job_id):
+        """Job as a dict, or None if there is no such job"""
+        row = self._connect().execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,211 @@
+"""
+Structured logging for the app and the command line tools.
+
+configure() routes the standard logging module through a bounded queue to
+a background thread that formats and writes the records, so a request
+thread only pays for putting a record on the queue; when the queue is full
+the record is dropped and counted instead of blocking. Records are written
+as one JSON object per line (LOG_FORMAT=text for plain lines) with the
+fields passed in `extra`:
+
+    logger = logging.getLogger(__name__)
+    logger.info("Variants stored", extra={'lab_number': lab_number, 'count': count})
+
+Patient identifying fields (patient_name, hkid, dob, ...) are redacted
+by field name, HKID numbers are masked in messages and tracebacks, and
+DataFrames or long lists are logged as their size only.
+
+Per-row events (one per imported row, say) pass extra={'sample': key}:
+the first SAMPLE_FIRST records of each key are kept, then one in
+SAMPLE_EVERY, each with the running count of records seen for the key.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+
+import metrics
+
+# Field names whose values never reach the log
+PHI_FIELDS = {
+    'patient', 'patient_name', 'hkid', 'dob', 'born_on', 'sex', 'age',
+    'ethnicity', 'case_history', 'clinical_history',
+}
+
+REDACTED = '[REDACTED]'
+
+# HKID: one or two letters, six digits and a check digit, e.g. A123456(7)
+HKID_PATTERN = re.compile(r'\b[A-Z]{1,2}[0-9]{6}\s*\(?[0-9A]\)?')
+
+# Longer lists and any DataFrame / Series are logged as their size
+MAX_ITEMS = 20
+
+SAMPLE_FIRST = 10
+SAMPLE_EVERY = 100
+
+QUEUE_SIZE = 10000
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+LOG_DROPPED = metrics.REGISTRY.register(metrics.Counter(
+    'log_records_dropped_total', 'Log records dropped because the log queue was full'))
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def redact_text(text):
+    return HKID_PATTERN.sub('[HKID]', text)
+
+
+def redact_value(key, value):
+    """value as it may appear in the log under this field name"""
+    if key in PHI_FIELDS:
+        return REDACTED
+    if hasattr(value, 'shape') and hasattr(value, 'columns'):
+        return f"<DataFrame {value.shape[0]} rows x {value.shape[1]} columns>"
+    if hasattr(value, 'shape') and hasattr(value, 'dtype'):
+        return f"<{type(value).__name__} of {len(value)}>"
+    if isinstance(value, dict):
+        return {k: redact_value(k, v) for k, v in list(value.items())[:MAX_ITEMS]}
+    if isinstance(value, (list, tuple, set)):
+        if len(value) > MAX_ITEMS:
+            return f"<{type(value).__name__} of {len(value)} items>"
+        return [redact_value(key, item) for item in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return redact_text(str(value))
+
+
+def record_fields(record):
+    """The `extra` fields of a record, redacted"""
+    return {key: redact_value(key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact_text(record.getMessage()),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exc'] = redact_text(self.formatException(record.exc_info))
+        elif record.exc_text:
+            entry['exc'] = redact_text(record.exc_text)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = redact_text(super().format(record))
+        fields = record_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={json.dumps(value, default=str)}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps the first `first` records of each sample key, then one in `every`"""
+
+    def __init__(self, first=SAMPLE_FIRST, every=SAMPLE_EVERY):
+        super().__init__()
+        self.first = first
+        self.every = every
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None:
+            return True
+        with self._lock:
+            seen = self._seen[key] = self._seen.get(key, 0) + 1
+        record.sample_count = seen
+        return seen <= self.first or seen % self.every == 0
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records when the queue is full. In a forked
+    child (report worker processes) nothing drains the queue, so records
+    are written directly with the fallback handler.
+    """
+
+    def __init__(self, log_queue, fallback):
+        super().__init__(log_queue)
+        self.fallback = fallback
+        self._pid = os.getpid()
+
+    def emit(self, record):
+        if os.getpid() != self._pid:
+            self.fallback.handle(record)
+            return
+        super().emit(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+    def prepare(self, record):
+        # Merge the args into the message now; the traceback is kept apart (as text, the frames
+        # can't wait for the listener thread) so the formatter can put it in its own field
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure(level=None, fmt=None, stream=None):
+    """
+    Send the root logger through the log queue. LOG_LEVEL (default INFO)
+    and LOG_FORMAT (json or text) are read from the environment unless
+    given. Safe to call more than once; later calls only change the level.
+    """
+    global _listener
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    root = logging.getLogger()
+    root.setLevel(level)
+    with _configure_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(TextFormatter() if (fmt or os.getenv('LOG_FORMAT', 'json')) == 'text' else JsonFormatter())
+        handler = NonBlockingQueueHandler(queue.Queue(QUEUE_SIZE), output)
+        handler.addFilter(SamplingFilter())
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Write out the queued records and stop the log thread"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
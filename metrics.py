@@ -0,0 +1,197 @@
+"""
+In-process latency and counter metrics, served at /metrics in the
+Prometheus text format.
+
+Latencies are kept as summaries: a count and sum since start plus the
+p50 / p95 / p99 of the latest WINDOW samples of each label set, which is
+what worker sizing and regression hunting need without a client library.
+Each worker process keeps its own numbers; Prometheus adds them up per
+instance.
+
+    with metrics.DB_SECONDS.time(method='get_patient'):
+        ...
+
+    @metrics.timed(metrics.REPORT_SECONDS, step='create_word_document')
+    def create_word_document(...):
+        ...
+"""
+import functools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Latest samples per label set used for the quantiles
+WINDOW = 1024
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, state in series:
+            lines.extend(self._render_series(values, state))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, values, count):
+        return [f"{self.name}{_label_text(self.labelnames, values)} {_format_value(count)}"]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Summary(_Metric):
+    kind = 'summary'
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = [0, 0.0, deque(maxlen=WINDOW)]
+            state[0] += 1
+            state[1] += seconds
+            state[2].append(seconds)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, values, state):
+        count, total, window = state
+        samples = sorted(window)
+        lines = []
+        for quantile in QUANTILES:
+            # Nearest rank
+            value = samples[max(math.ceil(quantile * len(samples)) - 1, 0)] if samples else float('nan')
+            labels = _label_text(self.labelnames, values, [('quantile', quantile)])
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        labels = _label_text(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HTTP_SECONDS = REGISTRY.register(Summary(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests', ['method', 'route', 'status']))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests handled', ['method', 'route', 'status']))
+HTTP_IN_PROGRESS = REGISTRY.register(Gauge(
+    'http_requests_in_progress', 'HTTP requests being handled right now'))
+DB_SECONDS = REGISTRY.register(Summary(
+    'db_call_duration_seconds', 'Time spent in DatabaseManager methods', ['method']))
+DB_ERRORS = REGISTRY.register(Counter(
+    'db_call_errors_total', 'DatabaseManager calls that failed, raised or caught', ['method']))
+EXCEL_SECONDS = REGISTRY.register(Summary(
+    'excel_read_duration_seconds', 'Time spent parsing Excel workbooks', ['reader']))
+WORKBOOK_CACHE = REGISTRY.register(Counter(
+    'workbook_cache_lookups_total', 'Parsed workbook lookups by where they were found', ['result']))
+REPORT_SECONDS = REGISTRY.register(Summary(
+    'report_duration_seconds', 'Time spent producing patient reports', ['step']))
+
+
+def timed(summary, **labels):
+    """Decorator observing each call's duration in summary"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with summary.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed_methods(summary, errors=None, label='method'):
+    """
+    Class decorator timing every public method in summary (labelled with
+    the method name), counting the calls that raise in errors.
+    """
+    def wrap(name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**{label: name})
+                raise
+            finally:
+                summary.observe(time.perf_counter() - started, **{label: name})
+        return wrapper
+
+    def decorate(cls):
+        for name, value in list(vars(cls).items()):
+            if not name.startswith('_') and callable(value):
+                setattr(cls, name, wrap(name, value))
+        return cls
+    return decorate
@@ -0,0 +1,254 @@
+"""
+Schema migrations for patients_db.
+
+Each migration runs once and is recorded in the schema_migrations table, so
+apply_migrations() is safe to call on every start-up or after
+database_setup.initialize_database(). Tables, columns and indexes are
+defined in schema.py, so the same migrations build the schema on MySQL and
+SQLite (see storage.py).
+"""
+import logging
+
+import storage
+from data_versions import VARIANTS, seed_version
+from patient_dates import TYPED_DATE_COLUMNS, backfill_typed_dates, refresh_date_quarantine
+from schema import INDEXES, column_sql, create_index_sql, create_table_sql
+
+
+logger = logging.getLogger(__name__)
+
+# (table, column) -> count, per dialect
+COLUMN_EXISTS_SQL = {
+    'mysql': """
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """,
+    'sqlite': "SELECT COUNT(*) FROM pragma_table_xinfo(%s) WHERE name = %s",
+}
+
+# (table, index) -> count, per dialect
+INDEX_EXISTS_SQL = {
+    'mysql': """
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """,
+    'sqlite': "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+}
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute(COLUMN_EXISTS_SQL[storage.dialect(cursor)], (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute(INDEX_EXISTS_SQL[storage.dialect(cursor)], (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def _create_table(cursor, table):
+    cursor.execute(create_table_sql(table, storage.dialect(cursor)))
+
+
+def _add_column(cursor, table, column):
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column_sql(table, column, storage.dialect(cursor))}")
+
+
+def _add_index(cursor, index):
+    if not _index_exists(cursor, INDEXES[index][0], index):
+        cursor.execute(create_index_sql(index, storage.dialect(cursor)))
+
+
+def migrate_lab_number_keys(cursor):
+    """
+    lab_number / im_lab_number are VARCHAR(1000) and too wide to index, so
+    add short normalized copies maintained by the database and index those.
+    """
+    _add_column(cursor, 'patients', 'lab_key')
+    _add_column(cursor, 'patients', 'im_lab_key')
+    _add_index(cursor, 'idx_patients_lab_key')
+    _add_index(cursor, 'idx_patients_im_lab_key')
+
+    # Uploaded file lookups filter on lab_number too
+    _create_table(cursor, 'uploaded_files')
+    _add_index(cursor, 'idx_uploaded_files_lab_number')
+
+
+def migrate_patient_list_indexes(cursor):
+    """Indexes behind the filters and sort orders of the paged patient table"""
+    _add_index(cursor, 'idx_patients_name')
+    _add_index(cursor, 'idx_patients_type_of_test')
+    _add_index(cursor, 'idx_patients_type_of_findings')
+    _add_index(cursor, 'idx_patients_created_at')
+
+
+def migrate_patient_sync_keys(cursor):
+    """
+    Unique patient key (lab key + IM lab key) and a hash of the source row,
+    used by the incremental master list sync.
+    """
+    _add_column(cursor, 'patients', 'patient_key')
+    _add_column(cursor, 'patients', 'row_hash')
+    cursor.execute("""
+        SELECT patient_key, COUNT(*) FROM patients
+        GROUP BY patient_key HAVING COUNT(*) > 1
+    """)
+    duplicates = cursor.fetchall()
+    if duplicates:
+        raise Exception(
+            f"{len(duplicates)} lab number pairs appear more than once in patients "
+            f"(e.g. {duplicates[0][0]}); remove the duplicates and run the migrations again"
+        )
+    _add_index(cursor, 'uq_patients_patient_key')
+
+
+def migrate_upload_summaries(cursor):
+    """
+    Report findings summary computed when a variant file is ingested, with
+    the hash of the file and the summary rules version it was built from.
+    """
+    _add_column(cursor, 'uploaded_files', 'report_summary')
+    _add_column(cursor, 'uploaded_files', 'summary_source_hash')
+    _add_column(cursor, 'uploaded_files', 'summary_version')
+    _add_index(cursor, 'idx_uploaded_files_file_name')
+
+
+def migrate_variant_store(cursor):
+    """
+    Normalized variants of uploaded singleton / trio files, tied to the
+    upload and the patient's lab number, with one row per gene symbol in
+    variant_genes.
+    """
+    _create_table(cursor, 'variants')
+    _add_index(cursor, 'uq_variants_upload_row')
+    _add_index(cursor, 'idx_variants_lab_number')
+    _add_index(cursor, 'idx_variants_chr_pos')
+    _add_index(cursor, 'idx_variants_classification')
+    _create_table(cursor, 'variant_genes')
+    _add_index(cursor, 'idx_variant_genes_variant')
+
+
+def migrate_variant_query_indexes(cursor):
+    """Indexes behind the remaining cross-patient variant filters"""
+    _add_index(cursor, 'idx_variants_zygosity')
+
+
+def migrate_typed_dates(cursor):
+    """
+    DATE copies of the text date columns, parsed from the existing rows,
+    with the values that aren't dates listed in date_quarantine.
+    """
+    for typed in TYPED_DATE_COLUMNS:
+        _add_column(cursor, 'patients', typed)
+    _create_table(cursor, 'date_quarantine')
+    logger.info("Parsed patient dates", extra={'count': backfill_typed_dates(cursor)})
+    logger.info("Quarantined date values that could not be parsed", extra={'count': refresh_date_quarantine(cursor)})
+    _add_index(cursor, 'idx_patients_report_on')
+    _add_index(cursor, 'idx_patients_collected_on')
+    _add_index(cursor, 'idx_patients_arrived_on')
+
+
+def migrate_upload_tables(cursor):
+    """
+    Columns and tables the upload and findings code writes to that no
+    migration created: patients.findings_summary and the raw singleton /
+    trio sheet tables.
+    """
+    _add_column(cursor, 'patients', 'findings_summary')
+    _create_table(cursor, 'singleton')
+    _create_table(cursor, 'trio')
+
+
+def migrate_data_versions(cursor):
+    """
+    Change counter of the patients table, so every app process notices
+    writes made by the others and reloads its caches.
+    """
+    _create_table(cursor, 'data_versions')
+    seed_version(cursor)
+
+
+def migrate_variants_version(cursor):
+    """
+    Change counter of the variants table, so the genome index notices
+    replaced uploads and a recreated database.
+    """
+    seed_version(cursor, VARIANTS)
+
+
+# (version, description, function) - append only, never reorder
+MIGRATIONS = [
+    (1, 'Normalized, indexed lab number keys', migrate_lab_number_keys),
+    (2, 'Patient table filter and sort indexes', migrate_patient_list_indexes),
+    (3, 'Unique patient key and source row hash', migrate_patient_sync_keys),
+    (4, 'Precomputed report summaries on uploaded files', migrate_upload_summaries),
+    (5, 'Normalized variant store', migrate_variant_store),
+    (6, 'Variant zygosity index', migrate_variant_query_indexes),
+    (7, 'Typed patient date columns and date quarantine', migrate_typed_dates),
+    (8, 'Findings summary and raw variant sheet tables', migrate_upload_tables),
+    (9, 'Patients change counter for cache invalidation', migrate_data_versions),
+    (10, 'Variants change counter for the genome index', migrate_variants_version),
+]
+
+
+def get_schema_version(cursor):
+    _create_table(cursor, 'schema_migrations')
+    cursor.execute("SELECT MAX(version) FROM schema_migrations")
+    return cursor.fetchone()[0] or 0
+
+
+def apply_migrations(conn):
+    """Apply every pending migration in order, returns the list of versions applied"""
+    cursor = conn.cursor()
+    applied = []
+    try:
+        current = get_schema_version(cursor)
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info("Applying migration %s: %s", version, description)
+            migrate(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            conn.commit()
+            applied.append(version)
+        return applied
+    finally:
+        cursor.close()
+
+
+def schema_status(conn):
+    """(applied version, latest version), read only; raises if the migrations never ran"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_migrations")
+        return cursor.fetchone()[0] or 0, MIGRATIONS[-1][0]
+    finally:
+        cursor.close()
+
+
+def ensure_schema(conn):
+    """apply_migrations() on a database that may be empty (a new SQLite file), creating patients first"""
+    cursor = conn.cursor()
+    try:
+        _create_table(cursor, 'patients')
+        conn.commit()
+    finally:
+        cursor.close()
+    return apply_migrations(conn)
+
+
+if __name__ == '__main__':
+    import logs
+    from db_utils import DatabaseManager
+
+    logs.configure(fmt='text')
+    try:
+        with DatabaseManager().get_connection() as conn:
+            versions = ensure_schema(conn)
+        print(f"Applied migrations: {versions}" if versions else "Schema is up to date")
+    except storage.DATABASE_ERRORS as err:
+        print(f"Migration failed: {err}")
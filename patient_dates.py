@@ -0,0 +1,109 @@
+"""
+Typed copies of the patients date columns.
+
+report_date, dob, specimen_collected and specimen_arrived are TEXT because
+the master list mixes dates with notes ('results passed to Edmund'). Each
+has a DATE column next to it, parsed once when a row is written (and by the
+migration for existing rows), so date ranges, sorting and turnaround times
+are indexed SQL instead of string parsing per request. Text that isn't a
+date is left where it is and listed in date_quarantine for review.
+"""
+from datetime import date, datetime
+
+import pandas as pd
+
+# Text column -> DATE column
+DATE_COLUMNS = {
+    'report_date': 'report_on',
+    'dob': 'born_on',
+    'specimen_collected': 'collected_on',
+    'specimen_arrived': 'arrived_on',
+}
+
+TYPED_DATE_COLUMNS = list(DATE_COLUMNS.values())
+
+# Tried in order; the lab writes dates day first
+DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%Y']
+
+# Dates outside this range are typos, not dates
+MIN_DATE = date(1900, 1, 1)
+MAX_DATE = date(2100, 1, 1)
+
+
+def parse_dates(values):
+    """Series of date text -> Series of datetime.date, None where the text isn't a date"""
+    text = values.astype(str).str.strip()
+    # Second resolution so typos like year 0024 don't overflow
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[s]')
+    for date_format in DATE_FORMATS:
+        pending = parsed.isna()
+        if not pending.any():
+            break
+        parsed[pending] = pd.to_datetime(text[pending], format=date_format, errors='coerce').astype('datetime64[s]')
+    in_range = parsed.notna() & (parsed >= pd.Timestamp(MIN_DATE)) & (parsed < pd.Timestamp(MAX_DATE))
+    return pd.Series(parsed.dt.date.astype(object), index=values.index).where(in_range & values.notna(), None)
+
+
+def parse_date(value):
+    """One value as a datetime.date, or None; the same formats and range as parse_dates()"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if value is None or pd.isna(value):
+        return None
+    text = str(value).strip()
+    for date_format in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+        return parsed if MIN_DATE <= parsed < MAX_DATE else None
+    return None
+
+
+def typed_dates(patients):
+    """DataFrame of the DATE columns for patients rows (a DataFrame with the text columns)"""
+    return pd.DataFrame({
+        typed: parse_dates(patients[column]) if column in patients.columns else None
+        for column, typed in DATE_COLUMNS.items()
+    }, index=patients.index)
+
+
+def with_typed_dates(patient_data):
+    """Copy of a patients row dict with the DATE columns of the text dates it has"""
+    patient_data = dict(patient_data)
+    for column, typed in DATE_COLUMNS.items():
+        if column in patient_data:
+            patient_data[typed] = parse_date(patient_data[column])
+    return patient_data
+
+
+def backfill_typed_dates(cursor, chunk_size=1000):
+    """Parse the text dates of every patients row into the DATE columns, returns the rows updated"""
+    cursor.execute(f"SELECT id, {', '.join(DATE_COLUMNS)} FROM patients")
+    patients = pd.DataFrame(cursor.fetchall(), columns=['id'] + list(DATE_COLUMNS), dtype=object)
+    if patients.empty:
+        return 0
+    typed = typed_dates(patients)
+    typed['id'] = patients['id']
+    rows = list(typed[TYPED_DATE_COLUMNS + ['id']].itertuples(index=False, name=None))
+    sql = f"UPDATE patients SET {', '.join(f'{column} = %s' for column in TYPED_DATE_COLUMNS)} WHERE id = %s"
+    for start in range(0, len(rows), chunk_size):
+        cursor.executemany(sql, rows[start:start + chunk_size])
+    return len(rows)
+
+
+def refresh_date_quarantine(cursor):
+    """
+    Rebuild date_quarantine from the patients whose date text didn't parse,
+    returns the number of values quarantined (caller commits)
+    """
+    cursor.execute("DELETE FROM date_quarantine")
+    selects = " UNION ALL ".join(
+        f"SELECT id, '{column}', {column} FROM patients "
+        f"WHERE {typed} IS NULL AND TRIM(IFNULL({column}, '')) <> ''"
+        for column, typed in DATE_COLUMNS.items()
+    )
+    cursor.execute(f"INSERT INTO date_quarantine (patient_id, column_name, raw_value) {selects}")
+    return cursor.rowcount
@@ -0,0 +1,244 @@
+"""
+Batched import of the IM patient master list into the patients table.
+
+prepare_patients() cleans the whole sheet column-wise with pandas instead of
+row by row, and import_patients() inserts it in chunks with executemany,
+committing once per chunk. sync_patients() does the same as an incremental
+upsert, writing only rows whose source hash changed.
+"""
+import hashlib
+import time
+
+import pandas as pd
+from data_versions import bump_version
+from db_utils import normalize_lab_number
+from storage import DATABASE_ERRORS, dialect
+from patient_dates import TYPED_DATE_COLUMNS, typed_dates
+
+# Master list column -> patients column
+SOURCE_COLUMNS = {
+    'Singe gene Reported date': 'report_date',
+    'Lab. no.': 'lab_number',
+    'IM Lab. no.': 'im_lab_number',
+    'Patient name': 'name',
+    'HKID': 'hkid',
+    'DOB': 'dob',
+    'Ethnicity': 'ethnicity',
+    'Sample collection date': 'specimen_collected',
+    'Sample receive date': 'specimen_arrived',
+    'Case': 'case_history',
+    'Type of test': 'type_of_test',
+    'Type of findings': 'type_of_findings',
+}
+
+# Insert order of the patients columns
+PATIENT_COLUMNS = [
+    'report_date', 'lab_number', 'im_lab_number', 'name',
+    'hkid', 'dob', 'sex', 'age', 'ethnicity',
+    'specimen_collected', 'specimen_arrived', 'case_history',
+    'type_of_test', 'type_of_findings'
+]
+
+# Dates are also written parsed; row_hash lets sync_patients skip rows that haven't changed since the last load
+INSERT_COLUMNS = PATIENT_COLUMNS + TYPED_DATE_COLUMNS + ['row_hash']
+
+INSERT_PATIENT_SQL = f"""
+    INSERT INTO patients ({', '.join(INSERT_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(INSERT_COLUMNS))})
+"""
+
+# Insert or update on the unique patient_key, per dialect
+UPSERT_PATIENT_SQL = {
+    'mysql': INSERT_PATIENT_SQL + "ON DUPLICATE KEY UPDATE " + ", ".join(
+        f"{column} = VALUES({column})" for column in INSERT_COLUMNS
+    ),
+    'sqlite': INSERT_PATIENT_SQL + "ON CONFLICT (patient_key) DO UPDATE SET " + ", ".join(
+        f"{column} = excluded.{column}" for column in INSERT_COLUMNS
+    ),
+}
+
+
+def _find_column(columns, wanted):
+    """Match master list headers case- and whitespace-insensitively ('Patient Name' vs 'Patient name')"""
+    wanted = wanted.strip().lower()
+    for column in columns:
+        if str(column).strip().lower() == wanted:
+            return column
+    return None
+
+
+def _clean_text(series):
+    """str(value).strip() for every value, with blanks and missing values as None"""
+    text = series.astype(str).str.strip().astype(object)
+    return text.where(series.notna() & (text != ''), None)
+
+
+def prepare_patients(source):
+    """
+    Turn the raw master list DataFrame (read with header=1) into patients rows.
+
+    Returns (patients, errors, empty_rows): patients has the INSERT_COLUMNS
+    plus 'source_row' (the row number used in reports), errors lists rows
+    that can't be imported and empty_rows counts fully blank rows.
+    """
+    non_empty = source.notna().any(axis=1)
+    empty_rows = int((~non_empty).sum())
+    source = source[non_empty]
+
+    patients = pd.DataFrame(index=source.index)
+    for source_column, column in SOURCE_COLUMNS.items():
+        actual = _find_column(source.columns, source_column)
+        patients[column] = _clean_text(source[actual]) if actual is not None else None
+
+    sex_age_column = _find_column(source.columns, 'Sex/Age')
+    if sex_age_column is not None:
+        parts = source[sex_age_column].astype(str).str.partition('/')
+        has_sex_age = source[sex_age_column].notna() & (parts[1] == '/')
+        patients['sex'] = _clean_text(parts[0].where(has_sex_age))
+        patients['age'] = _clean_text(parts[2].where(has_sex_age))
+    else:
+        patients['sex'] = None
+        patients['age'] = None
+
+    patients['source_row'] = source.index + 2
+
+    no_lab_number = patients['lab_number'].isna() & patients['im_lab_number'].isna()
+    errors = [
+        {'row': row, 'reason': 'Both Lab No. and IM Lab No. are empty', 'patient': name or 'Unknown'}
+        for row, name in zip(patients.loc[no_lab_number, 'source_row'], patients.loc[no_lab_number, 'name'])
+    ]
+    patients = patients[~no_lab_number].copy()
+    patients[TYPED_DATE_COLUMNS] = typed_dates(patients)
+    patients['row_hash'] = row_hashes(patients)
+    return patients[INSERT_COLUMNS + ['source_row']], errors, empty_rows
+
+
+def row_hashes(patients):
+    """SHA-1 of each row's PATIENT_COLUMNS values"""
+    return [
+        hashlib.sha1('\x1f'.join('' if value is None else str(value) for value in row).encode()).hexdigest()
+        for row in patients[PATIENT_COLUMNS].itertuples(index=False, name=None)
+    ]
+
+
+def patient_keys(patients):
+    """Same value as the patients.patient_key generated column"""
+    return [
+        f"{normalize_lab_number(lab) if lab is not None else ''}|{normalize_lab_number(im_lab) if im_lab is not None else ''}"
+        for lab, im_lab in zip(patients['lab_number'], patients['im_lab_number'])
+    ]
+
+
+def split_duplicates(patients):
+    """
+    (kept rows, errors): the last sheet row of every lab number pair
+    (patient_key), like sync_patients(), and an error for each earlier row
+    with the same pair, naming the row kept in 'duplicate_of'
+    """
+    keys = pd.Series(patient_keys(patients), index=patients.index)
+    replaced = keys.duplicated(keep='last')
+    kept_rows = dict(zip(keys[~replaced], patients.loc[~replaced, 'source_row']))
+    errors = [
+        {
+            'row': row,
+            'reason': f'Duplicate Lab No. and IM Lab No., row {kept_rows[key]} imported instead',
+            'duplicate_of': kept_rows[key],
+            'patient': name or 'Unknown',
+            'lab_no': lab,
+            'im_lab_no': im_lab
+        }
+        for key, row, name, lab, im_lab in zip(keys[replaced], patients.loc[replaced, 'source_row'],
+                                              patients.loc[replaced, 'name'], patients.loc[replaced, 'lab_number'],
+                                              patients.loc[replaced, 'im_lab_number'])
+    ]
+    return patients[~replaced], errors
+
+
+def import_patients(conn, patients, chunk_size=1000, progress=None, sql=INSERT_PATIENT_SQL):
+    """
+    Insert prepared patients in chunks of chunk_size, committing each chunk
+    with a bump of the patients change counter so running app processes
+    reload. Of the rows repeating a lab number pair only the last is
+    inserted; the others are returned as duplicate errors. A chunk that
+    fails is retried row by row so only the bad rows are lost.
+    progress(done, total, elapsed_seconds) is called after every chunk.
+    Returns (imported_source_rows, errors).
+    """
+    patients, errors = split_duplicates(patients)
+    rows = list(patients[INSERT_COLUMNS].itertuples(index=False, name=None))
+    source_rows = patients['source_row'].tolist()
+    imported = []
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            chunk_rows = source_rows[start:start + chunk_size]
+            try:
+                cursor.executemany(sql, chunk)
+                bump_version(cursor)
+                conn.commit()
+                imported.extend(chunk_rows)
+            except DATABASE_ERRORS:
+                conn.rollback()
+                for values, source_row in zip(chunk, chunk_rows):
+                    try:
+                        cursor.execute(sql, values)
+                        imported.append(source_row)
+                    except DATABASE_ERRORS as e:
+                        errors.append({
+                            'row': source_row,
+                            'reason': str(e),
+                            'patient': values[PATIENT_COLUMNS.index('name')] or 'Unknown',
+                            'lab_no': values[PATIENT_COLUMNS.index('lab_number')],
+                            'im_lab_no': values[PATIENT_COLUMNS.index('im_lab_number')]
+                        })
+                bump_version(cursor)
+                conn.commit()
+            if progress:
+                progress(min(start + chunk_size, len(rows)), len(rows), time.perf_counter() - started)
+    finally:
+        cursor.close()
+    return imported, errors
+
+
+def sync_patients(conn, patients, chunk_size=1000, progress=None):
+    """
+    Incrementally load prepared patients into an existing patients table.
+    Rows are matched on patient_key; only new rows and rows whose row_hash
+    differs from the stored one are written (an upsert on patient_key).
+    Rows missing from the sheet are left alone.
+    Returns a dict with inserted / updated / unchanged counts and errors.
+    """
+    # The last occurrence of a lab number pair in the sheet wins, as in import_patients()
+    patients, _ = split_duplicates(patients)
+    patients = patients.copy()
+    patients['patient_key'] = patient_keys(patients)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT patient_key, row_hash FROM patients")
+        stored = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+    conn.commit()
+
+    stored_hash = patients['patient_key'].map(stored)
+    is_new = ~patients['patient_key'].isin(list(stored))
+    is_unchanged = ~is_new & (stored_hash == patients['row_hash'])
+    pending = patients[~is_unchanged]
+
+    written, errors = import_patients(conn, pending, chunk_size, progress, sql=UPSERT_PATIENT_SQL[dialect(conn)])
+    written = set(written)
+    new_rows = set(patients.loc[is_new, 'source_row'])
+    return {
+        'inserted': len(written & new_rows),
+        'updated': len(written - new_rows),
+        'unchanged': int(is_unchanged.sum()),
+        'errors': errors,
+    }
+
+
+def print_progress(done, total, elapsed):
+    rate = done / elapsed if elapsed else 0
+    print(f"Imported {done}/{total} rows ({rate:,.0f} rows/s)")
@@ -0,0 +1,111 @@
+"""
+In-memory patient lookup for /search.
+
+PatientIndex keeps two dicts (normalized lab number -> record and
+normalized IM lab number -> record) so a lookup is O(1) no matter how many
+patients there are. The maps are rebuilt from a loader function when the
+index is invalidated, when the patients change counter (data_versions.py)
+differs from the one it was built at, or when it is older than max_age, and
+swapped in as a whole, so request threads can share one index without
+locking on the read path.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from db_utils import normalize_lab_number
+from patient_dates import TYPED_DATE_COLUMNS, typed_dates
+
+RECORD_FIELDS = [
+    'report_date', 'lab_number', 'im_lab_number', 'name', 'hkid', 'dob',
+    'sex', 'age', 'ethnicity', 'specimen_collected', 'specimen_arrived',
+    'case_history', 'type_of_test', 'type_of_findings'
+] + TYPED_DATE_COLUMNS
+
+PatientRecord = namedtuple('PatientRecord', RECORD_FIELDS)
+
+
+def _is_missing(value):
+    return value is None or value != value or str(value).strip() in ('', 'nan', 'None')
+
+
+class PatientIndex:
+    def __init__(self, loader, max_age=300, version=None):
+        """
+        loader() must return a DataFrame with (a subset of) RECORD_FIELDS
+        columns; DATE columns it doesn't have are parsed from the text dates. version() returns the patients change counter, so changes
+        made by other processes are picked up; max_age (seconds) forces a
+        periodic reload as well.
+        """
+        self._loader = loader
+        self._version = version
+        self._loaded_version = None
+        self.max_age = max_age
+        self._reload_lock = threading.Lock()
+        self._maps = None
+        self._loaded_at = 0
+        self._stale = True
+
+    def _build(self, frame):
+        missing_dates = [typed for typed in TYPED_DATE_COLUMNS if typed not in frame.columns]
+        if missing_dates:
+            # The Excel fallback has no DATE columns; parse once per load, not per lookup
+            frame[missing_dates] = typed_dates(frame)[missing_dates]
+        for field in RECORD_FIELDS:
+            if field not in frame.columns:
+                frame[field] = None
+        by_lab = {}
+        by_im_lab = {}
+        indexed = 0
+        for values in frame[RECORD_FIELDS].itertuples(index=False, name=None):
+            record = PatientRecord._make(values)
+            if _is_missing(record.lab_number) and _is_missing(record.im_lab_number):
+                continue
+            indexed += 1
+            # Keep the first row for duplicate lab numbers, like the old df[...].iloc[0]
+            if not _is_missing(record.lab_number):
+                by_lab.setdefault(normalize_lab_number(record.lab_number), record)
+            if not _is_missing(record.im_lab_number):
+                by_im_lab.setdefault(normalize_lab_number(record.im_lab_number), record)
+        return (by_lab, by_im_lab), indexed
+
+    def _reload_locked(self):
+        # Clear the flag first so an invalidate() during the load isn't lost
+        self._stale = False
+        # Read before the rows: a write in between only causes another reload
+        loaded_version = self._version() if self._version is not None else None
+        try:
+            frame = self._loader()
+        except Exception:
+            self._stale = True
+            raise
+        self._maps, indexed = self._build(frame.copy())
+        self._loaded_at = time.monotonic()
+        self._loaded_version = loaded_version
+        return indexed
+
+    def reload(self):
+        """Rebuild the maps from the loader and swap them in, returns the number of patients indexed"""
+        with self._reload_lock:
+            return self._reload_locked()
+
+    def invalidate(self):
+        """Mark the index stale; the next lookup reloads it"""
+        self._stale = True
+
+    def _needs_reload(self):
+        if self._stale or self._maps is None or time.monotonic() - self._loaded_at >= self.max_age:
+            return True
+        version = self._version() if self._version is not None else None
+        return version is not None and version != self._loaded_version
+
+    def lookup(self, lab_number):
+        """PatientRecord for a lab number or IM lab number, or None"""
+        if self._needs_reload():
+            with self._reload_lock:
+                # Another thread may have reloaded while we waited for the lock
+                if self._needs_reload():
+                    self._reload_locked()
+        by_lab, by_im_lab = self._maps
+        key = normalize_lab_number(lab_number)
+        return by_lab.get(key) or by_im_lab.get(key)
@@ -1,16 +1,37 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, g, Response, abort
 import pandas as pd
 from datetime import datetime
+import atexit
 import re
-from docx import Document
 import os
-from docx.shared import Pt
-import sqlite3
-from db_utils import DatabaseManager
+import tempfile
+import threading
+import time
+import logging
+import logs
+import metrics
+from db_utils import DatabaseManager, PATIENT_FILTERS, PATIENT_DATE_FILTERS, encode_cursor, decode_cursor
+from migrations import ensure_schema, schema_status
+from patient_index import PatientIndex
+from patient_search import PatientSearchIndex
+from workbook_cache import WorkbookCache
+import reports
+from reports import SUMMARY_COLUMNS, report_data
+from jobs import JobQueue
+from report_store import ReportStore
+from variant_store import load_variants
+from variant_processing import clean_variants, insert_rows
+from genome_index import GenomeIndex, parse_region, read_panel_regions
+from patient_dates import parse_date
+from schema import UPLOAD_TABLE_COLUMNS
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 
+# JSON logs through a background writer; LOG_LEVEL=DEBUG for the upload steps
+logs.configure()
+logger = logging.getLogger(__name__)
+
 UPLOAD_FOLDER = 'uploads'  # Ensure this matches the directory where files are saved
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
@@ -19,46 +40,146 @@ ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Create uploads directory if it doesn't exist
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-
-# Global variable to store the DataFrame
-df = None
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.HTTP_IN_PROGRESS.inc()
+
+def record_request(status):
+    # The route pattern, not the path, so /download/<filename> is one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = {'method': request.method, 'route': route, 'status': status}
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - g.request_started, **labels)
+    metrics.HTTP_REQUESTS.inc(**labels)
+    g.request_recorded = True
+
+@app.after_request
+def stop_request_timer(response):
+    if 'request_started' in g:
+        record_request(response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_timer(error=None):
+    if 'request_started' not in g:
+        return
+    # Exceptions that escape Flask's error handling skip after_request
+    if not g.get('request_recorded'):
+        record_request(500)
+    metrics.HTTP_IN_PROGRESS.dec()
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness: the worker process answers requests"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """
+    Readiness: this worker has finished startup(), the database answers and
+    its schema is up to date. 503 otherwise, so the load balancer or
+    orchestrator holds traffic back.
+    """
+    problems = []
+    if not startup_done.is_set():
+        problems.append('starting up')
+    try:
+        with db.get_connection() as conn:
+            current, latest = schema_status(conn)
+        if current < latest:
+            problems.append(f"schema at version {current}, expected {latest}")
+    except Exception as e:
+        # Probes repeat every few seconds while the database is down
+        logger.warning("Readiness check could not reach the database", exc_info=True, extra={'sample': 'health_ready'})
+        problems.append('database unavailable')
+    body = {'status': 'unavailable' if problems else 'ready', 'pid': os.getpid(), 'problems': problems}
+    return jsonify(body), 503 if problems else 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request, database, Excel and report timings in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+# Create uploads directory if it doesn't exist (every worker process runs this)
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+# Parsed variant workbooks, shared by every request
+workbook_cache = WorkbookCache(
+    cache_dir=os.getenv('WORKBOOK_CACHE_DIR', '.workbook_cache'),
+    max_bytes=int(os.getenv('WORKBOOK_CACHE_MAX_MB', 256)) * 1024 * 1024,
+    max_disk_bytes=int(os.getenv('WORKBOOK_CACHE_DISK_MB', 1024)) * 1024 * 1024,
+    max_age=float(os.getenv('WORKBOOK_CACHE_MAX_AGE_DAYS', 30)) * 24 * 3600
+)
 
 # Update the database configuration
 db = DatabaseManager()
 
+# Rendered reports, reused while the patient, summary and template are unchanged
+report_store = ReportStore(
+    directory=os.getenv('REPORT_STORE_DIR', 'report_store'),
+    max_bytes=int(os.getenv('REPORT_STORE_MAX_MB', 512)) * 1024 * 1024,
+    max_age=float(os.getenv('REPORT_STORE_MAX_AGE_DAYS', 30)) * 24 * 3600
+)
+
+# Position index over the stored variants, for region and panel gene queries
+genome_index = GenomeIndex(
+    os.getenv('GENOME_INDEX_PATH', 'genome_index.pkl'),
+    db.get_variant_positions,
+    max_age=float(os.getenv('GENOME_INDEX_MAX_AGE', 60)),
+    load_generation=db.variants_version,
+    save_interval=float(os.getenv('GENOME_INDEX_SAVE_INTERVAL', 300))
+)
+atexit.register(genome_index.save)
+
+# Uploaded variant files are parsed and loaded in the background
+job_queue = JobQueue(
+    db_path=os.getenv('JOB_DB_PATH', 'jobs.sqlite3'),
+    workers=int(os.getenv('JOB_WORKERS', 2))
+)
+
 # Add error handling for database connection
 def load_patient_data():
     """Load patient data from database"""
     try:
         return db.get_all_patients()
     except Exception as e:
-        print(f"Database connection error: {str(e)}")
+        logger.exception("Database connection error")
         return None
 
-def get_all_patients(self):
-    try:
-        with self.get_connection() as conn:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT * FROM patients")
-            results = cursor.fetchall()
-            print("Database results:", results)  # Debug print
-            return pd.DataFrame(results) if results else pd.DataFrame()
-    except Exception as e:
-        print(f"Error in get_all_patients: {str(e)}")  # Debug print
-        return pd.DataFrame()
+def load_patient_frame():
+    """Patients for the search index: the database, falling back to the template Excel file"""
+    patients = load_patient_data()
+    if patients is not None and not patients.empty:
+        return patients
+    logger.warning("Failed to load from database, trying Excel file")
+    patients = load_excel_data()
+    if patients is not None:
+        return patients
+    raise Exception("Failed to load data from both database and Excel!")
+
+# Shared by all request threads; rebuilt whenever the patients table changes
+patient_index = PatientIndex(load_patient_frame, max_age=float(os.getenv('PATIENT_INDEX_MAX_AGE', 300)),
+                             version=db.data_version)
+db.add_change_listener(patient_index.invalidate)
+
+# Ranked lab number / name search for the typeahead box
+patient_search = PatientSearchIndex(load_patient_frame, max_age=float(os.getenv('PATIENT_INDEX_MAX_AGE', 300)),
+                                    version=db.data_version)
+db.add_change_listener(patient_search.invalidate)
 
 
 def load_excel_data():
-    global df
+    """
+    The template master list as a patients frame, or None. Built in a local
+    frame so index reloads in different threads never share one.
+    """
     try:
         # Read the Excel file
-        df = pd.read_excel('IM patient list_20250303_template.xlsx', header=1)
+        with metrics.EXCEL_SECONDS.time(reader='master_list'):
+            df = pd.read_excel('IM patient list_20250303_template.xlsx', header=1)
         
         # Print original columns for debugging
-        print("Original columns before mapping:", df.columns.tolist())
+        logger.debug("Original columns before mapping", extra={'columns': df.columns.tolist()})
         
         # First, handle unnamed columns if they exist
         unnamed_mapping = {}
@@ -117,155 +238,39 @@ def load_excel_data():
             if col in df.columns:
                 df[col] = pd.to_datetime(df[col], errors='coerce')
         
-        # Print debug information
-        print("\nFinal columns:", df.columns.tolist())
-        print("\nFirst row:")
-        print(df.iloc[0])
+        logger.debug("Loaded patient list from Excel", extra={'rows': len(df), 'columns': df.columns.tolist()})
         
-        return True
+        return df
     except Exception as e:
-        print(f"Error in load_excel_data: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        return False
+        logger.exception("Error in load_excel_data")
+        return None
 
 def validate_lab_number(lab_number):
     im_pattern = r'^IM\d{3}$'
     num_pattern = r'^2\d{10}$'
     return bool(re.match(im_pattern, lab_number) or re.match(num_pattern))
 
+@metrics.timed(metrics.REPORT_SECONDS, step='create_word_document')
 def create_word_document(patient_data):
     try:
-        output_doc = Document()
-        
-        style = output_doc.styles['Normal']
-        style.font.name = 'Calibri'
-        style.font.size = Pt(12)
-        
-        # Add report date with label and proper formatting
-        p = output_doc.add_paragraph()
-        p.add_run("REPORT DATE: ").bold = True
-        # Handle date formatting safely
-        try:
-            if patient_data['report_date']:
-                date_obj = datetime.strptime(patient_data['report_date'], '%Y-%m-%d')
-                formatted_date = date_obj.strftime('%d/%m/%Y')
-            else:
-                formatted_date = ''
-        except:
-            formatted_date = patient_data['report_date']
-        p.add_run(formatted_date).bold = True
-        
-        # Add patient information with formatting
-        info = [
-            ('Lab. #', f"{patient_data['im_lab_number']}/{patient_data['lab_number']}"),
-            ('Name', patient_data['name']),
-            ('HKID', patient_data['hkid']),
-            ('Date of Birth', patient_data['dob']),
-            ('Sex', patient_data['sex']),
-            ('Age', patient_data['age']),
-            ('Ethnicity', patient_data['ethnicity']),
-            ('Specimen Collected', patient_data['specimen_collected']),
-            ('Specimen Arrived', patient_data['specimen_arrived'])
-        ]
-        
-        for label, value in info:
-            p = output_doc.add_paragraph()
-            p.add_run(f"{label}: ").bold = True
-            # Format dates if the value is a date
-            if label in ['Date of Birth', 'Specimen Collected', 'Specimen Arrived'] and value:
-                try:
-                    date_obj = datetime.strptime(value, '%Y-%m-%d')
-                    value = date_obj.strftime('%d/%m/%Y')
-                except ValueError:
-                    pass
-            p.add_run(str(value))
-        
-        # Add line separator at the end
-        p = output_doc.add_paragraph()
-        p.add_run("-" * 117)
-        
-        # Add summary of results
-        sections = [
-            ('SPECIMEN', 'EDTA blood'),
-            ('CLINICAL HISTORY', patient_data['clinical_history']),  # Use clinical_history key
-            ('TYPE OF TESTING REQUESTED', patient_data.get('type_of_test', '')),
-            ('TEST DESCRIPTION', get_test_description(patient_data.get('test_type', ''))),
-            ('SUMMARY OF RESULT(S)', get_summary_result(patient_data.get('type_of_findings', ''), patient_data.get('lab_number')))
-        ]
-
-        for label, value in sections:
-            # Add title paragraph
-            p = output_doc.add_paragraph()
-            p.add_run(f"{label}:").bold = True
-
-            # Add value on next line
-            p = output_doc.add_paragraph()
-            p.add_run(str(value))
-        
-        # Create filename using lab number and timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"patient_info_{patient_data['lab_number']}_{timestamp}.docx"
-        
-        # Save the document
-        output_doc.save(filename)
-        return filename
+        # Summary stored when the variant file was ingested, rebuilt if the file or rules changed
+        files = db.get_uploaded_files([patient_data.get('lab_number'), patient_data.get('im_lab_number')])
+        summary, recomputed = reports.upload_summary(
+            reports.find_upload(files, patient_data), app.config['UPLOAD_FOLDER'], workbook_cache
+        )
+        if recomputed:
+            db.save_upload_summaries([recomputed])
+        return reports.store_report(report_store, patient_data, summary)
     except Exception as e:
-        print(f"Error creating Word document: {str(e)}")
+        logger.exception("Error creating Word document", extra={'lab_number': patient_data.get('lab_number')})
         return None
 
-def get_test_description(test_type):
-    base_desc = "In-house Immunological Disorders SuperPanel gene panel from WES was tested by next generation sequencing, and 516 genes were included in the panel test."
-    if test_type.lower() == 'trio':
-        return f"{base_desc} Trio analysis has been performed."
-    return base_desc
-
-def get_summary_result(finding_type, lab_number):
-    print(f"Debug: Generating summary for lab number {lab_number}")  # Debug print
-    file_path = db.get_uploaded_file_path(lab_number)
-    if file_path:
-        if not os.path.exists(file_path):
-            print(f"Debug: File does not exist at path: {file_path}")  # Debug print
-            return "Uploaded file not found on the server."
-
-        try:
-            # Read the uploaded file
-            variant_df = pd.read_excel(file_path)
-
-            # Filter rows where "Reportable Variant" is not empty
-            reportable_variants = variant_df[variant_df['Reportable Variant'].notnull()]
-
-            # Generate sentences for each reportable variant
-            sentences = []
-            for _, row in reportable_variants.iterrows():
-                comment = row['Second review and comment on reportable variant ']
-                gene_name = row['Gene Names']
-                sentences.append(f"One likely {comment} variant was detected in the {gene_name} gene.")
-
-            # Join all sentences into a single summary
-            return " ".join(sentences)
-
-        except Exception as e:
-            print(f"Error processing file for lab number {lab_number}: {str(e)}")
-            return "Error processing the uploaded file for this patient."
-    else:
-        print(f"Debug: No file path found for lab number {lab_number}")  # Debug print
-        return "No uploaded file found for this patient."
-
 @app.route('/')
 def home():
     return render_template('index.html')
 
 @app.route('/search', methods=['POST'])
 def search():
-    global df
-    if df is None:
-        if not load_excel_data():
-            return jsonify({
-                'success': False,
-                'message': 'Error loading patient database.'
-            })
-
     lab_number = request.form.get('lab_number')
     test_type = request.form.get('test_type')
     
@@ -275,46 +280,20 @@ def search():
             'message': 'Invalid lab number format. Please use IMxxx or 2xxxxxxxxxx format.'
         })
 
-    result = df[(df['lab_number'] == lab_number) | (df['im_lab_number'] == lab_number)]
+    try:
+        patient = patient_index.lookup(lab_number)
+    except Exception as e:
+        logger.exception("Error loading patient index")
+        return jsonify({
+            'success': False,
+            'message': 'Error loading patient database.'
+        })
 
-    if not result.empty:
-        patient = result.iloc[0]
+    if patient is not None:
         
-        # Handle dates safely
-        def format_date(date_value):
-            if pd.isna(date_value):
-                return ''
-            try:
-                if isinstance(date_value, str):
-                    # Try to parse the string date
-                    try:
-                        date_obj = pd.to_datetime(date_value).date()
-                        return date_obj.strftime('%Y-%m-%d')
-                    except:
-                        return date_value
-                return date_value.date().strftime('%Y-%m-%d')
-            except:
-                return str(date_value)
-
         # Prepare patient data with safe date handling
-        patient_data = {
-            'report_date': format_date(patient['report_date']),
-            'im_lab_number': str(patient['im_lab_number']),
-            'lab_number': str(patient['lab_number']),
-            'name': str(patient['name']),
-            'hkid': str(patient['hkid']),
-            'dob': format_date(patient['dob']),
-            'sex': str(patient['sex']),
-            'age': str(patient['age']),
-            'ethnicity': str(patient['ethnicity']),
-            'specimen_collected': format_date(patient['specimen_collected']),
-            'specimen_arrived': format_date(patient['specimen_arrived']),
-            'clinical_history': str(patient['case_history']),  # Use mapped column name
-            'type_of_test': str(patient['type_of_test']),
-            'test_type': request.form.get('test_type'),
-            'type_of_findings': str(patient['type_of_findings'])
-        }
-        
+        patient_data = report_data(patient._asdict(), request.form.get('test_type'))
+
         # Create Word document
         doc_filename = create_word_document(patient_data)
         
@@ -335,12 +314,91 @@ def search():
             'message': 'No patient found with this lab number.'
         })
 
+MAX_TYPEAHEAD_RESULTS = 50
+
+@app.route('/search/typeahead', methods=['GET'])
+def search_typeahead():
+    """Ranked patients for ?q= (lab number / IM lab number prefix or name), at most ?limit= (default 10)"""
+    try:
+        limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_TYPEAHEAD_RESULTS)
+        return jsonify({'success': True, 'data': patient_search.search(request.args.get('q', ''), limit)})
+    except Exception as e:
+        logger.exception("Error in /search/typeahead")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/patient_index/reload', methods=['POST'])
+def reload_patient_index():
+    """
+    Rebuild the search indexes, e.g. after the database was changed by hand.
+    Bumps the patients change counter so every worker process reloads too.
+    """
+    try:
+        db.bump_data_version()
+        count = patient_index.reload()
+        patient_search.reload()
+        return jsonify({'success': True, 'message': f'Patient index reloaded ({count} patients)'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
 @app.route('/download/<filename>')
 def download_file(filename):
+    # Only reports from the store can be downloaded; the key doubles as the ETag
+    key = reports.stored_report_key(filename)
+    path = report_store.get(key) if key else None
+    if path is None:
+        abort(404)
+    try:
+        return send_file(path, as_attachment=True, download_name=filename, etag=key, conditional=True,
+                         mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+    except FileNotFoundError:
+        # Evicted between the lookup and the send
+        abort(404)
+
+@app.route('/reports/batch', methods=['POST'])
+def batch_reports():
+    """
+    ZIP of reports for {"lab_numbers": [...]} and/or {"date_from": ..., "date_to": ...}
+    (YYYY-MM-DD), optionally with "test_type".
+    """
+    options = request.get_json(silent=True) or {}
+    lab_numbers = options.get('lab_numbers')
+    date_from = options.get('date_from')
+    date_to = options.get('date_to')
+    if not (lab_numbers or date_from or date_to):
+        return jsonify({'success': False, 'message': 'Give lab_numbers or a date_from/date_to range'}), 400
+
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            result = reports.generate_reports(
+                db, output_dir, lab_numbers, date_from, date_to, options.get('test_type'),
+                upload_folder=app.config['UPLOAD_FOLDER'],
+                workers=int(os.getenv('REPORT_WORKERS', 0)) or None,
+                cache_dir=workbook_cache.cache_dir
+            )
+            if not result['written']:
+                return jsonify({'success': False, 'message': 'No reports generated', **result}), 404
+            archive = reports.zip_reports(output_dir, result)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return send_file(archive, mimetype='application/zip', as_attachment=True,
+                         download_name=f"patient_reports_{timestamp}.zip")
+    except Exception as e:
+        logger.exception("Error in /reports/batch")
+        return jsonify({'success': False, 'message': f'Error generating reports: {str(e)}'}), 500
+
+@app.route('/reports/turnaround', methods=['GET'])
+def turnaround_times():
+    """Days from specimen arrival to report per month, for reports dated in ?date_from=&date_to= (YYYY-MM-DD)"""
     try:
-        return send_file(filename, as_attachment=True)
+        bounds = {}
+        for name in ('date_from', 'date_to'):
+            if request.args.get(name):
+                bounds[name] = parse_date(request.args[name])
+                if bounds[name] is None:
+                    return jsonify({'success': False, 'message': f'Invalid {name}'}), 400
+        return jsonify({'success': True, 'data': db.get_turnaround_times(**bounds)})
     except Exception as e:
-        return str(e)
+        logger.exception("Error in /reports/turnaround")
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 # Update add_new_patient function
 def add_new_patient(patient_data):
@@ -381,30 +439,114 @@ def add_patient():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+MAX_PAGE_SIZE = 500
+
 @app.route('/get_patients', methods=['GET'])
 def get_patients():
+    """
+    One page of patients.
+    Query parameters: lab_number, im_lab_number, name, type_of_test and
+    type_of_findings (exact match), sort, order (asc/desc), limit, cursor
+    (next_cursor from the previous page) and include_filters=1 to also
+    return the dropdown values.
+    """
     try:
-        # Fetch all patients from the database
-        patients = db.get_all_patients()
-        if patients.empty:
-            return jsonify({'success': True, 'data': [], 'filters': {}})
-
-        # Extract unique values for dropdown filters
-        filters = {
-            'lab_numbers': patients['lab_number'].dropna().unique().tolist(),
-            'im_lab_numbers': patients['im_lab_number'].dropna().unique().tolist(),
-            'names': patients['name'].dropna().unique().tolist(),
-            'test_types': patients['type_of_test'].dropna().unique().tolist(),
-            'findings': patients['type_of_findings'].dropna().unique().tolist(),
+        filters = {name: request.args.get(name) for name in {**PATIENT_FILTERS, **PATIENT_DATE_FILTERS} if request.args.get(name)}
+        limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+        page = db.query_patients(
+            filters=filters,
+            sort=request.args.get('sort', 'id'),
+            descending=request.args.get('order', 'asc').lower() == 'desc',
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+
+        response = {
+            'success': True,
+            'data': page['data'],
+            'next_cursor': page['next_cursor']
         }
+        if request.args.get('include_filters') == '1':
+            response['filters'] = db.get_filter_values()
+        return jsonify(response)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in /get_patients")
+        return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/variants', methods=['GET'])
+def query_variants():
+    """
+    One page of variants across all patients.
+    Query parameters: gene, chr, start, end (position range on chr),
+    zygosity, classification, limit and cursor (next_cursor from the
+    previous page).
+    """
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+        page = db.query_variants(
+            gene=request.args.get('gene'),
+            chr=request.args.get('chr'),
+            start=request.args.get('start', type=int),
+            end=request.args.get('end', type=int),
+            zygosity=request.args.get('zygosity'),
+            classification=request.args.get('classification'),
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+        return jsonify({'success': True, 'data': page['data'], 'next_cursor': page['next_cursor']})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in /variants")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/region', methods=['GET'])
+def query_region():
+    """
+    Variants in a region, from the genome index.
+    Query parameters: region (e.g. chr7:1000000-2000000) or gene (a panel
+    gene, its panel span is used), limit and cursor (next_cursor from the
+    previous page).
+    """
+    try:
+        if request.args.get('gene'):
+            region = genome_index.gene_region(request.args['gene'])
+            if region is None:
+                return jsonify({'success': False, 'message': 'Gene not found in the panel regions'}), 404
+        elif request.args.get('region'):
+            region = parse_region(request.args['region'])
+        else:
+            return jsonify({'success': False, 'message': 'Give a region or a gene'}), 400
+
+        chr, start, end = region
+        limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        data, more = [], False
+        # Ids the index still has but the database deleted leave a page short; read on until it is full
+        while len(data) < limit:
+            wanted = limit - len(data)
+            hits = genome_index.query(chr, start, end, limit=wanted + 1, after=after)
+            if not hits:
+                break
+            page = hits[:wanted]
+            data.extend(db.get_variants_by_ids([variant_id for _, variant_id in page]))
+            after = page[-1]
+            more = len(hits) > wanted
+            if not more:
+                break
+        next_cursor = encode_cursor(list(after)) if more else None
         return jsonify({
             'success': True,
-            'data': patients.to_dict('records'),
-            'filters': filters
+            'region': {'chr': chr, 'start': start, 'end': end},
+            'data': data,
+            'next_cursor': next_cursor
         })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
-        print(f"Error in /get_patients: {str(e)}")  # Debug print
+        logger.exception("Error in /region")
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/update_findings', methods=['POST'])
@@ -450,8 +592,8 @@ def delete_patient(lab_number):
 
 def process_variant_file(file_path, lab_number):
     try:
-        # Read the Excel file
-        variant_df = pd.read_excel(file_path)
+        # Read the reportable rows of the Excel file
+        variant_df = workbook_cache.read_variants(file_path, SUMMARY_COLUMNS, reportable_only=True)
 
         # Find rows where 'Reportable Variant' is 'C'
         c_variants = variant_df[variant_df['Reportable Variant'] == 'C']
@@ -459,7 +601,7 @@ def process_variant_file(file_path, lab_number):
         if not c_variants.empty:
             # Get the first C variant's information
             variant = c_variants.iloc[0]
-            variant_comment = variant['Second review and comment on reportable variant ']
+            variant_comment = variant['Second review and comment on reportable variant']
             gene_name = variant['Gene Names']
 
             # Create the formatted summary
@@ -507,28 +649,22 @@ def upload_variant_file():
         file.save(file_path)
         
         try:
-            variant_df = pd.read_excel(file_path, header=1)
-            
-            # Check required columns
-            required_columns = ['Reportable Variant', 'Second review and comment on reportable variant ', 'Gene Names']
-            missing_columns = [col for col in required_columns if col not in variant_df.columns]
-            
-            if missing_columns:
+            # Only the reportable rows of the required columns are read
+            try:
+                variants = workbook_cache.read_variants(file_path, SUMMARY_COLUMNS, reportable_only=True)
+            except ValueError as e:
                 return jsonify({
                     'success': False,
-                    'message': f'Missing required columns: {", ".join(missing_columns)}'
+                    'message': str(e)
                 })
             
-            # Get first row with any reportable variant
-            variants = variant_df[variant_df['Reportable Variant'].notna()]
-            
             if not variants.empty:
                 variant = variants.iloc[0]
                 variant_type = variant['Reportable Variant']
                 
                 # Set summary based on variant type
                 if variant_type == 'C':
-                    variant_comment = variant['Second review and comment on reportable variant ']
+                    variant_comment = variant['Second review and comment on reportable variant']
                     gene_name = variant['Gene Names']
                     summary = f"One {variant_comment} variant was detected in the {gene_name} gene"
                 elif variant_type == 'A':
@@ -595,7 +731,7 @@ def upload_file():
 
             # Save the file to the uploads folder
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            print(f"Debug: Saving file to {file_path}")  # Debug print
+            logger.debug("Saving uploaded file", extra={'path': file_path})
             file.save(file_path)
 
             # Extract lab number from the full file path
@@ -604,7 +740,7 @@ def upload_file():
                 return jsonify({'success': False, 'message': 'Lab number not found in file path'})
             lab_number = lab_number_match.group(0)  # Fetch the full lab number (e.g., IM_651 or IM_651_652_653)
 
-            print(f"Debug: Lab number extracted from file path: {lab_number}")  # Debug print
+            logger.debug("Lab number extracted from file name", extra={'lab_number': lab_number})
 
             # Check if a file for this lab number already exists in the uploaded_files table
             existing_file = db.get_uploaded_file_path(lab_number)
@@ -615,24 +751,55 @@ def upload_file():
                 })
 
             # Save file information to the database
-            success = db.save_uploaded_file(file_type, filename, lab_number)
-            if success:
-                print(f"Debug: File information saved to database for lab number {lab_number}")  # Debug print
+            upload_id = db.save_uploaded_file(file_type, filename, lab_number)
+            if upload_id:
+                logger.debug("Uploaded file recorded", extra={'lab_number': lab_number})
 
-                # Process the file and store its data in the respective table
-                process_success = process_file_data(file_path, file_type, lab_number)
-                if process_success:
-                    return jsonify({'success': True, 'message': 'File uploaded and processed successfully', 'lab_number': lab_number})
-                else:
-                    return jsonify({'success': False, 'message': 'File uploaded but failed to process data'})
+                # Process the file and store its data in the respective table in the background
+                job_id = job_queue.submit('upload_file', process_upload, file_path, file_type, lab_number, upload_id)
+                return jsonify({
+                    'success': True,
+                    'message': 'File uploaded, processing in the background',
+                    'lab_number': lab_number,
+                    'job_id': job_id,
+                    'status_url': f'/jobs/{job_id}'
+                }), 202
             else:
                 return jsonify({'success': False, 'message': 'Failed to save file information to the database'})
         else:
             return jsonify({'success': False, 'message': 'Invalid file type'})
     except Exception as e:
-        print(f"Error in /upload_file: {str(e)}")  # Debug print
+        logger.exception("Error in /upload_file")
         return jsonify({'success': False, 'message': f'Error uploading file: {str(e)}'})
 
+def process_upload(file_path, file_type, lab_number, upload_id=None):
+    """Background job for /upload_file: load the variants, then precompute the report summary"""
+    if not process_file_data(file_path, file_type, lab_number, upload_id):
+        return False, 'File uploaded but failed to process data'
+    try:
+        genome_index.sync()
+        genome_index.add_panel_regions(read_panel_regions(file_path))
+    except Exception as e:
+        # Region queries catch up on their next sync
+        logger.exception("Error updating genome index", extra={'lab_number': lab_number})
+    try:
+        summary = reports.build_summary(file_path, workbook_cache)
+        db.save_upload_summaries([
+            (os.path.basename(file_path), summary, workbook_cache.content_hash(file_path), reports.SUMMARY_RULES_VERSION)
+        ])
+    except Exception as e:
+        # Reports rebuild the summary from the file if it wasn't stored
+        logger.exception("Error precomputing summary", extra={'lab_number': lab_number})
+        summary = None
+    return {'lab_number': lab_number, 'file_type': file_type, 'summary': summary}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/get_uploaded_files', methods=['GET'])
 def get_uploaded_files():
     try:
@@ -640,103 +807,46 @@ def get_uploaded_files():
             cursor = conn.cursor(dictionary=True)
             cursor.execute("SELECT file_type, file_name, upload_date FROM uploaded_files")
             files = cursor.fetchall()
-            print("Fetched uploaded files:", files)  # Debug print
+            logger.debug("Fetched uploaded files", extra={'count': len(files)})
             return jsonify({'success': True, 'files': files})
     except Exception as e:
-        print(f"Error in /get_uploaded_files: {str(e)}")  # Debug print
+        logger.exception("Error in /get_uploaded_files")
         return jsonify({'success': False, 'message': str(e)})
 
-def delete_patient(self, lab_number):
-    """Delete patient by lab number"""
-    try:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        query = "DELETE FROM patients WHERE lab_number = %s"
-        cursor.execute(query, (lab_number,))
-        conn.commit()
-        return cursor.rowcount > 0
-    except Exception as e:
-        print(f"Error deleting patient: {e}")
-        return False
-    finally:
-        if 'conn' in locals():
-            conn.close()
-
-def save_uploaded_file(self, file_type, file_name, lab_number):
+def process_file_data(file_path, file_type, lab_number, upload_id=None):
     """
-    Save uploaded file information to the database.
+    Process the uploaded file and store its data in the respective table,
+    and in the normalized variants table when the uploaded_files id is given.
     """
     try:
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            query = """
-                INSERT INTO uploaded_files (file_type, file_name, lab_number)
-                VALUES (%s, %s, %s)
-            """
-            cursor.execute(query, (file_type, file_name, lab_number))
-            conn.commit()
-            return True
-    except Exception as e:
-        print(f"Error saving uploaded file: {str(e)}")
-        return False
-
-def process_file_data(file_path, file_type, lab_number):
-    """
-    Process the uploaded file and store its data in the respective table.
-    """
-    try:
-        # Read the Excel file with the correct header row
-        print(f"Debug: Reading file {file_path}")  # Debug print
-        df = pd.read_excel(file_path, header=1)  # Use header=1 to read the second row as column headers
-
-        # Normalize column names by stripping leading/trailing spaces
-        df.columns = df.columns.str.strip()
-
-        # Debug print for DataFrame columns
-        print(f"Debug: Columns in the file after stripping spaces: {df.columns.tolist()}")
-
-        # Replace all missing values (NaN, empty strings, whitespace) with None
-        df = df.replace({pd.NA: None, '': None, ' ': None, 'nan': None, 'NaN': None}).where(pd.notnull(df), None)
-
-        # Debug print for DataFrame after replacing missing values
-        print(f"Debug: DataFrame after replacing missing values:\n{df.head()}")
-
-        # Define the required columns for both singleton and trio tables
-        required_columns = [
-            "Reportable Variant", "Chr:Pos", "IGV review ( True / False call)", 
-            "Second review and comment on reportable variant",  # No trailing space in the code
-            "Gene Names", "HGVS c. (Clinically Relevant)", "HGVS p. (Clinically Relevant)",
-            "Exon Number (Clinically Relevant)", "Zygosity", "Inheritance", "Classification",
-            "OMIM ID", "RSID", "Title"
-        ]
+        # The columns of the singleton and trio tables (schema.py)
+        required_columns = list(UPLOAD_TABLE_COLUMNS)
 
         # Add "Inherited From" for trio files
         if file_type == "trio":
             required_columns.append("Inherited From")
 
-        # Ensure the required columns exist in the DataFrame
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            print(f"Error: Missing required columns: {', '.join(missing_columns)}")
+        # Read just the required columns (header names are matched after stripping spaces)
+        logger.debug("Reading variant file", extra={'path': file_path})
+        try:
+            df = workbook_cache.read_variants(file_path, required_columns)
+        except ValueError as e:
+            logger.error("Unreadable variant file: %s", e, extra={'path': file_path})
             return False
 
-        # Filter the DataFrame to include only the required columns
-        df = df[required_columns]
+        # Replace all missing values (NaN, empty strings, whitespace) with None
+        df = clean_variants(df)
 
         # Prepare data for insertion
-        rows = []
-        for _, row in df.iterrows():
-            rows.append(tuple(row[col] for col in required_columns))
-
-        # Debug print for rows
-        print(f"Debug: Prepared rows for insertion: {rows}")
+        rows = insert_rows(df, required_columns)
+        logger.debug("Prepared rows for insertion", extra={'count': len(rows)})
 
         # Escape column names with backticks
         escaped_columns = [f"`{col}`" for col in required_columns]
 
         # Insert data into the respective table
         table_name = 'singleton' if file_type == 'singleton' else 'trio'
-        print(f"Debug: Inserting data into {table_name} table")  # Debug print
+        logger.debug("Inserting variant rows", extra={'table': table_name})
         with db.get_connection() as conn:
             cursor = conn.cursor()
             query = f"""
@@ -744,21 +854,48 @@ def process_file_data(file_path, file_type, lab_number):
                 VALUES ({', '.join(['%s'] * len(required_columns))})
             """
             cursor.executemany(query, rows)
+            if upload_id is not None:
+                count = load_variants(cursor, df, upload_id, lab_number, file_type)
+                logger.info("Variants stored", extra={'lab_number': lab_number, 'count': count})
             conn.commit()
-            print(f"Debug: Data inserted into {table_name} table for lab number {lab_number}")
+            logger.info("Variant rows inserted", extra={'table': table_name, 'lab_number': lab_number, 'count': len(rows)})
         return True
     except Exception as e:
-        print(f"Error processing file data: {str(e)}")
+        logger.exception("Error processing file data", extra={'lab_number': lab_number})
         return False
 
+# Set once startup() has run in this process; /health/ready reports 503 until then
+startup_done = threading.Event()
+
+def startup(migrate=True):
+    """
+    Per-process start-up, run by every worker (wsgi.py) and the development
+    server: apply pending migrations unless migrate is False (gunicorn.conf.py
+    applies them once before forking), compile the report template and load
+    the patient index.
+    """
+    # Bring the schema up to date before serving lookups
+    if migrate:
+        try:
+            with db.get_connection() as conn:
+                ensure_schema(conn)
+        except Exception as e:
+            logger.exception("Error applying migrations")
+
+    # Compile the report template once instead of on the first report
+    try:
+        reports.get_report_template()
+    except Exception as e:
+        logger.exception("Error loading report template")
+
+    # Build the search index when starting
+    try:
+        logger.info("Patient index loaded", extra={'count': patient_index.reload()})
+    except Exception as e:
+        logger.exception("Error loading patient index")
+    startup_done.set()
+
 if __name__ == '__main__':
-    # Load data from database when starting
-    df = load_patient_data()
-    if df is None:
-        print("Failed to load from database, trying Excel file...")
-        if not load_excel_data():
-            print("Failed to load data from both database and Excel!")
-    else:
-        print("Successfully loaded data from database")
-    
+    # Development server; see wsgi.py for production serving
+    startup()
     app.run(debug=True)
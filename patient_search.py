@@ -0,0 +1,256 @@
+"""
+In-process patient search for the typeahead box.
+
+PatientSearchIndex is rebuilt from the same loader as PatientIndex and
+swapped in whole. It holds:
+
+- sorted lab number / IM lab number keys, searched by prefix with bisect
+- name tokens reduced to a romanization group (CHAN, CHEN -> CHAN), kept
+  in a sorted list for prefix matches
+- a trigram index over the name tokens for typos and partial spellings
+
+A query is a few binary searches and set operations, well under a
+millisecond for tens of thousands of patients.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import defaultdict
+
+from db_utils import normalize_lab_number
+from patient_index import _is_missing
+
+# Common surname spellings in Cantonese (HK government) and Mandarin (pinyin)
+# romanization; every spelling in a group matches the others.
+ROMANIZATION_GROUPS = [
+    ['CHAN', 'CHEN', 'CHUN'],
+    ['WONG', 'HUANG', 'WANG', 'VONG'],
+    ['LEE', 'LI', 'LY'],
+    ['CHEUNG', 'ZHANG', 'CHANG', 'CHEONG'],
+    ['LAU', 'LIU', 'LAO'],
+    ['NG', 'WU', 'ENG'],
+    ['HO', 'HE', 'HOR'],
+    ['TSANG', 'ZENG', 'TSENG', 'CHANG'],
+    ['CHOW', 'ZHOU', 'CHAU', 'CHOU'],
+    ['YEUNG', 'YANG', 'IEONG'],
+    ['LAM', 'LIN', 'LUM'],
+    ['LEUNG', 'LIANG', 'LEONG'],
+    ['KWOK', 'GUO', 'KUOK'],
+    ['TAM', 'TAN', 'TAAM'],
+    ['TANG', 'DENG', 'TENG'],
+    ['FUNG', 'FENG', 'FONG'],
+    ['CHU', 'ZHU', 'CHUE'],
+    ['MAK', 'MAI', 'MAC'],
+    ['LO', 'LU', 'LOW'],
+    ['LAW', 'LUO', 'LOH'],
+    ['YIP', 'YE', 'IP'],
+    ['TSE', 'XIE', 'TSEH'],
+    ['KWAN', 'GUAN', 'KUAN'],
+    ['SIU', 'XIAO', 'SIEW'],
+    ['SO', 'SU', 'SOU'],
+    ['CHENG', 'ZHENG', 'CHING'],
+    ['POON', 'PAN', 'PUN'],
+    ['CHOI', 'CAI', 'TSOI', 'CHOY'],
+    ['TSUI', 'XU', 'CHUI', 'HSU'],
+    ['KONG', 'JIANG', 'KWONG'],
+    ['LUI', 'LEI', 'LOUIE'],
+    ['CHIU', 'ZHAO', 'CHIO'],
+    ['YUEN', 'YUAN', 'YUN'],
+    ['WAN', 'YIN', 'WUN'],
+    ['KO', 'GAO', 'KOH'],
+    ['SHUM', 'SHEN', 'SUM'],
+]
+
+ROMANIZATION = {}
+for group in ROMANIZATION_GROUPS:
+    for spelling in group:
+        # The first group listing a spelling wins (CHANG is both ZHANG and ZENG in the wild)
+        ROMANIZATION.setdefault(spelling, group[0])
+
+# Score of each kind of match; ranked results are sorted by the summed score
+SCORE_LAB_EXACT = 100
+SCORE_LAB_PREFIX = 60
+SCORE_TOKEN_EXACT = 10
+SCORE_TOKEN_PREFIX = 6
+SCORE_TOKEN_TRIGRAM = 3
+SCORE_NAME_ORDER = 5
+
+MIN_TRIGRAM_SIMILARITY = 0.25
+
+RESULT_FIELDS = ['lab_number', 'im_lab_number', 'name', 'type_of_test', 'type_of_findings']
+
+
+def name_tokens(name):
+    """'Chan Tai-man' -> ['CHAN', 'TAI', 'MAN']"""
+    return [token for token in re.split(r'[^A-Z0-9]+', str(name).upper()) if token]
+
+
+def canonical(token):
+    return ROMANIZATION.get(token, token)
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PatientSearchIndex:
+    def __init__(self, loader, max_age=300, version=None):
+        """loader() returns a DataFrame with RESULT_FIELDS columns; version and max_age are as for PatientIndex"""
+        self._loader = loader
+        self._version = version
+        self._loaded_version = None
+        self.max_age = max_age
+        self._reload_lock = threading.Lock()
+        self._state = None
+        self._loaded_at = 0
+        self._stale = True
+
+    def _build(self, frame):
+        for field in RESULT_FIELDS:
+            if field not in frame.columns:
+                frame[field] = None
+        patients = []
+        name_keys = []                      # canonical name tokens of each patient, in order
+        lab_keys = []                       # (key, patient) sorted
+        tokens = defaultdict(set)           # canonical token -> patients
+        token_trigrams = defaultdict(set)   # trigram -> canonical tokens
+        for values in frame[RESULT_FIELDS].itertuples(index=False, name=None):
+            record = {field: (None if _is_missing(value) else str(value).strip()) for field, value in zip(RESULT_FIELDS, values)}
+            if record['lab_number'] is None and record['im_lab_number'] is None:
+                continue
+            patient = len(patients)
+            patients.append(record)
+            for column in ('lab_number', 'im_lab_number'):
+                if record[column] is not None:
+                    lab_keys.append((normalize_lab_number(record[column]), patient))
+            name_key = tuple(canonical(token) for token in name_tokens(record['name'] or ''))
+            name_keys.append(name_key)
+            for token in name_key:
+                tokens[token].add(patient)
+                for trigram in trigrams(token):
+                    token_trigrams[trigram].add(token)
+        lab_keys.sort()
+        return {
+            'patients': patients,
+            'name_keys': name_keys,
+            'lab_keys': lab_keys,
+            'lab_key_values': [key for key, _ in lab_keys],
+            'tokens': dict(tokens),
+            'sorted_tokens': sorted(tokens),
+            'trigrams': dict(token_trigrams),
+        }
+
+    def reload(self):
+        """Rebuild from the loader and swap in, returns the number of patients indexed"""
+        with self._reload_lock:
+            self._reload_locked()
+            return len(self._state['patients'])
+
+    def invalidate(self):
+        self._stale = True
+
+    def _needs_reload(self):
+        if self._stale or self._state is None or time.monotonic() - self._loaded_at >= self.max_age:
+            return True
+        version = self._version() if self._version is not None else None
+        return version is not None and version != self._loaded_version
+
+    def _current(self):
+        if self._needs_reload():
+            with self._reload_lock:
+                if self._needs_reload():
+                    self._reload_locked()
+        return self._state
+
+    def _reload_locked(self):
+        self._stale = False
+        loaded_version = self._version() if self._version is not None else None
+        try:
+            frame = self._loader()
+        except Exception:
+            self._stale = True
+            raise
+        self._state = self._build(frame.copy())
+        self._loaded_at = time.monotonic()
+        self._loaded_version = loaded_version
+
+    @staticmethod
+    def _prefix_range(sorted_values, prefix):
+        lo = bisect.bisect_left(sorted_values, prefix)
+        hi = bisect.bisect_left(sorted_values, prefix + '\uffff')
+        return lo, hi
+
+    def _match_lab_number(self, state, term, scores, limit):
+        key = normalize_lab_number(term)
+        lo, hi = self._prefix_range(state['lab_key_values'], key)
+        # Exact keys sort first; beyond that the first `limit` keys in order are enough
+        for value, patient in state['lab_keys'][lo:min(hi, lo + limit + 1)]:
+            score = SCORE_LAB_EXACT if value == key else SCORE_LAB_PREFIX
+            scores[patient] = max(scores.get(patient, 0), score)
+
+    def _match_token(self, state, token, cap=None):
+        """
+        patient -> score for one query token (exact, prefix, then trigram
+        matches). With cap, prefix and trigram matches stop once there are
+        cap matches, which keeps one-letter queries fast.
+        """
+        typed, token = token, canonical(token)
+        matches = dict.fromkeys(state['tokens'].get(token, ()), SCORE_TOKEN_EXACT)
+        # Prefixes of what was typed as well as of its group ('LI' should still find LIANG)
+        for prefix in {typed, token}:
+            lo, hi = self._prefix_range(state['sorted_tokens'], prefix)
+            for candidate in state['sorted_tokens'][lo:hi]:
+                if cap is not None and len(matches) >= cap:
+                    break
+                matches.update(dict.fromkeys(state['tokens'][candidate].difference(matches), SCORE_TOKEN_PREFIX))
+        if not matches and len(token) >= 3:
+            wanted = trigrams(token)
+            shared = defaultdict(int)
+            for trigram in wanted:
+                for candidate in state['trigrams'].get(trigram, ()):
+                    shared[candidate] += 1
+            similar = [(count / len(wanted | trigrams(candidate)), candidate) for candidate, count in shared.items()]
+            # Most similar spelling first, so each patient keeps its best score
+            for similarity, candidate in sorted(similar, reverse=True):
+                if similarity < MIN_TRIGRAM_SIMILARITY or (cap is not None and len(matches) >= cap):
+                    break
+                matches.update(dict.fromkeys(state['tokens'][candidate].difference(matches), SCORE_TOKEN_TRIGRAM * similarity))
+        return matches
+
+    def search(self, query, limit=10):
+        """Best matching patients for a lab number prefix or name, as dicts with a score"""
+        state = self._current()
+        query = (query or '').strip()
+        if not query:
+            return []
+
+        scores = {}
+        if ' ' not in query:
+            self._match_lab_number(state, query, scores, limit)
+
+        # Every name token of the query has to match
+        name_scores = None
+        query_tokens = name_tokens(query)
+        for token in query_tokens:
+            # Several tokens are intersected, so only a lone token can stop early
+            matches = self._match_token(state, token, cap=limit if len(query_tokens) == 1 else None)
+            if name_scores is None:
+                name_scores = matches
+            else:
+                name_scores = {patient: score + matches[patient] for patient, score in name_scores.items() if patient in matches}
+            if not name_scores:
+                break
+        # Names typed in their stored order ('CHAN TAI MAN') rank above reorderings
+        query_key = tuple(canonical(token) for token in query_tokens)
+        name_keys = state['name_keys']
+        for patient, score in (name_scores or {}).items():
+            if name_keys[patient][:len(query_key)] == query_key:
+                score += SCORE_NAME_ORDER
+            scores[patient] = scores.get(patient, 0) + score
+
+        patients = state['patients']
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], patients[item[0]]['name'] or ''))
+        return [dict(patients[patient], score=round(score, 2)) for patient, score in ranked]
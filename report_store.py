@@ -0,0 +1,92 @@
+"""
+Content-addressed store for rendered reports.
+
+A report is stored under the SHA-256 of everything that goes into it (the
+filled in template fields, which include the patient record and the
+findings summary) and the template version, so asking for an unchanged
+report again returns the stored file instead of rendering a new one. The
+directory is kept under max_bytes and files not used for max_age seconds
+are removed.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def report_key(fields, template_version):
+    """Store key for a report rendered from these fields with this template"""
+    payload = json.dumps({'template': template_version, 'fields': fields}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ReportStore:
+    def __init__(self, directory='report_store', max_bytes=512 * 1024 * 1024, max_age=30 * 24 * 3600):
+        # Absolute, so paths handed to send_file don't depend on the working directory
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid report key: {key}")
+        return os.path.join(self.directory, f"{key}.docx")
+
+    def get(self, key):
+        """Path of the stored report, or None. A hit counts as a use for eviction."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        """Store the report bytes and return their path"""
+        path = self.path(key)
+        # Write then rename so a concurrent download never sees half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+        return path
+
+    def get_or_create(self, key, render):
+        """Path of the stored report, calling render() for its bytes only if it isn't stored yet"""
+        return self.get(key) or self.put(key, render())
+
+    def evict(self, keep=None):
+        """Remove reports older than max_age, then the least recently used until under max_bytes"""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith('.docx') or entry.path == keep:
+                    continue
+                stat = entry.stat()
+                if self.max_age and now - stat.st_mtime > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            if keep and os.path.exists(keep):
+                total += os.path.getsize(keep)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
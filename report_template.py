@@ -0,0 +1,103 @@
+"""
+Compiled DOCX report template.
+
+A template is any DOCX with {{field}} placeholders in its body text.
+ReportTemplate pre-processes it once: placeholders split over several runs
+are merged into one, and the package is split into a ZIP holding every part
+except word/document.xml plus document.xml itself, cut into literal XML
+segments around the placeholders. Rendering a report is then string joins
+and appending one deflated part to a copy of the prebuilt ZIP bytes, with no
+python-docx object model per document.
+"""
+import hashlib
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from docx import Document
+from docx.oxml.ns import qn
+
+DOCUMENT_PART = 'word/document.xml'
+PLACEHOLDER = re.compile(r'\{\{(\w+)\}\}')
+
+# Inside a <w:t>, a line break ends the text element and adds a <w:br/>
+LINE_BREAK = '</w:t><w:br/><w:t xml:space="preserve">'
+
+
+def _merge_split_placeholders(document):
+    """Move placeholders that Word split over several runs into their first run"""
+    paragraphs = list(document.paragraphs)
+    for table in document.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                paragraphs.extend(cell.paragraphs)
+    for paragraph in paragraphs:
+        if not PLACEHOLDER.search(paragraph.text):
+            continue
+        runs = paragraph.runs
+        if sum(len(PLACEHOLDER.findall(run.text)) for run in runs) == len(PLACEHOLDER.findall(paragraph.text)):
+            continue
+        # Keep the formatting of the run where the first placeholder starts
+        first = next(i for i, run in enumerate(runs) if '{' in run.text)
+        runs[first].text = ''.join(run.text for run in runs[first:])
+        for run in runs[first + 1:]:
+            run.text = ''
+
+
+def _preserve_spaces(document):
+    """Substituted values may start or end with spaces, which Word drops without xml:space"""
+    for text in document.element.body.iter(qn('w:t')):
+        if text.text and PLACEHOLDER.search(text.text):
+            text.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+
+
+class ReportTemplate:
+    def __init__(self, source):
+        """source is a DOCX path, file object or an already built python-docx Document"""
+        document = source if hasattr(source, 'element') else Document(source)
+        _merge_split_placeholders(document)
+        _preserve_spaces(document)
+
+        package = io.BytesIO()
+        document.save(package)
+        base = io.BytesIO()
+        # Changes whenever the template does, so stored reports can be keyed on
+        # it. Built from part names and contents: the ZIP bytes also hold entry
+        # timestamps, which differ between processes.
+        digest = hashlib.sha1()
+        with zipfile.ZipFile(package) as source_zip, zipfile.ZipFile(base, 'w', zipfile.ZIP_DEFLATED) as base_zip:
+            parts = {info.filename: source_zip.read(info) for info in source_zip.infolist()}
+            for info in source_zip.infolist():
+                if info.filename == DOCUMENT_PART:
+                    document_xml = parts[info.filename].decode('utf-8')
+                else:
+                    base_zip.writestr(info, parts[info.filename], zipfile.ZIP_DEFLATED)
+        for name in sorted(parts):
+            digest.update(f"{name}\0{len(parts[name])}\0".encode('utf-8') + parts[name])
+        self._base = base.getvalue()
+        self.version = digest.hexdigest()
+
+        # Even entries are literal XML, odd entries field names
+        self._segments = PLACEHOLDER.split(document_xml)
+        self.fields = sorted(set(self._segments[1::2]))
+
+    def render_xml(self, values):
+        """document.xml with every placeholder replaced (missing fields become empty)"""
+        parts = list(self._segments)
+        for i in range(1, len(parts), 2):
+            value = values.get(parts[i])
+            parts[i] = escape('' if value is None else str(value)).replace('\n', LINE_BREAK)
+        return ''.join(parts)
+
+    def render(self, values):
+        """The filled in DOCX as bytes"""
+        output = io.BytesIO(self._base)
+        output.seek(0, io.SEEK_END)
+        with zipfile.ZipFile(output, 'a') as docx:
+            docx.writestr(DOCUMENT_PART, self.render_xml(values), zipfile.ZIP_DEFLATED)
+        return output.getvalue()
+
+    def save(self, values, path):
+        with open(path, 'wb') as f:
+            f.write(self.render(values))
@@ -0,0 +1,440 @@
+"""
+Patient report (DOCX) generation, for one patient or a batch.
+
+/search renders one report per request. generate_reports() does a whole
+sign-off run at once: the patients and their uploaded variant files are
+fetched with one query each, and the documents are rendered in parallel
+in a process pool (parsing the workbooks and building the DOCX is CPU
+bound). Run as a script to write a batch to a directory:
+
+    python reports.py --from 2024-09-01 --to 2024-09-30 --output-dir reports
+    python reports.py --lab-numbers IM599 IM600 --output-dir reports
+"""
+import argparse
+import io
+import logging
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+from docx import Document
+from docx.shared import Pt
+from db_utils import normalize_lab_number
+from patient_dates import DATE_COLUMNS, parse_date
+from report_store import report_key
+from report_template import ReportTemplate
+from variant_processing import summarize_variants
+from workbook_cache import WorkbookCache
+
+logger = logging.getLogger(__name__)
+
+# Variant columns used to build findings summaries
+SUMMARY_COLUMNS = ['Reportable Variant', 'Second review and comment on reportable variant', 'Gene Names',
+                   'Classification', 'Zygosity']
+
+# Bump when summarize_variants() changes so stored summaries are rebuilt
+SUMMARY_RULES_VERSION = 3
+
+
+def format_date(date_value):
+    """YYYY-MM-DD for dates and date strings, other values as they are"""
+    if date_value is None or pd.isna(date_value):
+        return ''
+    parsed = parse_date(date_value)
+    return parsed.strftime('%Y-%m-%d') if parsed else str(date_value)
+
+
+def patient_date(patient, column):
+    """
+    format_date() of a patients date column. Rows with the parsed DATE
+    column use it and show text that didn't parse as it is.
+    """
+    typed = DATE_COLUMNS[column]
+    if typed not in patient:
+        return format_date(patient.get(column))
+    parsed = patient[typed]
+    if parsed is not None and not pd.isna(parsed):
+        return parsed.strftime('%Y-%m-%d')
+    return _text(patient.get(column))
+
+
+def _text(value):
+    """str() of a patients value; missing values (None, NaN) are empty"""
+    if value is None or pd.isna(value):
+        return ''
+    return str(value)
+
+
+def report_data(patient, test_type=None):
+    """patient_data for create_word_document from a patients row (dict)"""
+    return {
+        'report_date': patient_date(patient, 'report_date'),
+        'im_lab_number': _text(patient.get('im_lab_number')),
+        'lab_number': _text(patient.get('lab_number')),
+        'name': _text(patient.get('name')),
+        'hkid': _text(patient.get('hkid')),
+        'dob': patient_date(patient, 'dob'),
+        'sex': _text(patient.get('sex')),
+        'age': _text(patient.get('age')),
+        'ethnicity': _text(patient.get('ethnicity')),
+        'specimen_collected': patient_date(patient, 'specimen_collected'),
+        'specimen_arrived': patient_date(patient, 'specimen_arrived'),
+        'clinical_history': _text(patient.get('case_history')),  # Use mapped column name
+        'type_of_test': _text(patient.get('type_of_test')),
+        'test_type': test_type,
+        'type_of_findings': _text(patient.get('type_of_findings'))
+    }
+
+
+def get_test_description(test_type):
+    base_desc = "In-house Immunological Disorders SuperPanel gene panel from WES was tested by next generation sequencing, and 516 genes were included in the panel test."
+    if (test_type or '').lower() == 'trio':
+        return f"{base_desc} Trio analysis has been performed."
+    return base_desc
+
+
+def uploaded_file_path(file_name, upload_folder='uploads'):
+    """Where an uploaded_files.file_name is on disk (uploads are saved in the upload folder)"""
+    if not file_name:
+        return None
+    if os.path.exists(file_name):
+        return file_name
+    return os.path.join(upload_folder, file_name)
+
+
+def build_summary(file_path, workbook_cache):
+    """Findings summary of an uploaded workbook, from its rows where "Reportable Variant" is not empty"""
+    return summarize_variants(workbook_cache.read_variants(file_path, SUMMARY_COLUMNS, reportable_only=True))
+
+
+def get_summary_result(file_path, workbook_cache):
+    """SUMMARY OF RESULT(S) text from the reportable variants of an uploaded workbook"""
+    if not file_path:
+        return "No uploaded file found for this patient."
+    if not os.path.exists(file_path):
+        logger.warning("Uploaded file not found", extra={'path': file_path})
+        return "Uploaded file not found on the server."
+
+    try:
+        return build_summary(file_path, workbook_cache)
+    except Exception:
+        logger.exception("Error processing uploaded file", extra={'path': file_path})
+        return "Error processing the uploaded file for this patient."
+
+
+def find_upload(files, patient):
+    """The patient's entry in DatabaseManager.get_uploaded_files() results, or None"""
+    # Uploads are recorded under the IM lab number, older ones under the lab number
+    for column in ('lab_number', 'im_lab_number'):
+        if patient.get(column) and normalize_lab_number(patient[column]) in files:
+            return files[normalize_lab_number(patient[column])]
+    return None
+
+
+def upload_summary(upload, upload_folder, workbook_cache):
+    """
+    Report summary for an uploaded file (an uploaded_files row, or None).
+    The summary stored at ingest is used while the file's content hash and
+    SUMMARY_RULES_VERSION still match; otherwise it is rebuilt. Returns
+    (summary, recomputed), recomputed being the (file_name, summary,
+    source_hash, version) to save, or None.
+    """
+    if upload is None:
+        return get_summary_result(None, workbook_cache), None
+    stored = upload.get('report_summary')
+    current_rules = upload.get('summary_version') == SUMMARY_RULES_VERSION
+    file_path = uploaded_file_path(upload['file_name'], upload_folder)
+    if not os.path.exists(file_path):
+        # The source is gone, so the stored summary is the best we have
+        if stored is not None and current_rules:
+            return stored, None
+        return get_summary_result(file_path, workbook_cache), None
+
+    source_hash = workbook_cache.content_hash(file_path)
+    if stored is not None and current_rules and upload.get('summary_source_hash') == source_hash:
+        return stored, None
+    try:
+        summary = build_summary(file_path, workbook_cache)
+    except Exception:
+        logger.exception("Error processing uploaded file", extra={'path': file_path})
+        return "Error processing the uploaded file for this patient.", None
+    return summary, (upload['file_name'], summary, source_hash, SUMMARY_RULES_VERSION)
+
+
+def _report_date(value):
+    """YYYY-MM-DD -> DD/MM/YYYY for the report"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%d/%m/%Y')
+    except (TypeError, ValueError):
+        return value
+
+
+# Report placeholders -> label; REPORT DATE and the sections are filled in separately
+REPORT_INFO_FIELDS = [
+    ('lab_numbers', 'Lab. #'),
+    ('name', 'Name'),
+    ('hkid', 'HKID'),
+    ('dob', 'Date of Birth'),
+    ('sex', 'Sex'),
+    ('age', 'Age'),
+    ('ethnicity', 'Ethnicity'),
+    ('specimen_collected', 'Specimen Collected'),
+    ('specimen_arrived', 'Specimen Arrived'),
+]
+
+REPORT_SECTION_FIELDS = [
+    ('specimen', 'SPECIMEN'),
+    ('clinical_history', 'CLINICAL HISTORY'),
+    ('type_of_test', 'TYPE OF TESTING REQUESTED'),
+    ('test_description', 'TEST DESCRIPTION'),
+    ('summary', 'SUMMARY OF RESULT(S)'),
+]
+
+REPORT_FIELDS = ['report_date'] + [field for field, _ in REPORT_INFO_FIELDS + REPORT_SECTION_FIELDS]
+
+
+def report_fields(patient_data, summary):
+    """Text of every report placeholder for a patient"""
+    return {
+        'report_date': _report_date(patient_data['report_date']) if patient_data['report_date'] else '',
+        'lab_numbers': f"{patient_data['im_lab_number']}/{patient_data['lab_number']}",
+        'name': str(patient_data['name']),
+        'hkid': str(patient_data['hkid']),
+        'dob': str(_report_date(patient_data['dob'])),
+        'sex': str(patient_data['sex']),
+        'age': str(patient_data['age']),
+        'ethnicity': str(patient_data['ethnicity']),
+        'specimen_collected': str(_report_date(patient_data['specimen_collected'])),
+        'specimen_arrived': str(_report_date(patient_data['specimen_arrived'])),
+        'specimen': 'EDTA blood',
+        'clinical_history': str(patient_data['clinical_history']),  # Use clinical_history key
+        'type_of_test': str(patient_data.get('type_of_test', '')),
+        'test_description': get_test_description(patient_data.get('test_type', '')),
+        'summary': str(summary),
+    }
+
+
+def build_document(fields):
+    """Build the report with python-docx, paragraph by paragraph"""
+    output_doc = Document()
+
+    style = output_doc.styles['Normal']
+    style.font.name = 'Calibri'
+    style.font.size = Pt(12)
+
+    # Add report date with label and proper formatting
+    p = output_doc.add_paragraph()
+    p.add_run("REPORT DATE: ").bold = True
+    p.add_run(fields['report_date']).bold = True
+
+    # Add patient information with formatting
+    for field, label in REPORT_INFO_FIELDS:
+        p = output_doc.add_paragraph()
+        p.add_run(f"{label}: ").bold = True
+        p.add_run(fields[field])
+
+    # Add line separator at the end
+    p = output_doc.add_paragraph()
+    p.add_run("-" * 117)
+
+    # Add summary of results
+    for field, label in REPORT_SECTION_FIELDS:
+        # Add title paragraph
+        p = output_doc.add_paragraph()
+        p.add_run(f"{label}:").bold = True
+
+        # Add value on next line
+        p = output_doc.add_paragraph()
+        p.add_run(fields[field])
+
+    return output_doc
+
+
+_report_template = None
+_report_template_lock = threading.Lock()
+
+
+def get_report_template():
+    """
+    The compiled report template, loaded once per process: REPORT_TEMPLATE
+    (a DOCX with {{field}} placeholders, see REPORT_FIELDS) or the built in
+    layout.
+    """
+    global _report_template
+    if _report_template is None:
+        # Request threads may ask for it at the same time; only one compiles it
+        with _report_template_lock:
+            if _report_template is None:
+                path = os.getenv('REPORT_TEMPLATE')
+                source = path if path else build_document({field: f"{{{{{field}}}}}" for field in REPORT_FIELDS})
+                _report_template = ReportTemplate(source)
+    return _report_template
+
+
+def report_name_part(value):
+    """value with everything but letters, digits and '-' removed, for report file names"""
+    if value is None or pd.isna(value):
+        return ''
+    return re.sub(r'[^A-Za-z0-9-]', '', str(value))
+
+
+def batch_report_names(patients):
+    """
+    File name part for each patients row (dict) of a batch: the IM lab
+    number, else the lab number, else row<id>. A name already taken in the
+    batch (compared case-insensitively) gets the row id appended.
+    """
+    names = []
+    used = set()
+    for patient in patients:
+        name = (report_name_part(patient.get('im_lab_number')) or report_name_part(patient.get('lab_number'))
+                or f"row{patient['id']}")
+        candidate, n = name, 1
+        while candidate.upper() in used:
+            candidate = f"{name}-{patient['id']}" if n == 1 else f"{name}-{patient['id']}-{n}"
+            n += 1
+        used.add(candidate.upper())
+        names.append(candidate)
+    return names
+
+
+def create_word_document(patient_data, summary, output_dir='.', name=None):
+    """
+    Write the report DOCX into output_dir and return its file name,
+    patient_info_<name>_<content key>.docx. name defaults to the IM lab
+    number or lab number; batches pass batch_report_names() so no two
+    patients share a file.
+    """
+    fields = report_fields(patient_data, summary)
+    template = get_report_template()
+    name = name or report_name_part(patient_data['im_lab_number']) or report_name_part(patient_data['lab_number'])
+    filename = f"patient_info_{name}_{report_key(fields, template.version)[:16]}.docx"
+
+    template.save(fields, os.path.join(output_dir, filename))
+    return filename
+
+
+def store_report(store, patient_data, summary):
+    """
+    Render the report into a ReportStore unless an identical one is already
+    stored. Returns its download name, patient_info_<lab number>_<key>.docx.
+    """
+    fields = report_fields(patient_data, summary)
+    template = get_report_template()
+    key = report_key(fields, template.version)
+    store.get_or_create(key, lambda: template.render(fields))
+    lab_number = report_name_part(patient_data['lab_number'])
+    return f"patient_info_{lab_number}_{key}.docx"
+
+
+def stored_report_key(filename):
+    """Store key in a store_report() download name, or None"""
+    match = re.match(r'^patient_info_[A-Za-z0-9-]*_([0-9a-f]{64})\.docx$', filename)
+    return match.group(1) if match else None
+
+
+# Each pool process keeps its own in-memory cache; sidecar files are shared
+_worker_cache = None
+
+
+def _render_report(task):
+    """Process pool entry point: (lab_number, file name or None, error or None, recomputed summary or None)"""
+    global _worker_cache
+    patient_data, upload, upload_folder, output_dir, cache_dir, name = task
+    try:
+        if _worker_cache is None:
+            _worker_cache = WorkbookCache(cache_dir=cache_dir)
+        summary, recomputed = upload_summary(upload, upload_folder, _worker_cache)
+        filename = create_word_document(patient_data, summary, output_dir, name)
+        return patient_data['lab_number'], filename, None, recomputed
+    except Exception as e:
+        return patient_data['lab_number'], None, str(e), None
+
+
+def generate_reports(db, output_dir, lab_numbers=None, date_from=None, date_to=None, test_type=None,
+                     upload_folder='uploads', workers=None, cache_dir='.workbook_cache'):
+    """
+    Render reports for the patients matching lab_numbers and/or the report
+    date range into output_dir. test_type defaults to each patient's type
+    of test. Returns {'written': [file names], 'missing': [lab numbers not
+    found], 'errors': [{'lab_number', 'error'}]}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    patients = db.get_report_patients(lab_numbers, date_from, date_to)
+
+    found = set()
+    for patient in patients:
+        found.update(normalize_lab_number(patient[column]) for column in ('lab_number', 'im_lab_number') if patient[column])
+    missing = [lab_number for lab_number in (lab_numbers or []) if normalize_lab_number(lab_number) not in found]
+
+    files = db.get_uploaded_files(
+        [patient[column] for patient in patients for column in ('lab_number', 'im_lab_number')]
+    )
+    tasks = [
+        (report_data(patient, test_type or patient.get('type_of_test')), find_upload(files, patient),
+         upload_folder, output_dir, cache_dir, name)
+        for patient, name in zip(patients, batch_report_names(patients))
+    ]
+
+    if workers == 1 or len(tasks) <= 1:
+        results = [_render_report(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_render_report, tasks, chunksize=max(1, len(tasks) // 32)))
+
+    # Keep summaries that had to be rebuilt so the next run reads them
+    db.save_upload_summaries(list({recomputed[0]: recomputed for *_, recomputed in results if recomputed}.values()))
+
+    written = [filename for _, filename, _, _ in results if filename]
+    errors = [{'lab_number': lab_number, 'error': error} for lab_number, _, error, _ in results if error]
+    return {'written': written, 'missing': missing, 'errors': errors}
+
+
+def zip_reports(output_dir, result):
+    """The written reports (plus errors.txt if anything failed) as a ZIP in memory"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filename in result['written']:
+            archive.write(os.path.join(output_dir, filename), filename)
+        problems = [f"{lab_number}: not found" for lab_number in result['missing']]
+        problems += [f"{error['lab_number']}: {error['error']}" for error in result['errors']]
+        if problems:
+            archive.writestr('errors.txt', "\n".join(problems) + "\n")
+    buffer.seek(0)
+    return buffer
+
+
+def main():
+    import logs
+    from db_utils import DatabaseManager
+
+    logs.configure(fmt='text')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lab-numbers', nargs='+', help='lab numbers or IM lab numbers')
+    parser.add_argument('--from', dest='date_from', help='first report date (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='date_to', help='last report date (YYYY-MM-DD)')
+    parser.add_argument('--test-type', help='test type for the description, e.g. trio (default: type of test)')
+    parser.add_argument('--output-dir', default='reports')
+    parser.add_argument('--uploads', default='uploads', help='folder with the uploaded variant files')
+    parser.add_argument('--workers', type=int, default=None, help='render processes (default: CPU count)')
+    args = parser.parse_args()
+    if not (args.lab_numbers or args.date_from or args.date_to):
+        parser.error('give --lab-numbers and/or --from/--to')
+
+    result = generate_reports(
+        DatabaseManager(), args.output_dir, args.lab_numbers, args.date_from, args.date_to,
+        args.test_type, args.uploads, args.workers
+    )
+    print(f"Wrote {len(result['written'])} reports to {args.output_dir}")
+    for lab_number in result['missing']:
+        print(f"Not found: {lab_number}")
+    for error in result['errors']:
+        print(f"Error for {error['lab_number']}: {error['error']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Tables and indexes of patients_db, shared by the MySQL and SQLite backends.
+
+Definitions are written in MySQL spelling; the *_sql() functions render
+them for a dialect, swapping the few things SQLite spells differently
+(auto-increment keys, UNSIGNED, stored generated columns, index prefix
+lengths, table options). Migrations create every table, column and index
+from here, so both backends end up with the same schema.
+"""
+import re
+
+# table -> [(column, definition)]; a dict definition is spelled per dialect
+TABLES = {
+    'patients': [
+        ('id', 'INT AUTO_INCREMENT PRIMARY KEY'),
+        # Dates and lab numbers are free text in the master list
+        ('report_date', 'TEXT'),
+        ('lab_number', 'VARCHAR(1000)'),
+        ('im_lab_number', 'VARCHAR(1000)'),
+        ('name', 'VARCHAR(1000)'),
+        ('hkid', 'TEXT'),
+        ('dob', 'TEXT'),
+        ('sex', 'VARCHAR(100)'),
+        ('age', 'VARCHAR(100)'),
+        ('ethnicity', 'VARCHAR(500)'),
+        ('specimen_collected', 'TEXT'),
+        ('specimen_arrived', 'TEXT'),
+        ('case_history', 'TEXT'),
+        ('type_of_test', 'VARCHAR(500)'),
+        ('type_of_findings', 'VARCHAR(500)'),
+        ('created_at', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'),
+        ('findings_summary', 'TEXT'),
+        # Indexable normalized lab numbers (see db_utils.normalize_lab_number)
+        ('lab_key', "VARCHAR(64) GENERATED ALWAYS AS (SUBSTR(UPPER(TRIM(lab_number)), 1, 64)) STORED"),
+        ('im_lab_key', "VARCHAR(64) GENERATED ALWAYS AS (SUBSTR(UPPER(TRIM(im_lab_number)), 1, 64)) STORED"),
+        ('patient_key', {
+            'mysql': "VARCHAR(129) GENERATED ALWAYS AS (CONCAT(IFNULL(lab_key, ''), '|', IFNULL(im_lab_key, ''))) STORED",
+            'sqlite': "VARCHAR(129) GENERATED ALWAYS AS (IFNULL(lab_key, '') || '|' || IFNULL(im_lab_key, '')) STORED",
+        }),
+        ('row_hash', 'CHAR(40)'),
+        ('report_on', 'DATE'),
+        ('born_on', 'DATE'),
+        ('collected_on', 'DATE'),
+        ('arrived_on', 'DATE'),
+    ],
+    'uploaded_files': [
+        ('id', 'INT AUTO_INCREMENT PRIMARY KEY'),
+        ('file_type', 'VARCHAR(20)'),
+        ('file_name', 'VARCHAR(255)'),
+        ('lab_number', 'VARCHAR(64)'),
+        ('upload_date', 'DATETIME DEFAULT CURRENT_TIMESTAMP'),
+        ('report_summary', 'TEXT'),
+        ('summary_source_hash', 'CHAR(40)'),
+        ('summary_version', 'INT'),
+    ],
+    'variants': [
+        ('id', 'BIGINT AUTO_INCREMENT PRIMARY KEY'),
+        ('upload_id', 'INT NOT NULL'),
+        ('lab_number', 'VARCHAR(64) NOT NULL'),
+        ('file_type', 'VARCHAR(20)'),
+        ('source_row', 'INT NOT NULL'),
+        ('chr', 'VARCHAR(2) NOT NULL'),
+        ('pos', 'INT UNSIGNED NOT NULL'),
+        ('reportable', 'VARCHAR(8)'),
+        ('igv_review', 'VARCHAR(32)'),
+        ('review_comment', 'TEXT'),
+        ('gene_names', 'VARCHAR(1000)'),
+        ('hgvs_c', 'VARCHAR(512)'),
+        ('hgvs_p', 'VARCHAR(255)'),
+        ('exon', 'VARCHAR(32)'),
+        ('zygosity', 'VARCHAR(32)'),
+        ('inheritance', 'VARCHAR(255)'),
+        ('classification', 'VARCHAR(64)'),
+        ('omim_id', 'VARCHAR(255)'),
+        ('rsid', 'VARCHAR(64)'),
+        ('title', 'TEXT'),
+        ('inherited_from', 'VARCHAR(32)'),
+    ],
+    'variant_genes': [
+        ('variant_id', 'BIGINT NOT NULL'),
+        ('gene', 'VARCHAR(64) NOT NULL'),
+    ],
+    'date_quarantine': [
+        ('patient_id', 'INT NOT NULL'),
+        ('column_name', 'VARCHAR(32) NOT NULL'),
+        ('raw_value', 'TEXT'),
+        ('found_at', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    'schema_migrations': [
+        ('version', 'INT PRIMARY KEY'),
+        ('description', 'VARCHAR(255)'),
+        ('applied_at', 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'),
+    ],
+    # Change counters the app processes check to drop their caches (see data_versions.py)
+    'data_versions': [
+        ('name', 'VARCHAR(64) PRIMARY KEY'),
+        ('version', 'BIGINT NOT NULL'),
+    ],
+}
+
+# Raw rows of uploaded variant files, one column per spreadsheet header
+UPLOAD_TABLE_COLUMNS = [
+    'Reportable Variant', 'Chr:Pos', 'IGV review ( True / False call)',
+    'Second review and comment on reportable variant', 'Gene Names',
+    'HGVS c. (Clinically Relevant)', 'HGVS p. (Clinically Relevant)',
+    'Exon Number (Clinically Relevant)', 'Zygosity', 'Inheritance', 'Classification',
+    'OMIM ID', 'RSID', 'Title'
+]
+TABLES['singleton'] = [('id', 'INT AUTO_INCREMENT PRIMARY KEY')] + [(column, 'TEXT') for column in UPLOAD_TABLE_COLUMNS]
+TABLES['trio'] = TABLES['singleton'] + [('Inherited From', 'TEXT')]
+
+# table -> table constraints after the columns
+CONSTRAINTS = {
+    'variants': [
+        "CONSTRAINT fk_variants_upload FOREIGN KEY (upload_id) REFERENCES uploaded_files (id) ON DELETE CASCADE",
+    ],
+    'variant_genes': [
+        "PRIMARY KEY (gene, variant_id)",
+        "CONSTRAINT fk_variant_genes_variant FOREIGN KEY (variant_id) REFERENCES variants (id) ON DELETE CASCADE",
+    ],
+    'date_quarantine': [
+        "PRIMARY KEY (patient_id, column_name)",
+        "CONSTRAINT fk_date_quarantine_patient FOREIGN KEY (patient_id) REFERENCES patients (id) ON DELETE CASCADE",
+    ],
+}
+
+# index -> (table, columns, unique); name(191) is a MySQL prefix index, the whole column on SQLite
+INDEXES = {
+    'idx_patients_lab_key': ('patients', 'lab_key', False),
+    'idx_patients_im_lab_key': ('patients', 'im_lab_key', False),
+    'idx_patients_name': ('patients', 'name(191)', False),
+    'idx_patients_type_of_test': ('patients', 'type_of_test', False),
+    'idx_patients_type_of_findings': ('patients', 'type_of_findings', False),
+    'idx_patients_created_at': ('patients', 'created_at', False),
+    'uq_patients_patient_key': ('patients', 'patient_key', True),
+    'idx_patients_report_on': ('patients', 'report_on', False),
+    'idx_patients_collected_on': ('patients', 'collected_on', False),
+    'idx_patients_arrived_on': ('patients', 'arrived_on', False),
+    'idx_uploaded_files_lab_number': ('uploaded_files', 'lab_number', False),
+    'idx_uploaded_files_file_name': ('uploaded_files', 'file_name(191)', False),
+    'uq_variants_upload_row': ('variants', 'upload_id, source_row', True),
+    'idx_variants_lab_number': ('variants', 'lab_number', False),
+    'idx_variants_chr_pos': ('variants', 'chr, pos', False),
+    'idx_variants_classification': ('variants', 'classification', False),
+    'idx_variants_zygosity': ('variants', 'zygosity', False),
+    'idx_variant_genes_variant': ('variant_genes', 'variant_id', False),
+}
+
+MYSQL_TABLE_OPTIONS = 'ENGINE=InnoDB DEFAULT CHARSET=utf8mb4'
+
+
+def quote(column):
+    """Backquoted if it isn't a plain identifier (spreadsheet headers); both dialects accept backquotes"""
+    return column if re.match(r'^\w+$', column) else f"`{column}`"
+
+
+def _definition(definition, dialect):
+    if isinstance(definition, dict):
+        definition = definition[dialect]
+    if dialect == 'sqlite':
+        definition = re.sub(r'^(BIG)?INT AUTO_INCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT', definition)
+        definition = definition.replace(' UNSIGNED', '')
+        # SQLite can only add VIRTUAL generated columns to an existing table; indexes store the value anyway
+        definition = re.sub(r' STORED$', ' VIRTUAL', definition)
+    return definition
+
+
+def column_sql(table, column, dialect):
+    """'column definition' for CREATE TABLE / ALTER TABLE ADD COLUMN"""
+    definition = dict(TABLES[table])[column]
+    return f"{quote(column)} {_definition(definition, dialect)}"
+
+
+def create_table_sql(table, dialect):
+    parts = [column_sql(table, column, dialect) for column, _ in TABLES[table]] + CONSTRAINTS.get(table, [])
+    body = ',\n    '.join(parts)
+    options = f" {MYSQL_TABLE_OPTIONS}" if dialect == 'mysql' else ''
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n    {body}\n){options}"
+
+
+def create_index_sql(index, dialect):
+    table, columns, unique = INDEXES[index]
+    if dialect == 'sqlite':
+        columns = re.sub(r'\(\d+\)', '', columns)
+    return f"CREATE {'UNIQUE ' if unique else ''}INDEX {index} ON {table} ({columns})"
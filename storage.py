@@ -0,0 +1,176 @@
+"""
+Storage backends behind db_utils.DatabaseManager.
+
+DB_BACKEND picks the database: 'mysql' (the default, configured with the
+MYSQL_* variables) or 'sqlite', a single file at SQLITE_PATH in WAL mode,
+for small sites without a MySQL server and for in-process benchmarks and
+tests. Both get the same tables and indexes from schema.py.
+
+Queries are written once for MySQL with %s parameters; SQLiteConnection
+translates them and takes FOR UPDATE as a write lock on the database. The
+few functions that differ (dates, upserts) ask the backend or dialect().
+"""
+import os
+import re
+import sqlite3
+from datetime import date, datetime
+
+import mysql.connector
+
+# Errors raised by either backend's driver
+DATABASE_ERRORS = (mysql.connector.Error, sqlite3.Error)
+
+FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\s*$', re.IGNORECASE)
+
+
+def dialect(conn):
+    """'mysql' or 'sqlite' for a connection or cursor of either backend"""
+    return getattr(conn, 'dialect', 'mysql')
+
+
+class MySQLBackend:
+    dialect = 'mysql'
+    # Connection-level errors mean the socket can't be trusted any more
+    DISCONNECT_ERRORS = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+
+    def __init__(self, config):
+        self.config = config
+
+    def connect(self):
+        return mysql.connector.connect(**self.config)
+
+    def create_database(self):
+        """Drop and recreate the (empty) database"""
+        server = {k: v for k, v in self.config.items() if k != 'database'}
+        conn = mysql.connector.connect(**server)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"DROP DATABASE IF EXISTS {self.config['database']}")
+            cursor.execute(f"CREATE DATABASE {self.config['database']}")
+        finally:
+            conn.close()
+
+    def year(self, column):
+        return f"YEAR({column})"
+
+    def month(self, column):
+        return f"MONTH({column})"
+
+    def days_between(self, later, earlier):
+        return f"DATEDIFF({later}, {earlier})"
+
+
+class SQLiteCursor:
+    """sqlite3 cursor taking MySQL-style queries; cursor(dictionary=True) rows are dicts"""
+    dialect = 'sqlite'
+
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._cursor = conn.raw.cursor()
+        if dictionary:
+            self._cursor.row_factory = lambda cursor, row: {
+                column[0]: value for column, value in zip(cursor.description, row)
+            }
+
+    def __getattr__(self, name):
+        # description, rowcount, lastrowid, fetchone, fetchmany, fetchall, close
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, params=()):
+        self._cursor.execute(self._conn.prepare(query), params or ())
+        return self
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(self._conn.prepare(query), rows)
+        return self
+
+
+class SQLiteConnection:
+    """sqlite3 connection with the parts of the mysql.connector interface the app uses"""
+    dialect = 'sqlite'
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __getattr__(self, name):
+        # commit, rollback, close, in_transaction
+        return getattr(self.raw, name)
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self, dictionary)
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self.raw.execute("SELECT 1")
+
+    def prepare(self, query):
+        """MySQL query -> SQLite query; FOR UPDATE becomes a write transaction"""
+        if FOR_UPDATE.search(query):
+            query = FOR_UPDATE.sub('', query)
+            if not self.raw.in_transaction:
+                self.raw.execute("BEGIN IMMEDIATE")
+        return query.replace('%s', '?')
+
+
+class SQLiteBackend:
+    dialect = 'sqlite'
+    # A failed statement never leaves the file unusable
+    DISCONNECT_ERRORS = ()
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.config = {'database': path}
+
+    def connect(self):
+        # Pooled connections move between threads, but only one uses a connection at a time
+        raw = sqlite3.connect(self.path, timeout=self.timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                              check_same_thread=False)
+        # WAL lets readers carry on while an import or upload writes
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+        raw.execute("PRAGMA foreign_keys=ON")
+        return SQLiteConnection(raw)
+
+    def create_database(self):
+        """Remove the database file so the next connection starts empty"""
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def year(self, column):
+        return f"CAST(strftime('%Y', {column}) AS INTEGER)"
+
+    def month(self, column):
+        return f"CAST(strftime('%m', {column}) AS INTEGER)"
+
+    def days_between(self, later, earlier):
+        return f"CAST(julianday({later}) - julianday({earlier}) AS INTEGER)"
+
+
+# DATE / TIMESTAMP columns come back as date / datetime, as they do from MySQL
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+
+
+def get_backend(database=None):
+    """
+    The backend DB_BACKEND selects; database overrides the database name
+    (MYSQL_DATABASE) or file (SQLITE_PATH)
+    """
+    name = os.getenv('DB_BACKEND', 'mysql').lower()
+    if name == 'sqlite':
+        return SQLiteBackend(database or os.getenv('SQLITE_PATH', 'patients.db'))
+    if name == 'mysql':
+        return MySQLBackend({
+            'host': os.getenv('MYSQL_HOST', 'localhost'),
+            'user': os.getenv('MYSQL_USER', 'root'),
+            'password': os.getenv('MYSQL_PASSWORD', 'password'),
+            'database': database or os.getenv('MYSQL_DATABASE', 'patients_db'),
+        })
+    raise ValueError(f"Unsupported DB_BACKEND: {name}")
@@ -0,0 +1,92 @@
+"""
+Shared fixtures: a migrated scratch SQLite database per test, and the Flask
+app pointed at its own scratch database, caches and uploads.
+
+Run from the project directory with:
+
+    python -m pytest
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db_utils import DatabaseManager
+from migrations import ensure_schema
+from storage import SQLiteBackend
+
+
+def patient(i, **columns):
+    """patients row dict for test patient i"""
+    row = {
+        'lab_number': f'M24-{i:04d}',
+        'im_lab_number': f'IM{i:04d}',
+        'name': f'Patient {i}',
+        'report_date': '2024-09-01',
+        'type_of_test': 'SuperPanel',
+        'type_of_findings': 'Negative',
+    }
+    row.update(columns)
+    return row
+
+
+def add_variants(db, variants, lab_number='M24-0001'):
+    """Store (chr, pos, gene or None) variants as one upload, returns their ids"""
+    ids = []
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO uploaded_files (file_type, file_name, lab_number) VALUES (%s, %s, %s)",
+                       ('singleton', 'superpanel.xlsx', lab_number))
+        upload_id = cursor.lastrowid
+        for row, (chr, pos, gene) in enumerate(variants):
+            cursor.execute(
+                "INSERT INTO variants (upload_id, lab_number, file_type, source_row, chr, pos) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                (upload_id, lab_number, 'singleton', row, chr, pos)
+            )
+            ids.append(cursor.lastrowid)
+            if gene:
+                cursor.execute("INSERT INTO variant_genes (variant_id, gene) VALUES (%s, %s)", (ids[-1], gene))
+        conn.commit()
+    return ids
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'patients.db'))
+    conn = backend.connect()
+    try:
+        ensure_schema(conn)
+    finally:
+        conn.close()
+    return backend
+
+
+@pytest.fixture
+def db(backend):
+    db = DatabaseManager(backend=backend)
+    # Read the change counter on every call instead of once a second
+    db.version_interval = 0
+    yield db
+    db.close_pool()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """patient_info with its database, caches and uploads under a scratch directory"""
+    work_dir = tmp_path_factory.mktemp('app')
+    os.environ['DB_BACKEND'] = 'sqlite'
+    for name, path in (('SQLITE_PATH', 'patients.db'), ('WORKBOOK_CACHE_DIR', 'workbook_cache'),
+                       ('REPORT_STORE_DIR', 'report_store'), ('JOB_DB_PATH', 'jobs.sqlite3'),
+                       ('GENOME_INDEX_PATH', 'genome_index.pkl')):
+        os.environ[name] = str(work_dir / path)
+    import patient_info
+    patient_info.app.config['UPLOAD_FOLDER'] = str(work_dir / 'uploads')
+    os.makedirs(patient_info.app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with patient_info.db.get_connection() as conn:
+        ensure_schema(conn)
+    yield patient_info
+    patient_info.db.close_pool()
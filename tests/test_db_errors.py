@@ -0,0 +1,34 @@
+import logging
+
+import pytest
+
+import metrics
+
+
+def errors(method):
+    return metrics.DB_ERRORS._series.get((method,), 0)
+
+
+def test_caught_errors_are_counted_once(db, caplog):
+    with db.get_connection() as conn:
+        conn.cursor().execute("DROP TABLE patients")
+        conn.commit()
+    before = {method: errors(method) for method in ('get_findings_summary', 'get_all_patients', 'update_findings')}
+
+    with caplog.at_level(logging.ERROR, logger='db_utils'):
+        assert db.get_findings_summary('M24-0001') is None
+        assert db.update_findings(lab_number='M24-0001', findings='Positive') is False
+    assert [record.lab_number for record in caplog.records] == ['M24-0001', 'M24-0001']
+    first, second = db.get_all_patients(), db.get_all_patients()
+    assert first.empty and first is not second
+
+    assert {method: errors(method) - count for method, count in before.items()} == {
+        'get_findings_summary': 1, 'get_all_patients': 2, 'update_findings': 1
+    }
+
+
+def test_errors_that_raise_are_counted(db):
+    before = errors('query_patients')
+    with pytest.raises(ValueError):
+        db.query_patients(sort='no_such_column')
+    assert errors('query_patients') == before + 1
@@ -0,0 +1,183 @@
+import pandas as pd
+import pytest
+
+from conftest import add_variants
+from genome_index import GenomeIndex, parse_region
+from migrations import ensure_schema
+from variant_store import CHR_POS_COLUMN, load_variants
+
+
+def genome_index(db, path, save_interval=0):
+    return GenomeIndex(str(path), db.get_variant_positions, load_generation=db.variants_version,
+                       save_interval=save_interval)
+
+
+def reupload(db, variant_id, positions):
+    """Load the upload of variant_id again with these 'chr:pos' variants, like a file uploaded twice"""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT upload_id, lab_number FROM variants WHERE id = %s", (variant_id,))
+        upload_id, lab_number = cursor.fetchone()
+        load_variants(cursor, pd.DataFrame({CHR_POS_COLUMN: positions}), upload_id, lab_number, 'singleton')
+        conn.commit()
+
+
+def panel_index(path):
+    """An index without variants, for the panel tests"""
+    return GenomeIndex(str(path), lambda after_id: [])
+
+
+def test_sync_is_incremental(db, tmp_path):
+    first = add_variants(db, [('1', 300, None), ('1', 100, None), ('X', 50, None)])
+    index = genome_index(db, tmp_path / 'genome_index.pkl')
+    assert index.sync() == 3
+    assert index.sync() == 0
+
+    second = add_variants(db, [('1', 200, None), ('1', 100, None)])
+    assert index.sync() == 2
+    assert index.query('1', 100, 300) == [(100, first[1]), (100, second[1]), (200, second[0]), (300, first[0])]
+    assert index.query('x', 1, 100) == [(50, first[2])]
+    assert index.query('2', 1, 1000) == []
+    assert index.stats() == {'variants': 5, 'chromosomes': 2, 'panel_genes': 0, 'max_id': second[1]}
+
+
+def test_query_pages(db, tmp_path):
+    add_variants(db, [('1', pos, None) for pos in (100, 200, 200, 200, 300)])
+    index = genome_index(db, tmp_path / 'genome_index.pkl')
+    index.sync()
+    pages, after = [], None
+    while True:
+        page = index.query('1', 150, 300, limit=2, after=after)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]
+    assert pages == [[(200, 2), (200, 3)], [(200, 4), (300, 5)]]
+
+
+def test_saved_index_is_picked_up(db, tmp_path):
+    path = tmp_path / 'genome_index.pkl'
+    add_variants(db, [('1', 100, None), ('2', 200, None)])
+    genome_index(db, path).sync()
+
+    index = genome_index(db, path)
+    assert index.stats()['variants'] == 2
+    add_variants(db, [('2', 300, None)])
+    assert index.sync() == 1
+    assert index.query('2', 1, 1000) == [(200, 2), (300, 3)]
+
+
+def test_saves_are_throttled(db, tmp_path):
+    path = tmp_path / 'genome_index.pkl'
+    add_variants(db, [('1', 100, None), ('2', 200, None)])
+    index = genome_index(db, path, save_interval=3600)
+    index.sync()
+    add_variants(db, [('2', 300, None)])
+    index.sync()
+    assert not path.exists()
+
+    index.save()
+    assert genome_index(db, path).stats()['variants'] == 3
+
+
+def test_database_reset_rebuilds_the_index(db, backend, tmp_path):
+    path = tmp_path / 'genome_index.pkl'
+    add_variants(db, [('1', pos, None) for pos in (100, 200, 300, 400)])
+    genome_index(db, path).sync()
+
+    # database_setup.py recreates the database: ids start again from 1 and grow past the old ones
+    db.close_pool()
+    backend.create_database()
+    conn = backend.connect()
+    try:
+        ensure_schema(conn)
+    finally:
+        conn.close()
+    ids = add_variants(db, [('1', 150, None), ('3', 250, None), ('3', 260, None), ('3', 270, None),
+                            ('3', 280, None)])
+    assert ids == [1, 2, 3, 4, 5]
+
+    index = genome_index(db, path)
+    assert index.stats()['max_id'] == 4
+    assert index.sync() == 5
+    assert index.query('1', 1, 1000) == [(150, 1)]
+    assert index.query('3', 1, 260) == [(250, 2), (260, 3)]
+    assert genome_index(db, path).stats() == index.stats()
+
+
+def test_uploading_a_file_again_rebuilds_the_index(db, tmp_path):
+    ids = add_variants(db, [('1', 100, None), ('1', 200, None)])
+    other = add_variants(db, [('1', 150, None)], lab_number='M24-0002')
+    index = genome_index(db, tmp_path / 'genome_index.pkl')
+    index.sync()
+
+    reupload(db, ids[0], ['chr1:300'])
+    assert index.sync() == 2
+    (_, new_id), = index.query('1', 300, 300)
+    assert index.query('1', 1, 1000) == [(150, other[0]), (300, new_id)]
+    assert new_id > other[0]
+
+
+def test_a_new_upload_keeps_the_index(db, tmp_path):
+    add_variants(db, [('1', 100, None)])
+    index = genome_index(db, tmp_path / 'genome_index.pkl')
+    index.sync()
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO uploaded_files (file_type, file_name, lab_number) VALUES (%s, %s, %s)",
+                       ('singleton', 'new.xlsx', 'M24-0002'))
+        load_variants(cursor, pd.DataFrame({CHR_POS_COLUMN: ['chr1:200']}), cursor.lastrowid, 'M24-0002',
+                      'singleton')
+        conn.commit()
+    # Only the new row is loaded, no rebuild
+    assert index.sync() == 1
+
+
+def test_region_pages_skip_deleted_variants(app_module):
+    db, client = app_module.db, app_module.app.test_client()
+    ids = add_variants(db, [('21', pos, None) for pos in range(100, 700, 100)])
+    app_module.genome_index.sync()
+    # Deleted behind the index's back: its ids come back from the index but not from the database
+    with db.get_connection() as conn:
+        conn.cursor().execute(f"DELETE FROM variants WHERE id IN ({ids[0]}, {ids[2]}, {ids[3]})")
+        conn.commit()
+
+    pages, cursor = [], None
+    while True:
+        response = client.get('/region', query_string={'region': 'chr21:1-1000', 'limit': 2,
+                                                        **({'cursor': cursor} if cursor else {})}).get_json()
+        pages.append([row['id'] for row in response['data']])
+        cursor = response['next_cursor']
+        if cursor is None:
+            break
+    assert pages == [[ids[1], ids[4]], [ids[5]]]
+
+
+def test_panel_regions_are_widened_and_saved(tmp_path):
+    path = tmp_path / 'genome_index.pkl'
+    index = panel_index(path)
+    index.add_panel_regions([('17', 43044295, 43125483, 'BRCA1'), ('13', 32315508, 32400268, 'BRCA2')])
+    index.add_panel_regions([('17', 43000000, 43100000, 'BRCA1')])
+
+    assert index.gene_region('BRCA1') == ('17', 43000000, 43125483)
+    assert index.gene_region('TP53') is None
+    assert panel_index(path).gene_region(' brca2') == ('13', 32315508, 32400268)
+
+
+def test_panel_regions_from_other_processes_are_kept(tmp_path):
+    path = tmp_path / 'genome_index.pkl'
+    first, second = panel_index(path), panel_index(path)
+    first.add_panel_regions([('17', 43044295, 43125483, 'BRCA1')])
+    second.add_panel_regions([('13', 32315508, 32400268, 'BRCA2'), ('17', 43000000, 43100000, 'BRCA1')])
+
+    index = panel_index(path)
+    assert index.gene_region('BRCA1') == ('17', 43000000, 43125483)
+    assert index.gene_region('BRCA2') == ('13', 32315508, 32400268)
+
+
+def test_parse_region():
+    assert parse_region('chr7:1,000,000-2,000,000') == ('7', 1000000, 2000000)
+    assert parse_region(' X:5-5') == ('X', 5, 5)
+    for region in ('chr7:2000-1000', '7-1000', 'BRCA1'):
+        with pytest.raises(ValueError):
+            parse_region(region)
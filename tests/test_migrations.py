@@ -0,0 +1,72 @@
+import pytest
+
+from data_versions import read_version
+from migrations import MIGRATIONS, ensure_schema, schema_status
+from storage import SQLiteBackend
+
+# patients as database_setup.py created it before the migrations
+LEGACY_PATIENTS_SQL = """
+    CREATE TABLE patients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        report_date TEXT, lab_number TEXT, im_lab_number TEXT, name TEXT, dob TEXT,
+        specimen_collected TEXT, specimen_arrived TEXT, type_of_test TEXT, type_of_findings TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def test_empty_database_gets_every_migration(tmp_path):
+    conn = SQLiteBackend(str(tmp_path / 'patients.db')).connect()
+    try:
+        assert ensure_schema(conn) == [version for version, _, _ in MIGRATIONS]
+        assert schema_status(conn) == (MIGRATIONS[-1][0], MIGRATIONS[-1][0])
+        assert read_version(conn.cursor()) is not None
+        # Already up to date: nothing runs again and the counter keeps its value
+        version = read_version(conn.cursor())
+        assert ensure_schema(conn) == []
+        assert read_version(conn.cursor()) == version
+    finally:
+        conn.close()
+
+
+def test_legacy_patients_table_is_migrated(tmp_path):
+    conn = SQLiteBackend(str(tmp_path / 'patients.db')).connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(LEGACY_PATIENTS_SQL)
+        cursor.execute(
+            "INSERT INTO patients (report_date, lab_number, im_lab_number, dob) VALUES (%s, %s, %s, %s)",
+            ('01/09/2024', ' m24-0001 ', 'im0001', 'see case notes')
+        )
+        conn.commit()
+
+        assert ensure_schema(conn) == [version for version, _, _ in MIGRATIONS]
+
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT lab_key, im_lab_key, patient_key, report_on, born_on FROM patients")
+        row = cursor.fetchone()
+        assert (row['lab_key'], row['im_lab_key'], row['patient_key']) == ('M24-0001', 'IM0001', 'M24-0001|IM0001')
+        assert str(row['report_on']) == '2024-09-01'
+        assert row['born_on'] is None
+        cursor.execute("SELECT column_name, raw_value FROM date_quarantine")
+        assert cursor.fetchall() == [{'column_name': 'dob', 'raw_value': 'see case notes'}]
+    finally:
+        conn.close()
+
+
+def test_duplicate_lab_numbers_stop_the_migrations(tmp_path):
+    conn = SQLiteBackend(str(tmp_path / 'patients.db')).connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(LEGACY_PATIENTS_SQL)
+        for _ in range(2):
+            cursor.execute("INSERT INTO patients (lab_number, im_lab_number) VALUES (%s, %s)", ('M24-0001', 'IM0001'))
+        conn.commit()
+
+        with pytest.raises(Exception, match='appear more than once'):
+            ensure_schema(conn)
+        conn.rollback()
+        # The migrations before the unique key are kept
+        assert schema_status(conn)[0] == 2
+    finally:
+        conn.close()
@@ -0,0 +1,101 @@
+import pytest
+
+from conftest import add_variants, patient
+
+
+def all_pages(query, **kwargs):
+    """Every row of a paged query, following next_cursor, and the number of pages"""
+    rows, pages, cursor = [], 0, None
+    while True:
+        page = query(cursor=cursor, **kwargs)
+        rows.extend(page['data'])
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            return rows, pages
+
+
+@pytest.fixture
+def patients(db):
+    # Repeated and missing names / report dates, so pages split inside runs of equal sort values
+    names = ['Chan', None, 'Chan', 'Wong', None, 'Au', 'Chan']
+    report_dates = ['2024-09-01', None, '2024-09-01', 'results pending', '2024-08-15', None, '2024-10-02']
+    for i, (name, report_date) in enumerate(zip(names, report_dates), start=1):
+        assert db.add_patient(patient(i, name=name, report_date=report_date,
+                                      type_of_test='Trio' if i % 3 == 0 else 'SuperPanel'))
+    return db
+
+
+def test_pages_by_id(patients):
+    first = patients.query_patients(limit=3)
+    assert [row['id'] for row in first['data']] == [1, 2, 3]
+    rows, pages = all_pages(patients.query_patients, limit=3)
+    assert [row['id'] for row in rows] == list(range(1, 8))
+    assert pages == 3
+
+
+def test_last_page_has_no_cursor(patients):
+    assert patients.query_patients(limit=7)['next_cursor'] is None
+    assert patients.query_patients(limit=6)['next_cursor'] is not None
+
+
+@pytest.mark.parametrize('sort', ['name', 'report_date', 'lab_number'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_match_a_single_query(patients, sort, descending):
+    expected = patients.query_patients(sort=sort, descending=descending, limit=100)['data']
+    for limit in (1, 2, 3):
+        rows, _ = all_pages(patients.query_patients, sort=sort, descending=descending, limit=limit)
+        assert rows == expected
+
+
+def test_pages_keep_filters(patients):
+    rows, pages = all_pages(patients.query_patients, filters={'type_of_test': 'SuperPanel'}, limit=2)
+    assert [row['id'] for row in rows] == [1, 2, 4, 5, 7]
+    assert pages == 3
+    rows, _ = all_pages(patients.query_patients, filters={'report_date_from': '2024-09-01'}, sort='report_date',
+                        limit=1)
+    assert [row['id'] for row in rows] == [1, 3, 7]
+
+
+def test_lab_number_filter_is_normalized(patients):
+    assert [row['id'] for row in patients.query_patients(filters={'lab_number': ' m24-0004 '})['data']] == [4]
+
+
+def test_invalid_requests(patients):
+    with pytest.raises(ValueError):
+        patients.query_patients(cursor='not a cursor')
+    with pytest.raises(ValueError):
+        patients.query_patients(sort='hkid')
+    with pytest.raises(ValueError):
+        patients.query_patients(filters={'hkid': 'A123456(7)'})
+
+
+@pytest.fixture
+def variants(db):
+    """Eleven variants on chr 1 and 2, every other one in BRCA1"""
+    positions = [('1', 500), ('2', 100), ('1', 100), ('1', 300), ('1', 300), ('2', 50),
+                 ('1', 300), ('1', 900), ('1', 100), ('2', 75), ('1', 700)]
+    add_variants(db, [(chr, pos, 'BRCA1' if row % 2 == 0 else None) for row, (chr, pos) in enumerate(positions)])
+    return db
+
+
+def test_variant_pages_by_id(variants):
+    rows, pages = all_pages(variants.query_variants, limit=4)
+    assert [row['id'] for row in rows] == list(range(1, 12))
+    assert pages == 3
+    rows, _ = all_pages(variants.query_variants, gene='BRCA1', limit=2)
+    assert [row['id'] for row in rows] == [1, 3, 5, 7, 9, 11]
+
+
+def test_variant_pages_by_position(variants):
+    # Equal positions are split across pages, and ordered by id
+    rows, _ = all_pages(variants.query_variants, chr='chr1', limit=2)
+    assert [(row['pos'], row['id']) for row in rows] == [
+        (100, 3), (100, 9), (300, 4), (300, 5), (300, 7), (500, 1), (700, 11), (900, 8)]
+    rows, _ = all_pages(variants.query_variants, chr='1', start=100, end=500, gene='BRCA1', limit=1)
+    assert [(row['pos'], row['id']) for row in rows] == [(100, 3), (100, 9), (300, 5), (300, 7), (500, 1)]
+
+
+def test_variant_range_needs_chr(variants):
+    with pytest.raises(ValueError):
+        variants.query_variants(start=100)
@@ -0,0 +1,51 @@
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+import reports
+from patient_dates import parse_date, parse_dates
+from patient_index import PatientIndex
+
+SAMPLES = ['2024-09-01', '01/09/2024', ' 1-9-2024 ', '2024/09/01', '01.09.2024', '2024-09-01 00:00:00',
+           '0024-09-01', '31/02/2024', 'results pending', '', None]
+
+
+@pytest.mark.parametrize('value', SAMPLES)
+def test_parse_date_matches_parse_dates(value):
+    assert parse_date(value) == parse_dates(pd.Series([value], dtype=object)).iloc[0]
+
+
+def test_parse_date_of_dates():
+    assert parse_date(datetime(2024, 9, 1, 12, 30)) == date(2024, 9, 1)
+    assert parse_date(pd.Timestamp('2024-09-01')) == date(2024, 9, 1)
+    assert parse_date(float('nan')) is None
+
+
+def test_index_records_carry_parsed_dates():
+    # Like the Excel fallback: text dates only
+    frame = pd.DataFrame([
+        {'lab_number': 'M24-0001', 'report_date': '01/09/2024', 'dob': 'unknown'},
+        {'lab_number': 'M24-0002', 'report_date': pd.Timestamp('2024-08-15')},
+    ])
+    index = PatientIndex(lambda: frame)
+    first = index.lookup('M24-0001')
+    assert (first.report_on, first.born_on, first.arrived_on) == (date(2024, 9, 1), None, None)
+    assert index.lookup('M24-0002').report_on == date(2024, 8, 15)
+
+
+def test_report_data_uses_the_date_columns(monkeypatch):
+    frame = pd.DataFrame([{
+        'lab_number': 'M24-0001', 'report_date': '01/09/2024', 'dob': 'unknown',
+        'report_on': date(2024, 9, 1), 'born_on': None, 'collected_on': None, 'arrived_on': None,
+    }])
+    patient = PatientIndex(lambda: frame).lookup('M24-0001')
+
+    def no_parsing(value):
+        raise AssertionError(f'parsed {value!r} per request')
+
+    monkeypatch.setattr(reports, 'parse_date', no_parsing)
+    data = reports.report_data(patient._asdict())
+    assert data['report_date'] == '2024-09-01'
+    assert data['dob'] == 'unknown'
+    assert data['specimen_collected'] == ''
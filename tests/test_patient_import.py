@@ -0,0 +1,138 @@
+import pandas as pd
+import pytest
+
+from data_versions import read_version
+from patient_import import import_patients, prepare_patients, sync_patients
+
+
+def master_list(*rows):
+    """Master list DataFrame as read with header=1, one dict of sheet columns per row"""
+    columns = ['Singe gene Reported date', 'Lab. no.', 'IM Lab. no.', 'Patient Name', 'HKID', 'DOB', 'Sex/Age',
+               'Ethnicity', 'Sample collection date', 'Sample receive date', 'Case', 'Type of test',
+               'Type of findings']
+    return pd.DataFrame([{column: row.get(column) for column in columns} for row in rows], columns=columns)
+
+
+def sheet_row(i, **columns):
+    row = {
+        'Lab. no.': f'M24-{i:04d}',
+        'IM Lab. no.': f'IM{i:04d}',
+        'Patient Name': f'Patient {i}',
+        'Singe gene Reported date': '01/09/2024',
+        'Sex/Age': 'F/34',
+        'Type of test': 'SuperPanel',
+        'Type of findings': 'Negative',
+    }
+    row.update(columns)
+    return row
+
+
+@pytest.fixture
+def conn(backend):
+    conn = backend.connect()
+    yield conn
+    conn.close()
+
+
+def stored(conn, column='type_of_findings'):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT lab_number, {column} FROM patients ORDER BY id")
+    return cursor.fetchall()
+
+
+def test_prepare_patients():
+    source = master_list(
+        sheet_row(1, **{'Lab. no.': '  M24-0001 ', 'Sex/Age': 'M / 5', 'DOB': 'not known'}),
+        {},
+        sheet_row(2, **{'Lab. no.': None, 'IM Lab. no.': None}),
+        sheet_row(3, **{'Lab. no.': None, 'Sex/Age': 'unknown', 'Singe gene Reported date': 'pending'}),
+    )
+    patients, errors, empty_rows = prepare_patients(source)
+
+    assert empty_rows == 1
+    assert errors == [{'row': 4, 'reason': 'Both Lab No. and IM Lab No. are empty', 'patient': 'Patient 2'}]
+    assert patients['source_row'].tolist() == [2, 5]
+    first, third = patients.to_dict('records')
+    assert (first['lab_number'], first['name'], first['sex'], first['age']) == ('M24-0001', 'Patient 1', 'M', '5')
+    assert str(first['report_on']) == '2024-09-01'
+    assert first['dob'] == 'not known' and first['born_on'] is None
+    assert (third['lab_number'], third['im_lab_number']) == (None, 'IM0003')
+    assert (third['sex'], third['age'], third['report_on']) == (None, None, None)
+    assert first['row_hash'] != third['row_hash']
+
+
+def test_import_in_chunks(conn):
+    patients, _, _ = prepare_patients(master_list(*[sheet_row(i) for i in range(1, 6)]))
+    version = read_version(conn.cursor())
+    progress = []
+
+    imported, errors = import_patients(conn, patients, chunk_size=2,
+                                       progress=lambda done, total, elapsed: progress.append((done, total)))
+
+    assert imported == [2, 3, 4, 5, 6]
+    assert errors == []
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+    assert [lab_number for lab_number, _ in stored(conn)] == [f'M24-{i:04d}' for i in range(1, 6)]
+    # One bump per chunk, so running app processes reload
+    assert read_version(conn.cursor()) == version + 3
+
+
+def test_repeated_lab_numbers_are_reported_as_duplicates(conn):
+    # The same lab numbers twice (ignoring case): the later row is imported, the earlier one reported
+    patients, _, _ = prepare_patients(master_list(
+        sheet_row(1), sheet_row(2), sheet_row(3, **{'Lab. no.': 'm24-0001', 'IM Lab. no.': 'im0001'}), sheet_row(4)
+    ))
+    imported, errors = import_patients(conn, patients, chunk_size=10)
+
+    assert imported == [3, 4, 5]
+    assert [(error['row'], error['lab_no'], error['duplicate_of']) for error in errors] == [(2, 'M24-0001', 4)]
+    assert errors[0]['reason'] == 'Duplicate Lab No. and IM Lab No., row 4 imported instead'
+    assert [lab_number for lab_number, _ in stored(conn)] == ['M24-0002', 'm24-0001', 'M24-0004']
+
+
+def test_failed_chunk_is_retried_row_by_row(conn):
+    import_patients(conn, prepare_patients(master_list(sheet_row(3)))[0])
+    # Patient 3 is already stored, so its row breaks the unique patient key
+    patients, _, _ = prepare_patients(master_list(*[sheet_row(i) for i in range(1, 5)]))
+    imported, errors = import_patients(conn, patients, chunk_size=10)
+
+    assert imported == [2, 3, 5]
+    assert [(error['row'], error['lab_no']) for error in errors] == [(4, 'M24-0003')]
+    assert 'duplicate_of' not in errors[0]
+    assert [lab_number for lab_number, _ in stored(conn)] == ['M24-0003', 'M24-0001', 'M24-0002', 'M24-0004']
+
+
+def test_sync(conn):
+    patients, _, _ = prepare_patients(master_list(*[sheet_row(i) for i in range(1, 5)]))
+    assert sync_patients(conn, patients) == {'inserted': 4, 'updated': 0, 'unchanged': 0, 'errors': []}
+    assert sync_patients(conn, patients) == {'inserted': 0, 'updated': 0, 'unchanged': 4, 'errors': []}
+
+    version = read_version(conn.cursor())
+    # Patient 2 changed, patient 3 left the sheet, patient 5 is new; lab numbers match case-insensitively
+    patients, _, _ = prepare_patients(master_list(
+        sheet_row(1), sheet_row(2, **{'Type of findings': 'Positive', 'Lab. no.': 'm24-0002'}),
+        sheet_row(4), sheet_row(5)
+    ))
+    assert sync_patients(conn, patients) == {'inserted': 1, 'updated': 1, 'unchanged': 2, 'errors': []}
+    assert stored(conn) == [('M24-0001', 'Negative'), ('m24-0002', 'Positive'), ('M24-0003', 'Negative'),
+                            ('M24-0004', 'Negative'), ('M24-0005', 'Negative')]
+    assert read_version(conn.cursor()) > version
+
+
+def test_sync_last_duplicate_wins(conn):
+    patients, _, _ = prepare_patients(master_list(
+        sheet_row(1, **{'Type of findings': 'Negative'}), sheet_row(1, **{'Type of findings': 'Positive'})
+    ))
+    assert sync_patients(conn, patients)['inserted'] == 1
+    assert stored(conn) == [('M24-0001', 'Positive')]
+
+
+def test_sync_reaches_other_processes_caches(db, conn):
+    patients, _, _ = prepare_patients(master_list(sheet_row(1), sheet_row(2)))
+    sync_patients(conn, patients)
+    assert db.get_filter_values()['findings'] == [{'value': 'Negative', 'count': 2}]
+
+    # database_setup.py --sync in another process: this one only sees the change counter move
+    patients, _, _ = prepare_patients(master_list(sheet_row(1), sheet_row(2, **{'Type of findings': 'Positive'})))
+    sync_patients(conn, patients)
+    assert db.get_filter_values()['findings'] == [{'value': 'Negative', 'count': 1}, {'value': 'Positive', 'count': 1}]
@@ -0,0 +1,126 @@
+import os
+import time
+
+import pytest
+
+import reports
+from conftest import patient
+from report_store import ReportStore, report_key
+
+FIELDS = {'lab_number': 'M24-0001', 'name': 'Patient 1', 'findings_summary': 'No variants found'}
+
+
+def test_report_key_depends_on_fields_and_template():
+    key = report_key(FIELDS, 'v1')
+    assert len(key) == 64
+    assert report_key(dict(reversed(list(FIELDS.items()))), 'v1') == key
+    assert report_key({**FIELDS, 'name': 'Patient 2'}, 'v1') != key
+    assert report_key(FIELDS, 'v2') != key
+
+
+def test_store_get_put(tmp_path):
+    store = ReportStore(str(tmp_path))
+    key = report_key(FIELDS, 'v1')
+    assert store.get(key) is None
+    path = store.put(key, b'report')
+    assert store.get(key) == path
+    with open(path, 'rb') as f:
+        assert f.read() == b'report'
+
+
+def test_get_or_create_renders_once(tmp_path):
+    store = ReportStore(str(tmp_path))
+    key = report_key(FIELDS, 'v1')
+    renders = []
+
+    def render():
+        renders.append(key)
+        return b'report'
+
+    assert store.get_or_create(key, render) == store.get_or_create(key, render)
+    assert len(renders) == 1
+
+
+@pytest.mark.parametrize('key', ['', '../patients.db', 'A' * 64, report_key(FIELDS, 'v1') + '.docx'])
+def test_invalid_keys(tmp_path, key):
+    store = ReportStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.get(key)
+    with pytest.raises(ValueError):
+        store.put(key, b'report')
+
+
+def test_evict_keeps_the_newest_under_max_bytes(tmp_path):
+    store = ReportStore(str(tmp_path), max_bytes=10)
+    keys = [report_key(FIELDS, f'v{i}') for i in range(3)]
+    now = time.time()
+    for age, key in zip((300, 200, 100), keys):
+        path = store.put(key, b'12345')
+        os.utime(path, (now - age, now - age))
+    store.put(report_key(FIELDS, 'v3'), b'12345')
+    assert [store.get(key) is not None for key in keys] == [False, False, True]
+
+
+def test_store_report_name_round_trip(tmp_path):
+    store = ReportStore(str(tmp_path))
+    data = reports.report_data(patient(1, lab_number='M24/0001'))
+    filename = reports.store_report(store, data, 'No variants found')
+    key = reports.stored_report_key(filename)
+    assert filename == f'patient_info_M240001_{key}.docx'
+    assert store.get(key) is not None
+    # Same patient and summary: same key, nothing new stored
+    assert reports.store_report(store, data, 'No variants found') == filename
+    assert len(os.listdir(tmp_path)) == 1
+    assert reports.stored_report_key(reports.store_report(store, data, 'BRCA1 variant')) != key
+
+
+@pytest.mark.parametrize('filename', ['patient_info.docx', '../patient_info_M24_x.docx',
+                                      'patient_info_M24_' + 'a' * 63 + '.docx'])
+def test_stored_report_key_rejects_other_names(filename):
+    assert reports.stored_report_key(filename) is None
+
+
+def test_download_etag(app_module):
+    client = app_module.app.test_client()
+    filename = reports.store_report(app_module.report_store, reports.report_data(patient(1)), 'No variants found')
+    key = reports.stored_report_key(filename)
+
+    response = client.get(f'/download/{filename}')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{key}"'
+    assert filename in response.headers['Content-Disposition']
+    assert response.data[:2] == b'PK'
+
+    response = client.get(f'/download/{filename}', headers={'If-None-Match': f'"{key}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    other = report_key(FIELDS, 'v1')
+    assert client.get(f'/download/{filename}', headers={'If-None-Match': f'"{other}"'}).status_code == 200
+
+
+def test_download_unknown_report(app_module):
+    client = app_module.app.test_client()
+    assert client.get(f"/download/patient_info_M24_{report_key(FIELDS, 'missing')}.docx").status_code == 404
+    assert client.get('/download/patients.db').status_code == 404
+
+
+def test_download_from_another_working_directory(app_module, tmp_path, monkeypatch):
+    # A relative REPORT_STORE_DIR is relative to the directory the app was started from
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app_module, 'report_store', ReportStore('report_store'))
+    assert os.path.isabs(app_module.report_store.directory)
+    filename = reports.store_report(app_module.report_store, reports.report_data(patient(1)), 'No variants found')
+    key = reports.stored_report_key(filename)
+
+    client = app_module.app.test_client()
+    response = client.get(f'/download/{filename}')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{key}"'
+    assert client.get(f'/download/{filename}', headers={'If-None-Match': f'"{key}"'}).status_code == 304
+
+
+def test_download_of_an_evicted_report(app_module):
+    filename = reports.store_report(app_module.report_store, reports.report_data(patient(2)), 'No variants found')
+    os.remove(app_module.report_store.path(reports.stored_report_key(filename)))
+    assert app_module.app.test_client().get(f'/download/{filename}').status_code == 404
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+from variant_processing import summarize_variants
+
+
+def variants(*rows):
+    """Reportable variants DataFrame, rows of (comment, genes, classification, zygosity)"""
+    return pd.DataFrame(rows, columns=['Second review and comment on reportable variant', 'Gene Names',
+                                       'Classification', 'Zygosity'])
+
+
+@pytest.mark.parametrize('rows, summary', [
+    ([], ''),
+    ([('Pathogenic', 'BRCA1', None, 'Heterozygous')],
+     'One likely Pathogenic variant was detected in the BRCA1 gene.'),
+    # Padding in the cells doesn't end up in the sentence
+    ([(' Pathogenic  ', ' BRCA1 ', None, None)],
+     'One likely Pathogenic variant was detected in the BRCA1 gene.'),
+    ([('Likely pathogenic', 'MTOR', None, None)],
+     'One Likely pathogenic variant was detected in the MTOR gene.'),
+    ([(None, 'MTOR', None, None)],
+     'One likely variant was detected in the MTOR gene.'),
+    ([('Pathogenic', None, None, None)],
+     'One likely Pathogenic variant was detected.'),
+    ([(None, 'BRCA1', 'Likely  Pathogenic', 'Heterozygous Variant'),
+      (float('nan'), ' BRCA2', 'likely pathogenic ', ' heterozygous')],
+     'Two Likely Pathogenic heterozygous variants were detected in the BRCA1 and BRCA2 genes.'),
+    ([(None, 'BRCA1', 'Pathogenic', ''), (None, 'BRCA1', 'Pathogenic', None),
+      ('VUS', 'ATM', None, 'Homozygous')],
+     'Two likely Pathogenic variants were detected in the BRCA1 gene. '
+     'One likely VUS variant was detected in the ATM gene.'),
+])
+def test_summary_text(rows, summary):
+    assert summarize_variants(variants(*rows)) == summary
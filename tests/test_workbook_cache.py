@@ -0,0 +1,63 @@
+import os
+import time
+
+import pandas as pd
+
+from workbook_cache import WorkbookCache
+
+
+def workbook(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def parsed(path):
+    return pd.DataFrame({'source': [os.path.basename(path)] * 1000})
+
+
+def sidecar(cache, path):
+    return cache._sidecar_path((cache.content_hash(path), ('test',)))
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_content_hashes_are_bounded(tmp_path):
+    cache = WorkbookCache(cache_dir=None, max_hashes=2)
+    first, second, third = (workbook(tmp_path, f'{i}.xlsx', bytes([i])) for i in range(3))
+    cache.content_hash(first)
+    cache.content_hash(second)
+    cache.content_hash(first)
+    cache.content_hash(third)
+    assert [os.path.basename(path) for path, _, _ in cache._hashes] == ['0.xlsx', '2.xlsx']
+
+
+def test_sidecars_over_the_size_limit_are_evicted(tmp_path):
+    oldest, used, new = (workbook(tmp_path, f'{i}.xlsx', bytes([i])) for i in range(3))
+    cache = WorkbookCache(cache_dir=str(tmp_path / 'cache'))
+    cache.get(oldest, ('test',), parsed)
+    cache.get(used, ('test',), parsed)
+    cache.max_disk_bytes = 2 * os.path.getsize(sidecar(cache, oldest))
+    age(sidecar(cache, oldest), 20)
+    age(sidecar(cache, used), 30)
+    # A disk hit in another process counts as a use
+    WorkbookCache(cache_dir=cache.cache_dir).get(used, ('test',), parsed)
+
+    cache.get(new, ('test',), parsed)
+    assert not os.path.exists(sidecar(cache, oldest))
+    assert os.path.exists(sidecar(cache, used))
+    assert os.path.exists(sidecar(cache, new))
+
+
+def test_old_sidecars_are_evicted(tmp_path):
+    old, new = workbook(tmp_path, 'old.xlsx', b'old'), workbook(tmp_path, 'new.xlsx', b'new')
+    cache = WorkbookCache(cache_dir=str(tmp_path / 'cache'), max_age=3600)
+    cache.get(old, ('test',), parsed)
+    age(sidecar(cache, old), 7200)
+
+    cache.get(new, ('test',), parsed)
+    assert not os.path.exists(sidecar(cache, old))
+    assert os.path.exists(sidecar(cache, new))
@@ -0,0 +1,137 @@
+"""
+Column-wise processing of variant sheet DataFrames.
+
+The upload and report paths used to walk every variant with iterrows(),
+which builds a Series per row. The helpers here work on whole columns
+instead: missing values are cleaned per column, DB batches come from
+to_numpy(), chromosome positions are split with one str.extract, and
+findings sentences are concatenated as string Series.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+COMMENT_COLUMN = 'Second review and comment on reportable variant'
+GENE_COLUMN = 'Gene Names'
+CLASSIFICATION_COLUMN = 'Classification'
+ZYGOSITY_COLUMN = 'Zygosity'
+
+# Cell values that mean "no value" in the variant sheets
+MISSING_STRINGS = ['', 'nan', 'NaN']
+
+COUNT_WORDS = ['One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine', 'Ten']
+
+CHR_POS_PATTERN = r'^\s*(?:chr)?([0-9]{1,2}|X|Y|M|MT)\s*:\s*([0-9]+)\s*$'
+
+# Between the symbols of a 'Gene Names' cell
+GENE_SEPARATORS = r'[,;]'
+
+
+def clean_variants(frame):
+    """Copy of frame as object columns, with NaN and blank / 'nan' strings as None"""
+    cleaned = {}
+    for column in frame.columns:
+        values = frame[column].astype(object)
+        missing = values.isna() | values.astype(str).str.strip().isin(MISSING_STRINGS)
+        cleaned[column] = values.where(~missing, None)
+    return pd.DataFrame(cleaned, index=frame.index, columns=frame.columns)
+
+
+def as_text(frame):
+    """Copy of a cleaned frame with every value as a stripped string (None kept)"""
+    text = {}
+    for column in frame.columns:
+        values = frame[column]
+        text[column] = values.astype(str).str.strip().astype(object).where(values.notna(), None)
+    return pd.DataFrame(text, index=frame.index, columns=frame.columns)
+
+
+def insert_rows(frame, columns):
+    """List of value tuples of `columns`, for cursor.executemany()"""
+    return list(map(tuple, frame[columns].to_numpy(dtype=object)))
+
+
+def split_chr_pos(values):
+    """Series of 'chr:pos' strings -> DataFrame of chr (upper case) and pos, NaN where it isn't a position"""
+    parts = values.astype(str).str.extract(CHR_POS_PATTERN, flags=re.IGNORECASE)
+    parts.columns = ['chr', 'pos']
+    parts['chr'] = parts['chr'].str.upper()
+    parts['pos'] = pd.to_numeric(parts['pos'])
+    return parts
+
+
+def split_gene_column(genes):
+    """Series of 'ANGPTL7,MTOR' -> Series of single gene symbols, indexed like the source rows"""
+    symbols = genes.dropna().astype(str).str.split(GENE_SEPARATORS, regex=True).explode().str.strip()
+    symbols = symbols[symbols.notna() & (symbols != '')]
+    # A gene listed twice on one row is stored once
+    return symbols[~symbols.reset_index().duplicated().to_numpy()]
+
+
+def _phrase(values):
+    """Series of cell text, stripped and with runs of whitespace as one space; missing values are ''"""
+    text = values.astype(object).where(values.notna(), '').astype(str)
+    text = text.str.replace(r'\s+', ' ', regex=True).str.strip()
+    return text.where(~text.isin(MISSING_STRINGS), '')
+
+
+def _join_genes(genes):
+    genes = [gene for gene in dict.fromkeys(genes) if gene]
+    if len(genes) < 2:
+        return ''.join(genes)
+    return f"{', '.join(genes[:-1])} and {genes[-1]}"
+
+
+def _count_genes(genes):
+    return genes[genes != ''].nunique()
+
+
+def summarize_variants(variants):
+    """
+    Findings summary for a DataFrame of reportable variants: one sentence
+    per classification and zygosity, in the order they first appear. A
+    single variant keeps the reviewer's comment as its classification.
+    """
+    if variants.empty:
+        return ""
+    comments = _phrase(variants[COMMENT_COLUMN])
+    genes = _phrase(variants[GENE_COLUMN])
+    labels = comments
+    if CLASSIFICATION_COLUMN in variants.columns:
+        classifications = _phrase(variants[CLASSIFICATION_COLUMN])
+        labels = classifications.where(classifications != '', comments)
+    if ZYGOSITY_COLUMN in variants.columns:
+        # 'Homozygous Variant' -> 'homozygous'
+        zygosity = _phrase(variants[ZYGOSITY_COLUMN]).str.replace(r'\s*\bvariants?$', '', case=False, regex=True)
+        zygosity = zygosity.str.lower()
+    else:
+        zygosity = pd.Series('', index=variants.index)
+
+    groups = pd.DataFrame({
+        # 'Likely pathogenic' and 'likely Pathogenic' are one classification
+        'key': labels.str.lower().to_numpy(),
+        'label': labels.to_numpy(),
+        'zygosity': zygosity.to_numpy(),
+        'comment': comments.to_numpy(),
+        'gene': genes.to_numpy(),
+    }).groupby(['key', 'zygosity'], sort=False).agg(
+        count=('gene', 'size'), gene_count=('gene', _count_genes), label=('label', 'first'),
+        comment=('comment', 'first'), genes=('gene', _join_genes)
+    ).reset_index()
+
+    counts = groups['count'].to_numpy()
+    count_words = pd.Series([COUNT_WORDS[count - 1] if count <= len(COUNT_WORDS) else str(count) for count in counts])
+    single_labels = groups['comment'].where(groups['comment'] != '', groups['label'])
+    labels = pd.Series(np.where(counts == 1, single_labels, groups['label']))
+    # No 'likely' in front of a classification that already says it
+    qualifiers = np.where(labels.str.match(r'likely\b', case=False), '', 'likely')
+    zygosity_words = groups['zygosity'].where(counts > 1, '')
+    nouns = np.where(counts == 1, 'variant was', 'variants were')
+    places = np.where(groups['genes'] == '', '',
+                      ' in the ' + groups['genes'] + np.where(groups['gene_count'] > 1, ' genes', ' gene'))
+
+    sentences = count_words + ' ' + qualifiers + ' ' + labels + ' ' + zygosity_words + ' ' + nouns + ' detected' + places
+    # Empty parts leave runs of spaces behind
+    sentences = sentences.str.replace(r'\s+', ' ', regex=True) + '.'
+    return " ".join(sentences)
@@ -0,0 +1,76 @@
+"""
+Streaming reader for SuperPanel / Trio variant workbooks.
+
+pd.read_excel materializes every cell of the 130+ column sheet before we
+throw most of it away. read_variant_rows() walks the sheet with openpyxl in
+read-only mode instead, finds the header row, reads only the requested
+columns and can skip rows without a 'Reportable Variant' as it goes, so
+memory and time scale with the rows we keep.
+"""
+import openpyxl
+import pandas as pd
+
+REPORTABLE_COLUMN = 'Reportable Variant'
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _header_positions(header):
+    """Stripped header name -> first column position (pandas also keeps the first one unsuffixed)"""
+    positions = {}
+    for position, name in enumerate(header):
+        if name is not None:
+            positions.setdefault(str(name).strip(), position)
+    return positions
+
+
+def read_variant_rows(path, columns, reportable_only=False, max_header_rows=10):
+    """
+    Yield one tuple per variant row with the values of `columns` (header
+    names, compared after stripping whitespace). The header row is the first
+    of the top max_header_rows rows that contains 'Reportable Variant'.
+    Raises ValueError if the header or any of the columns can't be found.
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+
+        positions = None
+        header_row = 0
+        for header_row, header in enumerate(sheet.iter_rows(max_row=max_header_rows, values_only=True), start=1):
+            candidate = _header_positions(header)
+            if REPORTABLE_COLUMN in candidate:
+                positions = candidate
+                break
+        if positions is None:
+            raise ValueError(f"Header row with '{REPORTABLE_COLUMN}' not found")
+
+        missing = [column for column in columns if column.strip() not in positions]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+        wanted = [positions[column.strip()] for column in columns]
+        reportable = positions[REPORTABLE_COLUMN]
+        width = max(wanted + [reportable]) + 1
+        # max_col stops openpyxl from building cells right of the last column we need
+        for row in sheet.iter_rows(min_row=header_row + 1, max_col=width, values_only=True):
+            if len(row) < width:
+                row = row + (None,) * (width - len(row))
+            if reportable_only and _is_blank(row[reportable]):
+                continue
+            values = tuple(row[position] for position in wanted)
+            if all(_is_blank(value) for value in values):
+                continue
+            yield values
+    finally:
+        workbook.close()
+
+
+def read_variants(path, columns, reportable_only=False):
+    """read_variant_rows() as a DataFrame with stripped column names"""
+    return pd.DataFrame(
+        list(read_variant_rows(path, columns, reportable_only)),
+        columns=[column.strip() for column in columns]
+    )
@@ -0,0 +1,149 @@
+"""
+Normalized variant store.
+
+The singleton / trio tables keep the spreadsheet headers as column names and
+no lab number. load_variants() also writes each uploaded variant into the
+variants table: tied to its uploaded_files row and the patient's lab number,
+with chromosome and position split into typed columns, and one
+variant_genes row per gene symbol so gene lookups hit an index.
+
+Backfill variants for files uploaded before the table existed with:
+
+    python variant_store.py --backfill
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from data_versions import VARIANTS, bump_version
+from db_utils import normalize_lab_number
+from variant_processing import as_text, clean_variants, insert_rows, split_chr_pos, split_gene_column
+
+logger = logging.getLogger(__name__)
+
+# Sheet header -> variants column
+VARIANT_COLUMNS = {
+    'Reportable Variant': 'reportable',
+    'IGV review ( True / False call)': 'igv_review',
+    'Second review and comment on reportable variant': 'review_comment',
+    'Gene Names': 'gene_names',
+    'HGVS c. (Clinically Relevant)': 'hgvs_c',
+    'HGVS p. (Clinically Relevant)': 'hgvs_p',
+    'Exon Number (Clinically Relevant)': 'exon',
+    'Zygosity': 'zygosity',
+    'Inheritance': 'inheritance',
+    'Classification': 'classification',
+    'OMIM ID': 'omim_id',
+    'RSID': 'rsid',
+    'Title': 'title',
+    'Inherited From': 'inherited_from',
+}
+
+CHR_POS_COLUMN = 'Chr:Pos'
+
+INSERT_COLUMNS = ['upload_id', 'lab_number', 'file_type', 'source_row', 'chr', 'pos'] + list(VARIANT_COLUMNS.values())
+
+INSERT_VARIANT_SQL = f"""
+    INSERT INTO variants ({', '.join(INSERT_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(INSERT_COLUMNS))})
+"""
+
+INSERT_GENE_SQL = """
+    INSERT INTO variant_genes (variant_id, gene)
+    SELECT id, %s FROM variants WHERE upload_id = %s AND source_row = %s
+"""
+
+def proband_lab_number(lab_number):
+    """Upload lab number -> patient lab number; trio uploads (IM673_674_675) belong to the first"""
+    return normalize_lab_number(str(lab_number).split('_')[0])
+
+
+def prepare_variants(frame, upload_id, lab_number, file_type):
+    """
+    Rows for INSERT_VARIANT_SQL from a variant sheet DataFrame (as returned
+    by variant_reader.read_variants). Rows without a chromosome position
+    (notes at the bottom of the sheet) are skipped. Returns (rows, genes)
+    with genes as (gene, upload_id, source_row).
+    """
+    lab_number = proband_lab_number(lab_number)
+    positions = split_chr_pos(frame[CHR_POS_COLUMN]).reset_index(drop=True)
+    values = as_text(clean_variants(frame.reindex(columns=list(VARIANT_COLUMNS)))).reset_index(drop=True)
+    keep = positions['chr'].notna().to_numpy()
+
+    batch = pd.DataFrame({
+        'upload_id': upload_id,
+        'lab_number': lab_number,
+        'file_type': file_type,
+        'source_row': np.arange(1, len(frame) + 1),
+        'chr': positions['chr'],
+        'pos': positions['pos'],
+    })
+    batch = pd.concat([batch, values], axis=1)[keep]
+    rows = [(upload_id, lab_number, file_type, int(source_row), chr, int(pos)) + tuple(rest)
+            for source_row, chr, pos, *rest in insert_rows(batch, ['source_row', 'chr', 'pos'] + list(VARIANT_COLUMNS))]
+
+    symbols = split_gene_column(batch.set_index('source_row')['Gene Names'])
+    genes = [(gene[:64], upload_id, int(source_row)) for source_row, gene in zip(symbols.index, symbols)]
+    return rows, genes
+
+
+def load_variants(cursor, frame, upload_id, lab_number, file_type):
+    """Replace the stored variants of an upload, returns the number of variants stored (caller commits)"""
+    rows, genes = prepare_variants(frame, upload_id, lab_number, file_type)
+    cursor.execute("DELETE FROM variants WHERE upload_id = %s", (upload_id,))
+    if cursor.rowcount > 0:
+        # The genome index still has the old ids
+        bump_version(cursor, VARIANTS)
+    if rows:
+        cursor.executemany(INSERT_VARIANT_SQL, rows)
+    if genes:
+        cursor.executemany(INSERT_GENE_SQL, genes)
+    return len(rows)
+
+
+def backfill(db, upload_folder='uploads'):
+    """Load variants for every uploaded file that has none stored yet"""
+    from variant_reader import read_variants
+
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT u.id, u.lab_number, u.file_type, u.file_name
+            FROM uploaded_files u
+            WHERE NOT EXISTS (SELECT 1 FROM variants v WHERE v.upload_id = u.id)
+        """)
+        uploads = cursor.fetchall()
+        for upload_id, lab_number, file_type, file_name in uploads:
+            path = os.path.join(upload_folder, file_name)
+            if not os.path.exists(path):
+                logger.warning("Skipping upload, file not found", extra={'file_name': file_name, 'folder': upload_folder})
+                continue
+            columns = [CHR_POS_COLUMN] + [column for column in VARIANT_COLUMNS if column != 'Inherited From']
+            if file_type == 'trio':
+                columns.append('Inherited From')
+            try:
+                count = load_variants(cursor, read_variants(path, columns), upload_id, lab_number, file_type)
+                conn.commit()
+                logger.info("Loaded variants", extra={'file_name': file_name, 'count': count})
+            except Exception:
+                conn.rollback()
+                logger.exception("Error loading variants", extra={'file_name': file_name})
+        cursor.close()
+
+
+if __name__ == '__main__':
+    import logs
+    from db_utils import DatabaseManager
+
+    logs.configure(fmt='text')
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backfill', action='store_true', help='load variants of files uploaded before the variants table')
+    parser.add_argument('--uploads', default='uploads', help='folder with the uploaded variant files')
+    args = parser.parse_args()
+    if args.backfill:
+        backfill(DatabaseManager(), args.uploads)
+    else:
+        parser.print_help()
@@ -0,0 +1,153 @@
+"""
+Cache of parsed variant workbooks.
+
+Parsing a SuperPanel/Trio .xlsx with openpyxl takes far longer than anything
+else in report generation, and the same file is read several times per
+patient. WorkbookCache parses each workbook once: results are kept in an
+in-memory LRU bounded by size, and pickled to a sidecar file named after
+the workbook's content hash so other processes and restarts reuse them.
+Like the report store, the sidecar directory is kept under max_disk_bytes
+and sidecars not used for max_age seconds are removed.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import metrics
+from variant_reader import read_variants
+
+logger = logging.getLogger(__name__)
+
+
+class WorkbookCache:
+    def __init__(self, cache_dir='.workbook_cache', max_bytes=256 * 1024 * 1024, max_disk_bytes=1024 * 1024 * 1024,
+                 max_age=30 * 24 * 3600, max_hashes=4096):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.max_hashes = max_hashes
+        self._lock = threading.Lock()
+        self._frames = OrderedDict()    # (content hash, read options) -> (DataFrame, size)
+        self._size = 0
+        self._hashes = OrderedDict()    # (path, mtime_ns, size) -> content hash
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def content_hash(self, path):
+        """SHA-1 of the file, only re-read when its path, mtime or size change"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._hashes:
+                self._hashes.move_to_end(key)
+                return self._hashes[key]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        with self._lock:
+            self._hashes[key] = digest.hexdigest()
+            # Every edit of a workbook adds a key, so old ones are dropped
+            while len(self._hashes) > self.max_hashes:
+                self._hashes.popitem(last=False)
+        return digest.hexdigest()
+
+    def _sidecar_path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.pkl")
+
+    def _remember(self, key, frame):
+        size = int(frame.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._frames:
+                return
+            self._frames[key] = (frame, size)
+            self._size += size
+            while self._size > self.max_bytes and len(self._frames) > 1:
+                _, (_, evicted) = self._frames.popitem(last=False)
+                self._size -= evicted
+
+    def get(self, path, options, loader):
+        """
+        DataFrame produced by loader(path) for this workbook content and
+        options (a hashable description of how it was read). Callers get a
+        copy they are free to modify.
+        """
+        key = (self.content_hash(path), options)
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                metrics.WORKBOOK_CACHE.inc(result='memory')
+                return self._frames[key][0].copy()
+
+        frame = None
+        sidecar = self._sidecar_path(key) if self.cache_dir else None
+        if sidecar and os.path.exists(sidecar):
+            try:
+                frame = pd.read_pickle(sidecar)
+                metrics.WORKBOOK_CACHE.inc(result='disk')
+                # A hit counts as a use for eviction
+                os.utime(sidecar)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.warning("Error reading workbook cache: %s", e, extra={'path': sidecar})
+        if frame is None:
+            metrics.WORKBOOK_CACHE.inc(result='miss')
+            with metrics.EXCEL_SECONDS.time(reader=options[0]):
+                frame = loader(path)
+            if sidecar:
+                # Write then rename so a concurrent reader never sees half a file
+                tmp_path = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+                frame.to_pickle(tmp_path)
+                os.replace(tmp_path, sidecar)
+                self.evict(keep=sidecar)
+
+        self._remember(key, frame)
+        return frame.copy()
+
+    def read_variants(self, path, columns, reportable_only=False):
+        """Cached variant_reader.read_variants()"""
+        options = ('read_variants', tuple(columns), reportable_only)
+        return self.get(path, options, lambda p: read_variants(p, columns, reportable_only))
+
+    def evict(self, keep=None):
+        """Remove sidecars older than max_age, then the least recently used until under max_disk_bytes"""
+        if not self.cache_dir:
+            return
+        with self._lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if not entry.name.endswith('.pkl') or entry.path == keep:
+                    continue
+                stat = entry.stat()
+                if self.max_age and now - stat.st_mtime > self.max_age:
+                    self._remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            if keep and os.path.exists(keep):
+                total += os.path.getsize(keep)
+            for _, size, path in sorted(entries):
+                if total <= self.max_disk_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._size = 0
+            self._hashes.clear()
@@ -0,0 +1,17 @@
+"""
+WSGI entry point for production serving.
+
+    gunicorn -c gunicorn.conf.py wsgi:app               Linux / macOS, WEB_WORKERS processes
+    waitress-serve --threads 8 --port 8000 wsgi:app     Windows, one process
+
+Each worker process imports this module itself, so it gets its own
+connection pool, caches, patient index and job threads, and runs
+patient_info.startup() before it serves requests. Pending migrations are
+applied here unless MIGRATE_ON_START=0; under gunicorn the master process
+applies them once before starting the workers (see gunicorn.conf.py).
+"""
+import os
+
+from patient_info import app, startup
+
+startup(migrate=os.getenv('MIGRATE_ON_START', '1') == '1')